@@ -0,0 +1,281 @@
+'''
+asyncio counterparts of UserAccounts, StatusUpdates and the CSV loaders
+
+The classes take an async database, either from pymongo's
+AsyncMongoClient or memory_store.AsyncMemoryClient, and mirror the
+return values of the blocking API (True/False for writes, the document or
+None for searches). Documents and updates are built by the same documents
+functions, and the same INDEXES are created by init_user_collection and
+init_status_collection. Many operations can then be in flight at once on
+one event loop:
+
+    client = AsyncMongoClient(**connection.client_options())
+    user_collection = await init_user_collection(client.SocialNetwork)
+    found = await asyncio.gather(*(user_collection.search_user(user_id)
+                                   for user_id in user_ids))
+'''
+# pylint: disable=E0401
+
+import asyncio
+import os
+import pandas as pd
+from loguru import logger
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import documents
+import indexes
+import records
+import user_status
+import users
+
+
+class AsyncUserAccounts():
+    """
+    a collection to hold user accounts, with coroutine methods
+    """
+    INDEXES = users.UserAccounts.INDEXES
+
+    def __init__(self, database):
+        self.database = database
+        self.user_collection = database['user_collection']
+        self.status_collection = database['status_collection']
+
+    async def count(self):
+        """
+        Number of user accounts in the collection
+        """
+        return await self.user_collection.count_documents({})
+
+    async def ensure_indexes(self):
+        """
+        Creates or verifies the indexes declared in INDEXES
+        """
+        return await indexes.ensure_indexes_async(self)
+
+    async def add_user(self, user_id, email, user_name, user_last_name):
+        '''
+        Adds a new user to the collection
+        '''
+        new_user = documents.user_document(user_id, email, user_name,
+                                           user_last_name)
+        try:
+            await self.user_collection.insert_one(new_user)
+        except DuplicateKeyError:
+            logger.error(f"Failed to add an existing user {user_id}")
+            return False
+        return True
+
+    async def add_users(self, user_chunk):
+        """
+        Insert a chunk of users to database
+        """
+        try:
+            await self.user_collection.insert_many(user_chunk, ordered=False)
+            return True
+        except BulkWriteError as err:
+            for error in err.details['writeErrors']:
+                logger.error(f"user_id: {error['op']['_id']} failed to add")
+            return False
+
+    async def modify_user(self, user_id, email, user_name, user_last_name):
+        '''
+        Modifies an existing user
+        '''
+        new_values = documents.user_update(email, user_name, user_last_name)
+        try:
+            result = await self.user_collection.update_one({'_id': user_id},
+                                                           new_values)
+        except DuplicateKeyError:
+            logger.error(f"Email {email} belongs to another user. Failed to "
+                         f"update user {user_id}.")
+            return False
+        if result.matched_count:
+            logger.info("User information updated successfully!")
+            return True
+        logger.error("User ID doesn't exist. Failed to update user.")
+        return False
+
+    async def delete_user(self, user_id):
+        '''
+        Deletes an existing user and their statuses
+        '''
+        result = await self.user_collection.delete_one({'_id': user_id})
+        if result.deleted_count:
+            await self.status_collection.delete_many({'user_id': user_id})
+            logger.info(f"User {user_id} was deleted.")
+            return True
+        logger.error("ERROR: User ID doesn't exist. Failed to delete user.")
+        return False
+
+    async def search_user(self, user_id):
+        '''
+        Searches for user data
+        '''
+        user = await self.user_collection.find_one({'_id': user_id})
+        if user is None:
+            logger.error("ERROR: User ID doesn't exist.")
+            return None
+        logger.info(f"User ID {user_id} was found.")
+        return records.user(user)
+
+
+class AsyncStatusUpdates():
+    """
+    Collection of UserStatus messages, with coroutine methods
+    """
+    INDEXES = user_status.StatusUpdates.INDEXES
+
+    def __init__(self, database):
+        self.database = database
+        self.status_collection = database['status_collection']
+        self.user_collection = database['user_collection']
+
+    async def count(self):
+        """
+        Number of status messages in the collection
+        """
+        return await self.status_collection.count_documents({})
+
+    async def ensure_indexes(self):
+        """
+        Creates or verifies the indexes declared in INDEXES
+        """
+        return await indexes.ensure_indexes_async(self)
+
+    async def add_status(self, status_id, user_id, status_text):
+        '''
+        add a new status message to the collection
+        '''
+        if await self.user_collection.find_one({'_id': user_id},
+                                               {'_id': 1}) is None:
+            logger.error(
+                "ERROR: User ID does not exist. Failed to add new status "
+                "for non-existing user ID")
+            return False
+        new_status = documents.status_document(status_id, user_id,
+                                               status_text)
+        try:
+            await self.status_collection.insert_one(new_status)
+        except DuplicateKeyError:
+            logger.error("ERROR: Status ID exists. Failed to add new status")
+            return False
+        logger.info("New status added successfully!")
+        return True
+
+    async def add_statuses(self, status_chunk, rejects=None):
+        '''
+        Insert a chunk of statuses, checking user existence once for the
+        chunk; statuses of non-existing users go to rejects
+        '''
+        user_ids = list({status['user_id'] for status in status_chunk})
+        cursor = self.user_collection.find({'_id': {'$in': user_ids}},
+                                           {'_id': 1})
+        known_users = {user['_id'] async for user in cursor}
+        accepted, rejected = documents.split_known_users(status_chunk,
+                                                         known_users)
+        user_status.StatusUpdates.reject_unknown_users(rejected, rejects)
+        if not accepted:
+            return True
+        try:
+            await self.status_collection.insert_many(accepted, ordered=False)
+        except BulkWriteError:
+            return False
+        return True
+
+    async def modify_status(self, status_id, user_id, status_text):
+        '''
+        Modifies a status message
+        '''
+        new_values = documents.status_update(user_id, status_text)
+        result = await self.status_collection.update_one({'_id': status_id},
+                                                         new_values)
+        if result.matched_count:
+            logger.info("Modified user status successfully!")
+            return True
+        logger.error("ERROR: User status ID doesn't exist. Failed to "
+                     "modify user status")
+        return False
+
+    async def delete_status(self, status_id):
+        '''
+        deletes the status message with id, status_id
+        '''
+        result = await self.status_collection.delete_one({'_id': status_id})
+        if not result.deleted_count:
+            logger.error("ERROR: Status ID doesn't exist. Failed to delete "
+                         "status")
+            return False
+        logger.info(f"User status for {status_id} was deleted")
+        return True
+
+    async def search_status(self, status_id):
+        '''
+        Find and return a status message by its status_id
+        '''
+        status = await self.status_collection.find_one({'_id': status_id})
+        if status is None:
+            logger.error(f"ERROR: Status ID {status_id} does not exist.")
+            return None
+        logger.info(f"Status ID {status_id} was found.")
+        return records.status(status)
+
+
+async def init_user_collection(database):
+    '''
+    An AsyncUserAccounts on database, with its indexes created or verified
+    '''
+    user_collection = AsyncUserAccounts(database)
+    await user_collection.ensure_indexes()
+    return user_collection
+
+
+async def init_status_collection(database):
+    '''
+    An AsyncStatusUpdates on database, with its indexes created or verified
+    '''
+    status_collection = AsyncStatusUpdates(database)
+    await status_collection.ensure_indexes()
+    return status_collection
+
+
+async def _load_chunks(filename, size, concurrency, insert_chunk):
+    '''
+    Reads filename in chunks and keeps up to concurrency chunk inserts
+    in flight; returns True if every insert_chunk call did
+    '''
+    if not os.path.exists(filename):
+        logger.error("Sorry, this file doesn't exist.")
+        return False
+    in_flight = set()
+    results = []
+    for chunk in pd.read_csv(filename, chunksize=size, iterator=True):
+        if len(in_flight) >= concurrency:
+            done, in_flight = await asyncio.wait(
+                in_flight, return_when=asyncio.FIRST_COMPLETED)
+            results.extend(task.result() for task in done)
+        in_flight.add(asyncio.ensure_future(insert_chunk(chunk)))
+    if in_flight:
+        results.extend(await asyncio.gather(*in_flight))
+    return all(results)
+
+
+async def load_users(filename, user_collection, size=1000, concurrency=4):
+    '''
+    Loads a user CSV file into an AsyncUserAccounts, with up to
+    concurrency insert_many calls in flight
+    '''
+    async def insert_chunk(chunk):
+        return await user_collection.add_users(documents.user_documents(chunk))
+    return await _load_chunks(filename, size, concurrency, insert_chunk)
+
+
+async def load_status_updates(filename, status_collection, size=1000,
+                              concurrency=4, rejects=None):
+    '''
+    Loads a status CSV file into an AsyncStatusUpdates, with up to
+    concurrency insert_many calls in flight; statuses of non-existing
+    users go to rejects
+    '''
+    async def insert_chunk(chunk):
+        return await status_collection.add_statuses(
+            documents.status_documents(chunk), rejects)
+    return await _load_chunks(filename, size, concurrency, insert_chunk)
@@ -0,0 +1,150 @@
+'''
+Batch-size autotuning for the chunked and parallel loaders
+
+The best chunk size differs per workload (see results_report.md), so
+instead of a hard-coded size a loader can ask a BatchSizeTuner for the
+size of every next batch and report back how long the batch took:
+
+    tuner = BatchSizeTuner()
+    for chunk in read_chunks(filename, tuner):
+        start = time.perf_counter()
+        insert(chunk)
+        tuner.record(len(chunk), time.perf_counter() - start)
+    tuner.report()      # the chosen size and its docs/sec
+
+The tuner hill-climbs on documents/sec: it measures a few batches at a
+size, moves the size by a factor in the direction that helped, and when
+a move makes throughput worse it turns back with a smaller factor. Once
+the factor is small it settles on the best size seen. Sizes stay within
+[minimum, maximum], and sizes whose batches take longer than max_latency
+seconds are not grown further.
+'''
+# pylint: disable=R0902 # too-many-instance-attributes
+# pylint: disable=R0913 # too-many-arguments
+
+import io
+import math
+import os
+import threading
+import pandas as pd
+import csv_ranges
+
+# Default initial size and bounds of a tuned batch size
+INITIAL_SIZE = 1000
+MIN_SIZE = 100
+MAX_SIZE = 50000
+
+
+class BatchSizeTuner():
+    '''
+    Hill-climbing batch size, safe to record from several threads
+    '''
+    def __init__(self, initial=INITIAL_SIZE, minimum=MIN_SIZE,
+                 maximum=MAX_SIZE, samples=3, max_latency=2.0,
+                 min_factor=1.1):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.samples = samples
+        self.max_latency = max_latency
+        self.min_factor = min_factor
+        self.size = self._clamp(initial)
+        self.factor = 2.0
+        self.direction = 1
+        self.best_size = self.size
+        self.best_rate = None
+        self.converged = False
+        self.batches = 0
+        self.history = []
+        self._measured = [0, 0.0, 0]
+        self._lock = threading.Lock()
+
+    def _clamp(self, size):
+        return max(self.minimum, min(self.maximum, int(size)))
+
+    def record(self, docs, seconds):
+        '''
+        Reports one batch of docs documents that took seconds; batches of
+        another size than the current one (such as the short last chunk,
+        or batches sent before the size changed) are not measured
+        '''
+        with self._lock:
+            self.batches += 1
+            if self.converged or docs != self.size:
+                return
+            measured = self._measured
+            measured[0] += docs
+            measured[1] += seconds
+            measured[2] += 1
+            if measured[2] < self.samples:
+                return
+            rate = measured[0] / measured[1] if measured[1] else math.inf
+            latency = measured[1] / measured[2]
+            self.history.append({'size': self.size, 'docs_per_second': rate,
+                                 'latency': latency})
+            self._measured = [0, 0.0, 0]
+            self._step(rate, latency)
+
+    def _step(self, rate, latency):
+        if self.best_rate is None or rate > self.best_rate:
+            self.best_size, self.best_rate = self.size, rate
+        else:
+            self.direction = -self.direction
+            self.factor = math.sqrt(self.factor)
+        if latency > self.max_latency:
+            self.direction = -1
+        while self.factor >= self.min_factor:
+            size = self._clamp(self.best_size * self.factor ** self.direction)
+            if size != self.best_size:
+                self.size = size
+                return
+            self.direction = -self.direction
+            self.factor = math.sqrt(self.factor)
+        self.size = self.best_size
+        self.converged = True
+
+    def report(self):
+        '''
+        The chosen size, its documents/sec and how the tuner got there
+        '''
+        with self._lock:
+            return {'size': self.best_size,
+                    'docs_per_second': self.best_rate or 0.0,
+                    'converged': self.converged,
+                    'batches': self.batches,
+                    'history': list(self.history)}
+
+
+def batch_size(size):
+    '''
+    The size of the next batch, for a fixed size or a BatchSizeTuner
+    '''
+    return size.size if isinstance(size, BatchSizeTuner) else size
+
+
+def read_chunks(filename, size, skip=0):
+    '''
+    Yields DataFrame chunks of filename; size is a fixed number of rows
+    or a BatchSizeTuner asked for the size of every next chunk
+
+    The first skip data rows are not parsed: reading starts at their byte
+    offset (see csv_ranges.record_offset).
+    '''
+    if not skip:
+        yield from _read_chunks(filename, size)
+        return
+    header, offset = csv_ranges.record_offset(filename, skip)
+    if offset >= os.path.getsize(filename):
+        return
+    columns = list(pd.read_csv(io.BytesIO(header), nrows=0).columns)
+    with open(filename, 'rb') as file:
+        file.seek(offset)
+        yield from _read_chunks(file, size, names=columns, header=None)
+
+
+def _read_chunks(source, size, **options):
+    with pd.read_csv(source, iterator=True, **options) as reader:
+        while True:
+            try:
+                yield reader.get_chunk(batch_size(size))
+            except StopIteration:
+                return
@@ -0,0 +1,146 @@
+'''
+Benchmark of the blocking API against the asyncio API under concurrency
+
+Runs the same number of search_user lookups at 1, 10, 100 and 1000
+concurrent requests. The blocking API gets one thread per in-flight
+request (how it is served today); the async API runs every request on a
+single event loop.
+
+    python bench_async.py --backend mongo     # server from social_network.ini
+    python bench_async.py --backend memory --latency-ms 1
+
+The memory backend is the in-process stand-in; --latency-ms adds a
+simulated network round trip to every command so that waiting, not
+Python overhead, dominates as it does against a real server.
+'''
+# pylint: disable=E0401
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from loguru import logger
+from pymongo import AsyncMongoClient
+import async_collections
+import connection
+import documents
+import memory_store
+import users
+
+CONCURRENCY_LEVELS = (1, 10, 100, 1000)
+
+
+class SlowCollection():
+    '''
+    Adds a fixed delay to every call of a blocking collection
+    '''
+    def __init__(self, collection, latency):
+        self.collection = collection
+        self.latency = latency
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        def call(*args, **kwargs):
+            time.sleep(self.latency)
+            return method(*args, **kwargs)
+        return call
+
+
+class AsyncSlowCollection():
+    '''
+    Adds a fixed non-blocking delay to every call of an async collection
+    '''
+    def __init__(self, collection, latency):
+        self.collection = collection
+        self.latency = latency
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(self.latency)
+            return await method(*args, **kwargs)
+        return call
+
+
+def run_sync(user_collection, user_ids, concurrency):
+    '''
+    Lookups per second with one thread per in-flight request
+    '''
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(user_collection.search_user, user_ids))
+    return len(user_ids) / (time.perf_counter() - start)
+
+
+async def run_async(user_collection, user_ids, concurrency):
+    '''
+    Lookups per second with up to concurrency requests on one event loop
+    '''
+    limit = asyncio.Semaphore(concurrency)
+
+    async def lookup(user_id):
+        async with limit:
+            return await user_collection.search_user(user_id)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(lookup(user_id) for user_id in user_ids))
+    return len(user_ids) / (time.perf_counter() - start)
+
+
+def build_collections(backend, latency):
+    '''
+    Returns (sync UserAccounts, async AsyncUserAccounts, async client)
+    over the same data, loaded from accounts.csv
+    '''
+    if backend == 'memory':
+        client = memory_store.MemoryClient()
+        async_client = memory_store.AsyncMemoryClient(client)
+    else:
+        client = connection.get_client()
+        client.drop_database('bench_async')
+        async_client = AsyncMongoClient(**connection.client_options())
+    sync_users = users.UserAccounts(client.bench_async)
+    sync_users.add_users(documents.user_documents(pd.read_csv('accounts.csv')))
+    async_users = async_collections.AsyncUserAccounts(async_client.bench_async)
+    if latency:
+        sync_users.user_collection = SlowCollection(
+            sync_users.user_collection, latency)
+        async_users.user_collection = AsyncSlowCollection(
+            async_users.user_collection, latency)
+    return sync_users, async_users, async_client
+
+
+def main(backend, requests, latency):
+    '''
+    Prints lookups/sec of both APIs at every concurrency level
+    '''
+    logger.remove()
+    user_ids = pd.read_csv('accounts.csv')['USER_ID'].tolist()
+    user_ids = (user_ids * (requests // len(user_ids) + 1))[:requests]
+
+    async def measure():
+        sync_users, async_users, async_client = build_collections(backend,
+                                                                  latency)
+        print(f"{backend} backend, {requests} lookups, "
+              f"{latency * 1000:g} ms added latency")
+        print(f"{'concurrency':>12} {'sync/sec':>12} {'async/sec':>12}")
+        for concurrency in CONCURRENCY_LEVELS:
+            sync_rate = run_sync(sync_users, user_ids, concurrency)
+            async_rate = await run_async(async_users, user_ids, concurrency)
+            print(f"{concurrency:>12} {sync_rate:>12,.0f} {async_rate:>12,.0f}")
+        await async_client.close()
+
+    asyncio.run(measure())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--backend', choices=('mongo', 'memory'),
+                        default='mongo')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    args = parser.parse_args()
+    main(args.backend, args.requests, args.latency_ms / 1000)
@@ -0,0 +1,291 @@
+'''
+Reproducible benchmark of the loader strategies in main
+
+Sweeps every loader (row by row, chunked, multiprocess, byte range and
+pipeline) over chunk sizes, including the autotuned size ('auto'), and
+worker counts. Each configuration is run
+--repeat times on a freshly dropped database, and the median rows/sec and
+spread are reported. Status loads get their users loaded (untimed) first.
+
+    python bench_loaders.py run --status-file status_updates.csv \
+        --output bench_results.json --report results_report.md
+    python bench_loaders.py compare old.json new.json --threshold 0.1
+
+run writes the raw runs to JSON and regenerates the markdown report.
+compare prints the change of every median between two JSON files and
+exits with status 1 if any configuration slowed down by more than the
+threshold (a fraction of the old median).
+
+The process-pool loaders cannot share the in-process store, so they are
+skipped with --backend memory.
+'''
+# pylint: disable=E0401
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import time
+import pandas as pd
+import pymongo
+from loguru import logger
+import connection
+import documents
+import main
+
+DATABASE = 'bench_loaders'
+CHUNK_SIZES = (100, 1000, 10000)
+
+
+def _workers(count):
+    return sorted({1, 2, count} if count > 1 else {1})
+
+
+# Strategies whose workers are processes, which the memory backend cannot
+# share its store with
+PROCESS_STRATEGIES = {'multiprocess', 'ranges'}
+
+# (strategy, dataset, loader(filename, database, size, workers), sized,
+# parallel); a loader that does not take a size or workers is run once per
+# sweep with None in their place
+STRATEGIES = [
+    ('row_by_row', 'users',
+     lambda filename, database, size, workers: main.load_users(
+         filename, main.init_user_collection(database)), False, False),
+    ('chunked', 'users',
+     lambda filename, database, size, workers: main.load_users_chunks(
+         filename, main.init_user_collection(database), size=size),
+     True, False),
+    ('multiprocess', 'users',
+     lambda filename, database, size, workers: main.load_users_multiprocess(
+         filename, size, workers, database.name), True, True),
+    ('ranges', 'users',
+     lambda filename, database, size, workers: main.load_users_ranges(
+         filename, size, workers, database.name), True, True),
+    ('pipeline', 'users',
+     lambda filename, database, size, workers: main.load_users_pipeline(
+         filename, main.init_user_collection(database), size,
+         writers=workers), True, True),
+    ('row_by_row', 'status',
+     lambda filename, database, size, workers: main.load_status_updates(
+         filename, main.init_status_collection(database)), False, False),
+    ('chunked', 'status',
+     lambda filename, database, size, workers:
+     main.load_status_updates_chunks(
+         filename, main.init_status_collection(database), size=size),
+     True, False),
+    ('multiprocess', 'status',
+     lambda filename, database, size, workers: main.load_status_multiprocess(
+         filename, size, workers, database.name), True, True),
+    ('ranges', 'status',
+     lambda filename, database, size, workers: main.load_status_ranges(
+         filename, size, workers, database.name), True, True),
+    ('pipeline', 'status',
+     lambda filename, database, size, workers: main.load_status_pipeline(
+         filename, main.init_status_collection(database), size,
+         writers=workers), True, True),
+]
+
+
+def count_rows(filename):
+    '''
+    Number of data rows in a CSV file
+    '''
+    return sum(len(chunk) for chunk in pd.read_csv(filename, chunksize=100000,
+                                                   iterator=True))
+
+
+def fresh_database(users_file=None):
+    '''
+    Drops the benchmark database and, for status loads, reloads the users
+    '''
+    connection.get_client().drop_database(DATABASE)
+    database = connection.get_database(DATABASE)
+    if users_file is not None:
+        user_collection = main.init_user_collection(database)
+        for chunk in pd.read_csv(users_file, chunksize=10000, iterator=True):
+            user_collection.add_users(documents.user_documents(chunk))
+    return database
+
+
+def configurations(backend, sizes, workers):
+    '''
+    Yields (strategy, dataset, loader, size, workers) for the sweep
+    '''
+    for strategy, dataset, loader, sized, parallel in STRATEGIES:
+        if strategy in PROCESS_STRATEGIES and backend == 'memory':
+            continue
+        for size in (*sizes, 'auto') if sized else (None, ):
+            for count in workers if parallel else (None, ):
+                yield strategy, dataset, loader, size, count
+
+
+def summarize(rates):
+    '''
+    Median rows/sec and the spread of the runs around it
+    '''
+    median = statistics.median(rates)
+    return {'median': median,
+            'min': min(rates),
+            'max': max(rates),
+            'spread': (max(rates) - min(rates)) / median if median else 0.0}
+
+
+def run(args):
+    '''
+    Runs the sweep; returns the results document
+    '''
+    files = {'users': args.users_file, 'status': args.status_file}
+    rows = {dataset: count_rows(filename)
+            for dataset, filename in files.items()
+            if filename and os.path.exists(filename)}
+    results = []
+    for strategy, dataset, loader, size, workers in configurations(
+            args.backend, args.sizes, args.workers):
+        if dataset not in rows:
+            continue
+        rates = []
+        for _ in range(args.repeat):
+            database = fresh_database(args.users_file if dataset == 'status'
+                                      else None)
+            start = time.perf_counter()
+            loader(files[dataset], database, None if size == 'auto' else size,
+                   workers)
+            rates.append(rows[dataset] / (time.perf_counter() - start))
+        result = {'strategy': strategy, 'dataset': dataset, 'size': size,
+                  'workers': workers, 'rows': rows[dataset],
+                  'rows_per_second': rates, **summarize(rates)}
+        results.append(result)
+        print(f"{dataset:>6} {strategy:>12} size={size} workers={workers}: "
+              f"{result['median']:,.0f} rows/sec "
+              f"(spread {result['spread']:.0%})", file=sys.stderr)
+    connection.get_client().drop_database(DATABASE)
+    return {'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'environment': {'backend': args.backend,
+                            'cpu_count': multiprocessing.cpu_count(),
+                            'python': platform.python_version(),
+                            'pandas': pd.__version__,
+                            'pymongo': pymongo.__version__,
+                            'platform': platform.platform()},
+            'repeat': args.repeat,
+            'files': files,
+            'results': results}
+
+
+def _key(result):
+    return (result['dataset'], result['strategy'], result['size'],
+            result['workers'])
+
+
+def _label(value):
+    return '-' if value is None else str(value)
+
+
+def markdown_report(bench):
+    '''
+    The results document as results_report.md
+    '''
+    environment = bench['environment']
+    lines = ['# Results Report',
+             f"Generated by bench_loaders.py on {bench['created']}: "
+             f"{environment['backend']} backend, "
+             f"{environment['cpu_count']} logical cores, "
+             f"Python {environment['python']}, "
+             f"pandas {environment['pandas']}, "
+             f"pymongo {environment['pymongo']}. Each configuration ran "
+             f"{bench['repeat']} times on a freshly dropped database; spread "
+             f"is (max - min) / median.",
+             '']
+    titles = {'users': 'Load users', 'status': 'Load status updates'}
+    for dataset, title in titles.items():
+        results = [result for result in bench['results']
+                   if result['dataset'] == dataset]
+        if not results:
+            continue
+        lines += [f"## {title} ({results[0]['rows']} rows)",
+                  '',
+                  '| strategy | chunk size | workers | median rows/sec '
+                  '| min | max | spread |',
+                  '|---|---:|---:|---:|---:|---:|---:|']
+        for result in results:
+            lines.append(f"| {result['strategy']} | {_label(result['size'])} "
+                         f"| {_label(result['workers'])} "
+                         f"| {result['median']:,.0f} | {result['min']:,.0f} "
+                         f"| {result['max']:,.0f} | {result['spread']:.0%} |")
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def compare(old, new, threshold):
+    '''
+    Returns (lines, regressions) comparing the medians of two results
+    documents; a regression is a drop of more than threshold
+    '''
+    old_results = {_key(result): result for result in old['results']}
+    lines = []
+    regressions = 0
+    for result in new['results']:
+        before = old_results.get(_key(result))
+        if before is None or not before['median']:
+            continue
+        change = result['median'] / before['median'] - 1
+        flag = ''
+        if change < -threshold:
+            regressions += 1
+            flag = '  REGRESSION'
+        dataset, strategy, size, workers = _key(result)
+        lines.append(f"{dataset:>6} {strategy:>12} {_label(size):>6} "
+                     f"{_label(workers):>3} {before['median']:>12,.0f} "
+                     f"{result['median']:>12,.0f} {change:>+8.1%}{flag}")
+    return lines, regressions
+
+
+def main_cli():
+    '''
+    Parses the command line and runs the chosen mode
+    '''
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    modes = parser.add_subparsers(dest='mode', required=True)
+    sweep = modes.add_parser('run', help='run the sweep')
+    sweep.add_argument('--backend', choices=('mongo', 'memory'),
+                       default='mongo')
+    sweep.add_argument('--users-file', default='accounts.csv')
+    sweep.add_argument('--status-file', default='status_updates.csv')
+    sweep.add_argument('--sizes', type=int, nargs='+', default=CHUNK_SIZES)
+    sweep.add_argument('--workers', type=int, nargs='+',
+                       default=_workers(multiprocessing.cpu_count()))
+    sweep.add_argument('--repeat', type=int, default=5)
+    sweep.add_argument('--output', default='bench_results.json')
+    sweep.add_argument('--report', default='results_report.md')
+    check = modes.add_parser('compare', help='flag regressions')
+    check.add_argument('old')
+    check.add_argument('new')
+    check.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.mode == 'run':
+        os.environ['SOCIAL_NETWORK_MONGODB_BACKEND'] = args.backend
+        logger.remove()
+        bench = run(args)
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(bench, file, indent=2)
+        with open(args.report, 'w', encoding='utf-8') as file:
+            file.write(markdown_report(bench))
+        return 0
+    with open(args.old, 'r', encoding='utf-8') as file:
+        old = json.load(file)
+    with open(args.new, 'r', encoding='utf-8') as file:
+        new = json.load(file)
+    lines, regressions = compare(old, new, args.threshold)
+    print(f"{'data':>6} {'strategy':>12} {'size':>6} {'wrk':>3} "
+          f"{'old rows/s':>12} {'new rows/s':>12} {'change':>8}")
+    print('\n'.join(lines))
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
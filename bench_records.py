@@ -0,0 +1,85 @@
+'''
+Memory benchmark of scanning statuses as dicts, records or raw BSON
+
+Decodes a synthetic status collection (generate_data rows) from BSON in
+cursor-sized batches, the way pymongo decodes each reply, and keeps every
+result, as a scan that collects what it reads does. Reports the memory
+held per status and the decode rate for:
+
+    dict     pymongo's default document class
+    record   records.UserStatus built from the decoded dict
+    raw      bson.raw_bson.RawBSONDocument (records.RAW_CODEC_OPTIONS)
+
+    python bench_records.py [--statuses 1000000] [--batch-size 1000]
+'''
+# pylint: disable=E0401
+
+import argparse
+import gc
+import itertools
+import time
+import tracemalloc
+import bson
+import documents
+import generate_data
+import records
+
+MODES = {
+    'dict': bson.decode_all,
+    'record': lambda data: [records.UserStatus.from_document(document)
+                            for document in bson.decode_all(data)],
+    'raw': lambda data: bson.decode_all(data, records.RAW_CODEC_OPTIONS),
+}
+
+
+def encoded_batches(statuses, batch_size, seed=0):
+    '''
+    The statuses as concatenated BSON documents, batch_size per batch
+    '''
+    rows = generate_data.status_rows(seed, statuses,
+                                     max(1, statuses // 10))
+    fields = list(documents.STATUS_FIELDS.values())
+    return [b''.join(bson.encode(dict(zip(fields, row))) for row in batch)
+            for batch in iter(lambda: list(itertools.islice(rows,
+                                                            batch_size)),
+                              [])]
+
+
+def measure(decode, batches):
+    '''
+    (bytes held per status, statuses decoded per second) of one mode
+    '''
+    start = time.perf_counter()
+    held = [decode(batch) for batch in batches]
+    elapsed = time.perf_counter() - start
+    count = sum(len(batch) for batch in held)
+    del held
+    gc.collect()
+    tracemalloc.start()
+    held = [decode(batch) for batch in batches]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    return size / count, count / elapsed
+
+
+def run(statuses, batch_size):
+    '''
+    Measures every mode and prints a small table
+    '''
+    batches = encoded_batches(statuses, batch_size)
+    size = sum(len(batch) for batch in batches)
+    print(f"{statuses:,} statuses, {size / statuses:.0f} BSON bytes each, "
+          f"batches of {batch_size}")
+    print(f"{'mode':<8} {'bytes/status':>13} {'statuses/sec':>13}")
+    for name, decode in MODES.items():
+        per_status, rate = measure(decode, batches)
+        print(f"{name:<8} {per_status:>13.0f} {rate:>13,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--statuses', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    run(args.statuses, args.batch_size)
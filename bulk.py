@@ -0,0 +1,97 @@
+'''
+Unordered bulk updates and deletes with one result per request
+
+A collection's bulk_write reports a write error per failed request, but
+only totals (nMatched, nRemoved) for the others, so the per-request
+result is derived from both:
+
+- update() sends every update in one bulk_write. A request with a write
+  error (e.g. a duplicate email) failed. When nMatched accounts for all
+  the other requests, the usual case, they all matched. Otherwise they
+  are re-sent one update_one at a time, whose matched_count says which
+  document exists; a $set that already matched is idempotent, so
+  applying it again changes nothing.
+- delete() reads which _ids exist with one $in projection and deletes
+  only those. nRemoved then confirms that this call removed every one of
+  them; a shortfall means another client deleted some in between, and is
+  logged.
+
+    bulk.update(collection, [({'_id': 'ckayx15'}, {'$set': {...}}), ...])
+    [True, False, ...]
+'''
+# pylint: disable=E0401
+
+from loguru import logger
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+
+def _bulk_write(collection, requests):
+    '''
+    Unordered bulk_write of requests; returns (totals, indexes of the
+    requests with a write error), the totals as in BulkWriteError.details
+    '''
+    try:
+        return collection.bulk_write(requests, ordered=False).bulk_api_result, \
+            set()
+    except BulkWriteError as err:
+        failed = {error['index'] for error in err.details['writeErrors']}
+        for error in err.details['writeErrors']:
+            logger.error(f"{requests[error['index']]} failed: "
+                         f"{error.get('errmsg', error['code'])}")
+        return err.details, failed
+
+
+def update(collection, changes):
+    '''
+    Applies (query, update) changes with one unordered bulk_write; returns
+    a list of True/False aligned with changes, False for a change that
+    matched no document or was rejected
+    '''
+    if not changes:
+        return []
+    totals, failed = _bulk_write(collection, [UpdateOne(query, change)
+                                              for query, change in changes])
+    pending = [index for index in range(len(changes)) if index not in failed]
+    if totals['nMatched'] >= len(pending):
+        matched = set(pending)
+    else:
+        matched = {index for index in pending
+                   if _update_one(collection, *changes[index])}
+    return [index in matched for index in range(len(changes))]
+
+
+def _update_one(collection, query, change):
+    '''
+    True if update_one matched a document
+    '''
+    try:
+        return bool(collection.update_one(query, change).matched_count)
+    except DuplicateKeyError as err:
+        logger.error(f"Update of {query} failed: {err}")
+        return False
+
+
+def delete(collection, ids):
+    '''
+    Deletes the documents with the given _ids with one unordered
+    bulk_write; returns a list of True/False aligned with ids, False for
+    an _id that does not exist or repeats an earlier one, so the Trues
+    add up to the documents deleted
+    '''
+    unique = list(dict.fromkeys(ids))
+    existing = {document['_id'] for document in collection.find(
+        {'_id': {'$in': unique}}, {'_id': 1})}
+    if existing:
+        totals, _ = _bulk_write(collection, [DeleteOne({'_id': doc_id})
+                                             for doc_id in existing])
+        if totals['nRemoved'] < len(existing):
+            logger.warning(f"{len(existing) - totals['nRemoved']} of "
+                           f"{len(existing)} documents of {collection.name} "
+                           f"were deleted by another client meanwhile")
+    first = set()
+    results = []
+    for doc_id in ids:
+        results.append(doc_id in existing and doc_id not in first)
+        first.add(doc_id)
+    return results
@@ -0,0 +1,118 @@
+'''
+In-process read-through cache for user and status lookups
+
+One LRUCache can be shared by a UserAccounts and a StatusUpdates
+instance; keys are namespaced as ('user', user_id) and
+('status', status_id). Misses are cached too (as None) so repeated
+lookups of a missing ID do not hit the database either. The collection
+classes invalidate the affected keys on every write they perform.
+
+A read that misses takes version() before it queries the database and
+passes it to put(). Every invalidation bumps the version, so a put whose
+read raced a write (and its invalidation) is dropped instead of caching
+what the database held before the write:
+
+    version = lru.version()
+    user = collection.find_one({'_id': user_id})
+    lru.put(('user', user_id), user, version)
+'''
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache():
+    '''
+    Size- and TTL-bounded least-recently-used cache with hit/miss counters
+    '''
+    def __init__(self, maxsize=10000, ttl=60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        '''
+        Returns (found, value); value is None for a cached miss
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def version(self):
+        '''
+        The invalidation count, to pass to put() for a value read after
+        this call
+        '''
+        with self._lock:
+            return self._version
+
+    def put(self, key, value, version=None):
+        '''
+        Stores value (None records a miss) and evicts the least recently
+        used entry when the cache is full; with a version from version(),
+        nothing is stored if anything was invalidated since
+        '''
+        with self._lock:
+            if version is not None and version != self._version:
+                return
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        '''
+        Invalidates one key
+        '''
+        with self._lock:
+            self._version += 1
+            self._entries.pop(key, None)
+
+    def discard_where(self, predicate):
+        '''
+        Invalidates every entry for which predicate(key, value) is true
+        '''
+        with self._lock:
+            self._version += 1
+            stale = [key for key, (_, value) in self._entries.items()
+                     if predicate(key, value)]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        '''
+        Invalidates everything
+        '''
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def stats(self):
+        '''
+        Counters as a dict
+        '''
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,140 @@
+'''
+Sidecar checkpoints that make bulk loads resumable
+
+A loader calls commit(start, end, rows, inserted) after each batch is
+written, where start..end is the batch's position in the input: data row
+numbers for the CSV-reading loaders, byte offsets for the byte-range
+loaders. The checkpoint is rewritten atomically next to the input file,
+e.g. status_updates.csv.checkpoint.json:
+
+    {"loader": "load_status_multiprocess", "unit": "rows",
+     "source": {"size": 10485760, "mtime": 1760000000.0},
+     "done": [[0, 42000], [43000, 45000]], "rows": 44000,
+     "inserted": 43990}
+
+done holds the merged committed intervals (the parallel loaders commit
+batches out of order); rows and inserted count every run, run_rows only
+this one. With resume=True a loader skips every batch that
+lies inside a committed interval, so recovering from a crash costs only
+the remaining rows; the rows of the first interval (see resume_row) are
+not even read again. A checkpoint is ignored if the input file changed,
+and it is removed once the load completes.
+'''
+
+import bisect
+import json
+import os
+import threading
+from loguru import logger
+from pymongo.errors import BulkWriteError
+
+DUPLICATE_KEY = 11000
+
+
+class Checkpoint():
+    '''
+    Committed-interval record of one loader run over one input file
+    '''
+    def __init__(self, filename, loader, resume=False, unit='rows',
+                 path=None):
+        self.filename = filename
+        self.loader = loader
+        self.unit = unit
+        self.path = path or f"{filename}.checkpoint.json"
+        self.done = []
+        self.rows = 0
+        self.inserted = 0
+        self.run_rows = 0
+        self.resumed = False
+        self._lock = threading.Lock()
+        if resume:
+            self._restore()
+
+    def _source(self):
+        stat = os.stat(self.filename)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def _restore(self):
+        '''
+        Loads the sidecar if it belongs to this file and loader
+        '''
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as file:
+            state = json.load(file)
+        if (state.get('loader'), state.get('unit'), state.get('source')) \
+                != (self.loader, self.unit, self._source()):
+            logger.warning(f"Ignoring checkpoint {self.path}: it belongs to "
+                           f"another loader or the file changed")
+            return
+        self.done = [tuple(interval) for interval in state['done']]
+        self.rows = state['rows']
+        self.inserted = state['inserted']
+        self.resumed = True
+        logger.info(f"Resuming {self.loader} on {self.filename} after "
+                    f"{self.rows} committed rows")
+
+    def is_done(self, start, end):
+        '''
+        True if start..end lies inside a committed interval
+        '''
+        position = bisect.bisect_right(self.done, (start, float('inf'))) - 1
+        return position >= 0 and self.done[position][1] >= end
+
+    def resume_row(self):
+        '''
+        End of the committed interval that starts the input (0 if there is
+        none), where a resumed reader can seek to
+        '''
+        return self.done[0][1] if self.done and self.done[0][0] == 0 else 0
+
+    def commit(self, start, end, rows, inserted):
+        '''
+        Records start..end as written (rows read, documents inserted) and
+        saves the sidecar
+        '''
+        with self._lock:
+            bisect.insort(self.done, (start, end))
+            merged = []
+            for interval in self.done:
+                if merged and interval[0] <= merged[-1][1]:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1],
+                                                     interval[1]))
+                else:
+                    merged.append(interval)
+            self.done = merged
+            self.rows += rows
+            self.run_rows += rows
+            self.inserted += inserted
+            self._save()
+
+    def _save(self):
+        state = {'loader': self.loader,
+                 'unit': self.unit,
+                 'source': self._source(),
+                 'done': self.done,
+                 'rows': self.rows,
+                 'inserted': self.inserted}
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(state, file)
+        os.replace(temporary, self.path)
+
+    def complete(self):
+        '''
+        The load finished: removes the sidecar
+        '''
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def duplicates_only(err):
+    '''
+    True if a BulkWriteError only reports duplicate keys, as happens when
+    a resumed load rewrites a batch that was partly written before the
+    interruption
+    '''
+    return isinstance(err, BulkWriteError) and all(
+        error['code'] == DUPLICATE_KEY
+        for error in err.details['writeErrors'])
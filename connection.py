@@ -0,0 +1,159 @@
+'''
+One pooled database client per process, configured in one place
+
+Every entry point (main, menu, the loader workers, users.start_mongo and
+user_status.start_mongo) gets its client from get_client instead of
+building a MongoClient of its own. The client is created on first use and
+then reused for the life of the process; after a fork the child drops the
+inherited client and builds its own, as pymongo requires.
+
+Settings come from the [mongodb] section of social_network.ini (or the
+file named by $SOCIAL_NETWORK_CONFIG), and each key can be overridden by
+an environment variable, e.g. SOCIAL_NETWORK_MONGODB_HOST=db.internal.
+The file is parsed once per process; the environment is read on every
+call.
+backend = memory swaps in the in-process memory_store engine, and
+profile = true registers the command profiler (see profiler) on the
+client.
+'''
+# pylint: disable=E0401
+
+import configparser
+import os
+from pymongo import MongoClient
+import memory_store
+import profiler
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'social_network.ini')
+
+DEFAULTS = {'backend': 'mongo',
+            'host': '127.0.0.1',
+            'port': '27017',
+            'database': 'SocialNetwork',
+            'max_pool_size': '100',
+            'min_pool_size': '0',
+            'compressors': '',
+            'connect_timeout_ms': '20000',
+            'server_selection_timeout_ms': '30000',
+            'socket_timeout_ms': '0',
+            'app_name': 'social-network',
+            'profile': 'false'}
+
+# Clients of this process, keyed by their settings; _STATE['pid'] is the
+# process that created them
+_STATE = {'pid': None, 'clients': {}}
+
+# Parsed [mongodb] section of each settings file read by this process
+_FILES = {}
+
+
+def load_settings(path=None):
+    '''
+    Reads the [mongodb] settings, applying environment overrides
+    '''
+    settings = dict(_read_file(path or os.environ.get('SOCIAL_NETWORK_CONFIG',
+                                                      CONFIG_FILE)))
+    for key in DEFAULTS:
+        override = os.environ.get(f"SOCIAL_NETWORK_MONGODB_{key.upper()}")
+        if override is not None:
+            settings[key] = override
+    return settings
+
+
+def _read_file(path):
+    '''
+    The [mongodb] section of path over DEFAULTS, parsed on first use
+    '''
+    section = _FILES.get(path)
+    if section is None:
+        parser = configparser.ConfigParser()
+        parser.read_dict({'mongodb': DEFAULTS})
+        parser.read(path)
+        section = _FILES[path] = dict(parser['mongodb'])
+    return section
+
+
+def client_options(settings=None):
+    '''
+    MongoClient keyword arguments for settings; also usable for
+    pymongo's AsyncMongoClient
+    '''
+    settings = settings or load_settings()
+    options = {'host': settings['host'],
+               'port': int(settings['port']),
+               'maxPoolSize': int(settings['max_pool_size']),
+               'minPoolSize': int(settings['min_pool_size']),
+               'connectTimeoutMS': int(settings['connect_timeout_ms']),
+               'serverSelectionTimeoutMS':
+               int(settings['server_selection_timeout_ms']),
+               'appname': settings['app_name']}
+    if int(settings['socket_timeout_ms']):
+        options['socketTimeoutMS'] = int(settings['socket_timeout_ms'])
+    compressors = [name.strip() for name in settings['compressors'].split(',')
+                   if name.strip()]
+    if compressors:
+        options['compressors'] = compressors
+    if profiling(settings):
+        options['event_listeners'] = [profiler.LISTENER]
+    return options
+
+
+def profiling(settings):
+    '''
+    True if settings turn the command profiler on
+    '''
+    return settings['profile'].strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _forget_clients():
+    '''
+    Drops clients inherited through fork without closing them; their
+    sockets belong to the parent
+    '''
+    _STATE['pid'] = os.getpid()
+    _STATE['clients'] = {}
+
+
+os.register_at_fork(after_in_child=_forget_clients)
+
+
+def get_client(**overrides):
+    '''
+    The shared client of this process for the configured settings
+
+    overrides replace individual settings (e.g. host='10.0.0.5'); each
+    distinct set of settings gets its own shared client.
+    '''
+    if _STATE['pid'] != os.getpid():
+        _forget_clients()
+    settings = {**load_settings(), **{key: str(value) for key, value
+                                       in overrides.items()}}
+    key = tuple(sorted(settings.items()))
+    client = _STATE['clients'].get(key)
+    if client is None:
+        if settings['backend'] == 'memory':
+            client = memory_store.MemoryClient()
+        else:
+            client = MongoClient(**client_options(settings))
+            if profiling(settings):
+                profiler.enable()
+        _STATE['clients'][key] = client
+    return client
+
+
+def get_database(name=None, **overrides):
+    '''
+    The configured database (or database name) on the shared client
+    '''
+    name = name or {**load_settings(), **overrides}['database']
+    return get_client(**overrides)[name]
+
+
+def close_clients():
+    '''
+    Closes every client of this process; the next get_client reconnects
+    '''
+    for client in _STATE['clients'].values():
+        client.close()
+    _STATE['clients'] = {}
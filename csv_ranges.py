@@ -0,0 +1,142 @@
+'''
+Splits a CSV file into byte ranges that each hold whole records
+
+Loader workers are given (filename, start, end, header) and parse their
+own slice of the memory-mapped file, so the parent never parses the CSV
+or pickles DataFrames to the workers.
+
+Range ends are moved forward to the end of a line, and only to a line end
+that lies outside a quoted field. Quoted STATUS_TEXT values may therefore
+hold commas, doubled quotes and even newlines. The parent finds these
+boundaries by counting quote characters block by block (C-speed
+bytes.count), which is far cheaper than parsing the file.
+
+record_offset finds where a given data record starts the same way, so a
+resumed load can seek past the rows it already committed instead of
+parsing them again.
+'''
+
+import io
+import mmap
+import os
+import pandas as pd
+
+# Bytes copied at a time while counting quotes
+BLOCK_SIZE = 16 * 1024 * 1024
+
+# Smallest range worth giving to a worker
+MIN_RANGE_SIZE = 1024 * 1024
+
+# Bytes checked at a time by record_offset; a block without quotes is
+# skipped by counting its newlines
+SCAN_SIZE = 64 * 1024
+
+
+def _quote_parity(mapped, start, end):
+    '''
+    Parity (0 or 1) of the number of quote characters in mapped[start:end]
+    '''
+    parity = 0
+    for block in range(start, end, BLOCK_SIZE):
+        parity ^= mapped[block:min(block + BLOCK_SIZE, end)].count(b'"') & 1
+    return parity
+
+
+def _next_record_start(mapped, position, parity):
+    '''
+    The first record start at or after position, given the quote parity
+    up to position; returns (record start, parity there)
+    '''
+    size = len(mapped)
+    while position < size:
+        newline = mapped.find(b'\n', position)
+        if newline < 0:
+            return size, parity
+        parity ^= _quote_parity(mapped, position, newline)
+        position = newline + 1
+        if not parity:
+            return position, parity
+    return size, parity
+
+
+def split_ranges(filename, parts):
+    '''
+    Splits filename into at most parts byte ranges of whole records
+
+    Returns (header, [(start, end), ...]) where header is the raw header
+    line (bytes) and the ranges cover every data row exactly once.
+    '''
+    with open(filename, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b'', []
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            data_start, _ = _next_record_start(mapped, 0, 0)
+            header = mapped[:data_start]
+            size = len(mapped)
+            boundaries = [data_start]
+            position = data_start
+            parity = 0
+            for part in range(1, parts):
+                target = data_start + (size - data_start) * part // parts
+                if target <= boundaries[-1]:
+                    continue
+                parity ^= _quote_parity(mapped, position, target)
+                position, parity = _next_record_start(mapped, target, parity)
+                if position >= size:
+                    break
+                boundaries.append(position)
+    boundaries.append(size)
+    ranges = [(start, end) for start, end in zip(boundaries, boundaries[1:])
+              if end > start]
+    return header, ranges
+
+
+def record_offset(filename, records):
+    '''
+    Returns (header, offset): the raw header line of filename and the
+    byte offset where data record number records (0 for the first) starts,
+    or the file size if there are not that many
+    '''
+    with open(filename, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b'', 0
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            position, _ = _next_record_start(mapped, 0, 0)
+            header = mapped[:position]
+            size = len(mapped)
+            while records and position < size:
+                end = min(position + SCAN_SIZE, size)
+                block = mapped[position:end]
+                lines = block.count(b'\n')
+                if lines < records and b'"' not in block:
+                    records -= lines
+                    position = end
+                    continue
+                # Record by record through a block with quoted fields, or
+                # up to the record asked for
+                while records and position < end:
+                    position, _ = _next_record_start(mapped, position, 0)
+                    records -= 1
+    return header, position
+
+
+def plan_ranges(filename, processes, ranges_per_process=4):
+    '''
+    Splits filename for a pool of processes: a few ranges per process
+    for load balancing, but none smaller than MIN_RANGE_SIZE
+    '''
+    size = os.path.getsize(filename)
+    parts = max(1, min(processes * ranges_per_process,
+                       size // MIN_RANGE_SIZE))
+    return split_ranges(filename, parts)
+
+
+def read_range(filename, start, end, header, chunksize):
+    '''
+    Parses bytes start..end of filename as CSV with the given header
+    line; yields DataFrames of at most chunksize rows
+    '''
+    with open(filename, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            data = mapped[start:end]
+    yield from pd.read_csv(io.BytesIO(header + data), chunksize=chunksize)
@@ -0,0 +1,164 @@
+'''
+Duplicate-tolerant bulk inserts
+
+A LoadReport follows one bulk load. Before a batch is sent, unique()
+drops the rows whose _id was already seen earlier in the same batch or in
+an earlier batch of the load (skipped). Batches are inserted unordered,
+so a duplicate key does not stop the rest of the batch: rows whose _id is
+already in the collection count as already present, and every other
+write error (e.g. a duplicate email) as failed. Rows the loader chose not
+to send (e.g. statuses of unknown users) are recorded as rejected. At the
+end the report holds the exact count and IDs of each:
+
+    report = dedup.LoadReport()
+    for docs in batches:
+        report.insert(collection, report.unique(docs))
+    report.as_dict()
+    {'inserted': 1994,
+     'skipped': {'count': 2, 'ids': ['Angy.Piselli51', 'Kay.Xian3']},
+     'already_present': {'count': 3, 'ids': [...]},
+     'rejected': {'count': 0, 'ids': []},
+     'failed': {'count': 1, 'ids': ['Mei.Miles138']}}
+
+Remembering the IDs seen costs one set entry per row of the file.
+'''
+# pylint: disable=E0401
+
+import threading
+from loguru import logger
+from pymongo.errors import BulkWriteError
+import checkpoint
+import logs
+
+OUTCOMES = ('skipped', 'already_present', 'rejected', 'failed')
+
+
+def insert_many(collection, docs):
+    '''
+    Unordered insert_many of docs; returns (inserted, IDs already present,
+    IDs that failed). Failures are logged through logs.reject.
+    '''
+    if not docs:
+        return 0, [], []
+    try:
+        return len(collection.insert_many(docs, ordered=False)
+                   .inserted_ids), [], []
+    except BulkWriteError as err:
+        present = []
+        failed = []
+        for error in err.details['writeErrors']:
+            doc_id = error['op']['_id']
+            if error['code'] == checkpoint.DUPLICATE_KEY \
+                    and '_id' in error.get('keyValue', {'_id': None}):
+                present.append(doc_id)
+            else:
+                failed.append(doc_id)
+                logs.reject(doc_id, logs.write_error_reason(error),
+                            f"_id: {doc_id} failed to add")
+        return err.details['nInserted'], present, failed
+
+
+class LoadReport():
+    '''
+    In-load dedup and the outcome of every row of one bulk load; safe to
+    share between threads
+    '''
+    def __init__(self):
+        self.inserted = 0
+        self.ids = {outcome: [] for outcome in OUTCOMES}
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def unique(self, docs):
+        '''
+        The docs whose _id was not seen before in this load
+        '''
+        kept = []
+        with self._lock:
+            for doc in docs:
+                if doc['_id'] in self._seen:
+                    self.ids['skipped'].append(doc['_id'])
+                else:
+                    self._seen.add(doc['_id'])
+                    kept.append(doc)
+        return kept
+
+    def unique_rows(self, chunk, id_column):
+        '''
+        The rows of a pandas chunk whose id_column was not seen before in
+        this load
+        '''
+        ids = chunk[id_column]
+        with self._lock:
+            new = ~ids.duplicated() & ~ids.isin(self._seen)
+            self.ids['skipped'].extend(ids[~new])
+            self._seen.update(ids[new])
+        return chunk[new]
+
+    def insert(self, collection, docs):
+        '''
+        Inserts docs unordered and records the outcome; returns the number
+        inserted
+        '''
+        inserted, present, failed = insert_many(collection, docs)
+        self.add(inserted, present, failed)
+        return inserted
+
+    def add(self, inserted, present=(), failed=(), rejected=()):
+        '''
+        Records the outcome of one insert, and the IDs of rows rejected
+        before it
+        '''
+        with self._lock:
+            self.inserted += inserted
+            self.ids['already_present'].extend(present)
+            self.ids['rejected'].extend(rejected)
+            self.ids['failed'].extend(failed)
+
+    def merge(self, outcome):
+        '''
+        Adds an as_dict() of another report (e.g. from a worker process)
+        '''
+        with self._lock:
+            self.inserted += outcome['inserted']
+            for name in OUTCOMES:
+                self.ids[name].extend(outcome[name]['ids'])
+
+    def count(self, outcome):
+        '''
+        Number of rows with outcome ('skipped', 'already_present',
+        'rejected' or 'failed')
+        '''
+        with self._lock:
+            return len(self.ids[outcome])
+
+    def clean(self):
+        '''
+        True if no row was rejected or failed to insert
+        '''
+        return not self.count('rejected') and not self.count('failed')
+
+    def as_dict(self):
+        '''
+        Rows inserted, and the count and IDs of every other outcome
+        '''
+        with self._lock:
+            report = {'inserted': self.inserted}
+            for name in OUTCOMES:
+                report[name] = {'count': len(self.ids[name]),
+                                'ids': list(self.ids[name])}
+        return report
+
+    def log(self, operation):
+        '''
+        Logs the totals, listing the IDs of every row that was not inserted
+        '''
+        report = self.as_dict()
+        logger.info(f"{operation}: {report['inserted']} inserted, "
+                    + ', '.join(f"{report[name]['count']} "
+                                f"{name.replace('_', ' ')}"
+                                for name in OUTCOMES))
+        for name in OUTCOMES:
+            if report[name]['count']:
+                logger.warning(f"{operation} {name.replace('_', ' ')}: "
+                               f"{', '.join(map(str, report[name]['ids']))}")
@@ -0,0 +1,106 @@
+'''
+Conversion of pandas CSV chunks and API arguments into Mongo documents
+
+The blocking and the asyncio collection classes build their documents
+and updates here, so both store the same fields.
+'''
+
+# CSV column -> document field, in document field order
+USER_FIELDS = {'USER_ID': '_id',
+               'EMAIL': 'email',
+               'NAME': 'name',
+               'LASTNAME': 'last_name'}
+
+STATUS_FIELDS = {'STATUS_ID': '_id',
+                 'USER_ID': 'user_id',
+                 'STATUS_TEXT': 'status_text'}
+
+
+def chunk_to_documents(chunk, fields):
+    '''
+    Converts a whole pandas chunk into a list of documents
+
+    The CSV columns are selected and renamed to document fields, then the
+    chunk is turned into records column-wise instead of building one
+    pandas Series per row with iterrows.
+    '''
+    return chunk[list(fields)].rename(columns=fields).to_dict('records')
+
+
+def user_documents(chunk):
+    '''
+    Converts a chunk of accounts.csv rows into user documents
+    '''
+    return chunk_to_documents(chunk, USER_FIELDS)
+
+
+def status_documents(chunk):
+    '''
+    Converts a chunk of status CSV rows into status documents
+    '''
+    return chunk_to_documents(chunk, STATUS_FIELDS)
+
+
+def user_document(user_id, email, user_name, user_last_name):
+    '''
+    The document of one user
+    '''
+    return {'_id': user_id,
+            'email': email,
+            'name': user_name,
+            'last_name': user_last_name}
+
+
+def user_update(email, user_name, user_last_name):
+    '''
+    The update that sets the fields of an existing user
+    '''
+    return {'$set': {'email': email,
+                     'name': user_name,
+                     'last_name': user_last_name}}
+
+
+def status_document(status_id, user_id, status_text):
+    '''
+    The document of one status
+    '''
+    return {'_id': status_id,
+            'user_id': user_id,
+            'status_text': status_text}
+
+
+def status_update(user_id, status_text):
+    '''
+    The update that sets the fields of an existing status
+    '''
+    return {'$set': {'user_id': user_id,
+                     'status_text': status_text}}
+
+
+def split_known_users(status_chunk, known_users):
+    '''
+    Splits status documents into (accepted, rejected) by whether their
+    user_id is in known_users
+    '''
+    accepted = []
+    rejected = []
+    for status in status_chunk:
+        if status['user_id'] in known_users:
+            accepted.append(status)
+        else:
+            rejected.append(status)
+    return accepted, rejected
+
+
+def batched(items, size):
+    '''
+    Yields consecutive lists of at most size items
+    '''
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
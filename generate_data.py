@@ -0,0 +1,177 @@
+'''
+Deterministic synthetic user and status CSV files of any size
+
+Writes USER_ID,NAME,LASTNAME,EMAIL and STATUS_ID,USER_ID,STATUS_TEXT
+files like accounts.csv and the status export. Rows are generated and
+written one at a time, so memory stays constant however many rows are
+asked for. The same seed and options always give byte-identical files.
+
+    python generate_data.py --users 200000 --statuses 2000000 --seed 7
+    python generate_data.py --users 1000000 --statuses 100000000 \
+        --distribution pareto --skew 1.2 --bad-rate 0.001
+
+Statuses per user are either uniform or Pareto distributed (--skew is
+the shape; smaller is more skewed, 1.16 gives roughly 80/20). Users are
+visited in order and, if the target is not reached after the last one,
+again from the first.
+
+With --bad-rate, that fraction of rows is defective, in equal shares of
+the defects in USER_DEFECTS / STATUS_DEFECTS: a repeated ID, an empty
+field, a malformed email, an email that does not match its USER_ID, a
+status of a non-existing user or an oversized STATUS_TEXT. Defects are
+drawn from their own random streams, so --bad-rate changes only the
+defective rows, and statuses are generated for the users file as written
+with the same --bad-rate; only the unknown-user defects reference a user
+that is not in it.
+'''
+# pylint: disable=E0401
+
+import argparse
+import csv
+import random
+
+FIRST_NAMES = ('Larisa', 'Danell', 'Sissie', 'Angy', 'Kay', 'Shiqi',
+               'Evelyn', 'Marcus', 'Priya', 'Tomas', 'Ingrid', 'Kofi',
+               'Mei', 'Rafael', 'Noor', 'Olga', 'Dmitri', 'Aiko', 'Liam',
+               'Zara')
+LAST_NAMES = ('Yesima', 'Genie', 'Andromede', 'Piselli', 'Xian', 'Miles',
+              'Okafor', 'Lindqvist', 'Tanaka', 'Novak', 'Haddad', 'Reyes',
+              'Schmidt', 'Kowalski', 'Nguyen', 'Fischer', 'Moreau',
+              'Silva', 'Ivanova', 'Brennan')
+DOMAINS = ('testmail.com', 'goodmail.com', 'funmail.com', 'uw.edu')
+WORDS = ('coffee', 'code', 'weekend', 'hiking', 'deadline', 'meeting',
+         'lunch', 'release', 'bug', 'music', 'travel', 'finally', 'again',
+         'great', 'tired', 'today', 'tomorrow', 'team', 'launch', 'rain')
+
+USER_DEFECTS = ('duplicate', 'missing_field', 'malformed_email',
+                'email_mismatch')
+STATUS_DEFECTS = ('duplicate', 'missing_field', 'unknown_user',
+                  'oversized_text')
+
+# Length of an oversized STATUS_TEXT
+OVERSIZED_TEXT = 5000
+
+
+def user_rows(seed, count, bad_rate=0.0):
+    '''
+    Yields count [USER_ID, NAME, LASTNAME, EMAIL] rows
+    '''
+    rng = random.Random(f"users:{seed}")
+    defects = random.Random(f"user defects:{seed}")
+    previous = None
+    for number in range(count):
+        name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        user_id = f"{name}.{last_name}{number}"
+        row = [user_id, name, last_name, f"{user_id}@{rng.choice(DOMAINS)}"]
+        if bad_rate and defects.random() < bad_rate:
+            row = _user_defect(defects.choice(USER_DEFECTS), row, previous)
+        previous = row
+        yield row
+
+
+def _user_defect(defect, row, previous):
+    user_id, name, last_name, email = row
+    if defect == 'duplicate' and previous is not None:
+        return [previous[0], name, last_name, email]
+    if defect == 'missing_field':
+        return [user_id, name, '', email]
+    if defect == 'malformed_email':
+        return [user_id, name, last_name, email.replace('@', '.at.')]
+    if defect == 'email_mismatch':
+        return [user_id, name, last_name, f"x{email}"]
+    return row
+
+
+def statuses_per_user(rng, mean, distribution, skew):
+    '''
+    Draws the number of statuses of one user
+    '''
+    if distribution == 'pareto':
+        # paretovariate(skew) has mean skew / (skew - 1)
+        return int(rng.paretovariate(skew) * mean * (skew - 1) / skew)
+    whole = int(mean)
+    return whole + (rng.random() < mean - whole)
+
+
+def status_rows(seed, count, users, distribution='uniform', skew=1.16,
+                bad_rate=0.0):
+    '''
+    Yields count [STATUS_ID, USER_ID, STATUS_TEXT] rows of the users that
+    user_rows(seed, users, bad_rate) generates
+    '''
+    rng = random.Random(f"statuses:{seed}")
+    defects = random.Random(f"status defects:{seed}")
+    mean = count / users if users else 0
+    number = 0
+    previous = None
+    while number < count and users:
+        for user in user_rows(seed, users, bad_rate):
+            for _ in range(statuses_per_user(rng, mean, distribution, skew)):
+                if number == count:
+                    return
+                number += 1
+                row = [f"{user[0]}_{number:08d}", user[0],
+                       ' '.join(rng.choices(WORDS, k=rng.randint(3, 12)))]
+                if bad_rate and defects.random() < bad_rate:
+                    row = _status_defect(defects.choice(STATUS_DEFECTS), row,
+                                         previous)
+                previous = row
+                yield row
+
+
+def _status_defect(defect, row, previous):
+    status_id, user_id, text = row
+    if defect == 'duplicate' and previous is not None:
+        return [previous[0], user_id, text]
+    if defect == 'missing_field':
+        return [status_id, user_id, '']
+    if defect == 'unknown_user':
+        return [status_id, f"{user_id}.missing", text]
+    if defect == 'oversized_text':
+        return [status_id, user_id, (text + ' ') * (OVERSIZED_TEXT
+                                                    // len(text) + 1)]
+    return row
+
+
+def write_csv(filename, header, rows):
+    '''
+    Streams rows to filename; returns the number written
+    '''
+    written = 0
+    with open(filename, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            written += 1
+    return written
+
+
+def generate(users_file, status_file, users, statuses, seed=0,
+             distribution='uniform', skew=1.16, bad_rate=0.0):
+    '''
+    Writes both files; returns (user rows, status rows)
+    '''
+    return (write_csv(users_file, ['USER_ID', 'NAME', 'LASTNAME', 'EMAIL'],
+                      user_rows(seed, users, bad_rate)),
+            write_csv(status_file, ['STATUS_ID', 'USER_ID', 'STATUS_TEXT'],
+                      status_rows(seed, statuses, users, distribution, skew,
+                                  bad_rate)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--statuses', type=int, default=2000000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--distribution', choices=('uniform', 'pareto'),
+                        default='uniform')
+    parser.add_argument('--skew', type=float, default=1.16)
+    parser.add_argument('--bad-rate', type=float, default=0.0)
+    parser.add_argument('--users-file', default='accounts_generated.csv')
+    parser.add_argument('--status-file', default='status_updates.csv')
+    args = parser.parse_args()
+    print(generate(args.users_file, args.status_file, args.users,
+                   args.statuses, args.seed, args.distribution, args.skew,
+                   args.bad_rate))
@@ -0,0 +1,107 @@
+'''
+Index provisioning and explain-based index checks for the collection
+classes
+
+A collection class declares the indexes it relies on as INDEXES, a list
+of (collection attribute, keys, options) tuples, e.g.
+
+    INDEXES = [('status_collection', [('user_id', ASCENDING)],
+                {'name': 'user_id_1'})]
+
+The indexes more than one class relies on are declared here once.
+
+ensure_indexes creates (or, when they already exist, verifies) them and
+uses_index asks the query planner whether a query is served by an index.
+'''
+# pylint: disable=E0401
+
+from loguru import logger
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+# One account per email
+USER_EMAIL = ('user_collection', [('email', ASCENDING)],
+              {'name': 'email_1', 'unique': True})
+
+# Serves the user_id lookups (the statuses of a user, the cascade of
+# delete_user) and, through its _id suffix, the keyset pages of timeline
+# and iter_statuses_for_user
+STATUS_USER_ID = ('status_collection', [('user_id', ASCENDING),
+                                        ('_id', ASCENDING)],
+                  {'name': 'user_id_1__id_1'})
+
+# Plan stages that read through an index rather than scanning the collection
+INDEX_STAGES = {'IXSCAN', 'IDHACK', 'EXPRESS_IXSCAN',
+                'EXPRESS_CLUSTERED_IXSCAN', 'COUNT_SCAN', 'DISTINCT_SCAN'}
+
+
+def ensure_indexes(owner):
+    '''
+    Creates every index declared in owner.INDEXES
+
+    create_index is a no-op for an index that already exists with the same
+    definition. Returns False if an index could not be built, for example
+    a unique index over existing duplicate values.
+    '''
+    success = True
+    for attribute, keys, options in owner.INDEXES:
+        collection = getattr(owner, attribute)
+        try:
+            collection.create_index(keys, **options)
+        except OperationFailure as err:
+            _log_failure(collection, keys, options, err)
+            success = False
+    return success
+
+
+async def ensure_indexes_async(owner):
+    '''
+    ensure_indexes for the async collection classes
+    '''
+    success = True
+    for attribute, keys, options in owner.INDEXES:
+        collection = getattr(owner, attribute)
+        try:
+            await collection.create_index(keys, **options)
+        except OperationFailure as err:
+            _log_failure(collection, keys, options, err)
+            success = False
+    return success
+
+
+def _log_failure(collection, keys, options, err):
+    logger.error(f"Failed to create index {options.get('name', keys)} "
+                 f"on {collection.name}: {err}")
+
+
+def missing_indexes(owner):
+    '''
+    Names of the declared indexes that do not exist on the server
+    '''
+    missing = []
+    for attribute, keys, options in owner.INDEXES:
+        existing = getattr(owner, attribute).index_information()
+        if not any(info['key'] == keys for info in existing.values()):
+            missing.append(options.get('name', keys))
+    return missing
+
+
+def plan_stages(plan):
+    '''
+    Yields the stage names of an explain() winning plan, outermost first
+    '''
+    if 'queryPlan' in plan:
+        plan = plan['queryPlan']
+    yield plan.get('stage')
+    if 'inputStage' in plan:
+        yield from plan_stages(plan['inputStage'])
+    for stage in plan.get('inputStages', []):
+        yield from plan_stages(stage)
+
+
+def uses_index(collection, query):
+    '''
+    True if the query planner serves query from an index
+    '''
+    plan = collection.find(query).explain()['queryPlanner']['winningPlan']
+    return any(stage in INDEX_STAGES for stage in plan_stages(plan))
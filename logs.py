@@ -0,0 +1,192 @@
+'''
+Low-overhead logging for bulk operations
+
+Outside bulk mode the API logs as it always has. Inside
+
+    with logs.bulk('load_users') as log:
+        ...
+        log.batch(rows, inserted, start, end)
+
+per-row success messages are dropped (logs.success), per-row errors go
+through logs.reject, and each batch writes one summary line. A reject is
+logged in full for the first SAMPLE_FIRST rows of each reason and then
+for every SAMPLE_EVERY-th, but the batch summary names every rejected
+ID with its reason, so every reject stays traceable:
+
+    load_users rows 0-1000: 1000 read, 997 inserted, 3 rejected
+    (duplicate: Larisa.Yesima75, Angy.Piselli51; unknown user: x_001)
+
+One BulkLog serves a whole load, so the sampling counters keep counting
+across batches. It is safe to share between threads; code running in
+another thread or process is given it explicitly and runs inside
+active(log).
+
+configure() installs an enqueued (non-blocking) file sink: formatting
+and file I/O happen on loguru's writer thread instead of the loading
+thread. Loader worker processes inherit it through fork.
+'''
+
+import collections
+import contextlib
+import contextvars
+import threading
+from loguru import logger
+
+# Full messages logged per reject reason before sampling starts
+SAMPLE_FIRST = 5
+
+# After SAMPLE_FIRST, one full message per this many rejects of a reason
+SAMPLE_EVERY = 1000
+
+# The BulkLog of the bulk operation running in this context
+_BULK = contextvars.ContextVar('bulk_log', default=None)
+
+
+class BulkLog():
+    '''
+    Batch summaries and sampled rejects of one bulk operation
+    '''
+    def __init__(self, operation, sample_first=SAMPLE_FIRST,
+                 sample_every=SAMPLE_EVERY):
+        self.operation = operation
+        self.sample_first = sample_first
+        self.sample_every = sample_every
+        self.batches = 0
+        self.rows = 0
+        self.inserted = 0
+        self.rejects = collections.Counter()
+        self._batch_rejects = []
+        self._lock = threading.Lock()
+
+    def reject(self, record_id, reason):
+        '''
+        Records one rejected row; logs it in full if it is sampled
+        '''
+        with self._lock:
+            self.rejects[reason] += 1
+            self._batch_rejects.append((record_id, reason))
+            seen = self.rejects[reason]
+        if seen <= self.sample_first or seen % self.sample_every == 0:
+            logger.error(f"{self.operation}: {record_id} rejected: {reason} "
+                         f"({seen} {reason} so far)")
+
+    def batch(self, rows, inserted, start=None, end=None):
+        '''
+        Logs the summary of one batch, naming every rejected ID recorded
+        since the previous summary
+        '''
+        with self._lock:
+            self.batches += 1
+            self.rows += rows
+            self.inserted += inserted
+            batch_rejects, self._batch_rejects = self._batch_rejects, []
+        where = '' if start is None else f" rows {start}-{end}"
+        message = (f"{self.operation}{where}: {rows} read, {inserted} "
+                   f"inserted")
+        if batch_rejects:
+            by_reason = collections.defaultdict(list)
+            for record_id, reason in batch_rejects:
+                by_reason[reason].append(str(record_id))
+            listed = '; '.join(f"{reason}: {', '.join(ids)}"
+                               for reason, ids in by_reason.items())
+            message += f", {len(batch_rejects)} rejected ({listed})"
+        logger.info(message)
+
+    def close(self):
+        '''
+        Logs the totals of an operation that ran more than one batch
+        '''
+        if self.batches > 1:
+            logger.info(f"{self.operation} done: {self.batches} batches, "
+                        f"{self.rows} rows read, {self.inserted} inserted, "
+                        f"rejects: {dict(self.rejects) or 'none'}")
+
+
+@contextlib.contextmanager
+def bulk(operation, sample_first=SAMPLE_FIRST, sample_every=SAMPLE_EVERY):
+    '''
+    Runs the block in bulk logging mode; yields its BulkLog
+    '''
+    log = BulkLog(operation, sample_first, sample_every)
+    try:
+        with active(log):
+            yield log
+    finally:
+        log.close()
+
+
+@contextlib.contextmanager
+def active(log):
+    '''
+    Runs the block in bulk logging mode with an existing BulkLog, e.g. one
+    handed to another thread or process; yields it
+    '''
+    token = _BULK.set(log)
+    try:
+        yield log
+    finally:
+        _BULK.reset(token)
+
+
+def bulk_mode():
+    '''
+    True inside a bulk operation
+    '''
+    return _BULK.get() is not None
+
+
+def success(message):
+    '''
+    Logs a per-row success message, except in bulk mode
+    '''
+    if _BULK.get() is None:
+        logger.info(message)
+
+
+def reject(record_id, reason, message=None):
+    '''
+    Logs a rejected row: in full outside bulk mode, sampled and summarized
+    per batch inside it
+    '''
+    log = _BULK.get()
+    if log is None:
+        logger.error(message or f"{record_id} rejected: {reason}")
+    else:
+        log.reject(record_id, reason)
+
+
+def batch(rows, inserted, start=None, end=None):
+    '''
+    Logs a batch summary if a bulk operation is running
+    '''
+    log = _BULK.get()
+    if log is not None:
+        log.batch(rows, inserted, start, end)
+
+
+def write_error_reason(error):
+    '''
+    Reject reason of one BulkWriteError writeErrors entry
+    '''
+    if error['code'] == 11000:
+        return duplicate_reason(error)
+    return f"write error {error['code']}"
+
+
+def duplicate_reason(details):
+    '''
+    Reject reason of a duplicate key error, given its details (a
+    DuplicateKeyError's or a writeErrors entry): 'duplicate' for an _id
+    that already exists, 'duplicate email' for a clash on the email index
+    '''
+    fields = [field for field in details.get('keyValue') or {'_id': None}
+              if field != '_id']
+    return f"duplicate {', '.join(fields)}" if fields else 'duplicate'
+
+
+def configure(path, level='INFO'):
+    '''
+    Replaces loguru's sinks with one enqueued file sink at path
+    '''
+    logger.remove()
+    logger.add(path, level=level, enqueue=True)
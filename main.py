@@ -6,50 +6,84 @@ main driver for a simple social network project
 
 import os
 import csv
+import itertools
 import multiprocessing
-import pandas as pd
+import queue
+import time
 from loguru import logger
-from pymongo import MongoClient
+import autotune
+import checkpoint
+import connection
+import csv_ranges
+import dedup
+import documents
+import logs
+import metrics
+import pipeline
 import users
 import user_status
+import validation
+
+# Per-process state of a loader pool worker (see _init_loader_worker)
+_WORKER = {}
 
 
 class MongoDBConnection():
-    """Mongo DB Connection"""
+    """
+    Mongo DB Connection
 
-    def __init__(self, host='127.0.0.1', port=27017):
-        self.host = host
-        self.port = port
-        self.connection = MongoClient(self.host, self.port)
+    Borrows the process-wide pooled client from connection.get_client;
+    host and port default to social_network.ini. Leaving the context
+    does not close the shared client, so later sessions reuse its pool.
+    """
+
+    def __init__(self, host=None, port=None):
+        overrides = {key: value for key, value
+                     in (('host', host), ('port', port)) if value is not None}
+        self.connection = connection.get_client(**overrides)
+        self.database = connection.get_database(**overrides)
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.connection.close()
+        self.close()
 
     def close(self):
         """
-        close client connection
+        Does nothing: the shared client stays open, with its pool, for the
+        rest of the process. connection.close_clients() closes it.
         """
-        self.connection.close()
 
 
-def init_user_collection(database):
+def init_user_collection(database, cache=None):
     '''
     Creates and returns a new instance of UserCollection
+
+    The indexes the collection relies on are created or verified here.
+    An optional cache.LRUCache puts a read-through cache in front of
+    search_user.
     '''
-    return users.UserAccounts(database)
+    user_collection = users.UserAccounts(database, cache)
+    user_collection.ensure_indexes()
+    return user_collection
 
 
-def init_status_collection(database):
+def init_status_collection(database, cache=None):
     '''
     Creates and returns a new instance of UserStatusCollection
+
+    The indexes the collection relies on are created or verified here.
+    An optional cache.LRUCache, usually the one given to the user
+    collection, puts a read-through cache in front of search_status.
     '''
-    return user_status.StatusUpdates(database)
+    status_collection = user_status.StatusUpdates(database, cache)
+    status_collection.ensure_indexes()
+    return status_collection
 
 
-def load_users(filename, user_collection):
+@metrics.timed
+def load_users(filename, user_collection, resume=False, checkpoint_every=1000):
     '''
     Opens a CSV file with user data and
     adds it to an existing instance of
@@ -62,22 +96,41 @@ def load_users(filename, user_collection):
     - Returns False if there are any errors
     (such as empty fields in the source CSV file)
     - Otherwise, it returns True.
+
+    Rows that fail validation are not loaded; they are written with
+    their reasons to a rejects CSV next to the file (see validation).
+    Progress is checkpointed every checkpoint_every rows; resume=True
+    continues an interrupted load after the last checkpoint.
     '''
     file_exist = os.path.exists(filename)
     if file_exist is False:
         logger.error("Sorry, this file doesn't exist.")
         return False
-    with open(filename, 'r', encoding='utf-8') as file:
+    progress = checkpoint.Checkpoint(filename, 'load_users', resume)
+    validator = validation.Validator(filename, resume)
+    with logs.bulk('load_users'), open(filename, 'r',
+                                       encoding='utf-8') as file:
         user_data = csv.DictReader(file, delimiter=',')
-        for row in user_data:
-            user_collection.add_user(row['USER_ID'],
-                                     row['EMAIL'],
-                                     row['NAME'],
-                                     row['LASTNAME'])
-    return True
-
-
-def load_status_updates(filename, status_collection):
+        start = 0
+        for rows in documents.batched(user_data, checkpoint_every):
+            end = start + len(rows)
+            if not progress.is_done(start, end):
+                valid = validator.users(rows).to_dict('records')
+                added = sum(user_collection.add_user(row['USER_ID'],
+                                                     row['EMAIL'],
+                                                     row['NAME'],
+                                                     row['LASTNAME'])
+                            for row in valid)
+                progress.commit(start, end, len(rows), added)
+                logs.batch(len(rows), added, start, end)
+            start = end
+    _complete(progress)
+    return _validated(validator)
+
+
+@metrics.timed
+def load_status_updates(filename, status_collection, resume=False,
+                        checkpoint_every=1000):
     '''
     Opens a CSV file with status data and adds it to an existing
     instance of UserStatusCollection
@@ -88,125 +141,603 @@ def load_status_updates(filename, status_collection):
     - Returns False if there are any errors(such as empty fields in the
       source CSV file)
     - Otherwise, it returns True.
+
+    Rows that fail validation are not loaded; they are written with
+    their reasons to a rejects CSV next to the file (see validation).
+    Progress is checkpointed every checkpoint_every rows; resume=True
+    continues an interrupted load after the last checkpoint.
     '''
     file_exist = os.path.exists(filename)
     if file_exist is False:
         logger.error("Sorry, this file doesn't exist.")
         return False
-    with open(filename, 'r', encoding='utf-8') as file:
+    progress = checkpoint.Checkpoint(filename, 'load_status_updates', resume)
+    validator = validation.Validator(filename, resume)
+    with logs.bulk('load_status_updates'), open(filename, 'r',
+                                                encoding='utf-8') as file:
         status_data = csv.DictReader(file, delimiter=',')
-        for row in status_data:
-            status_collection.add_status(row['STATUS_ID'],
-                                         row['USER_ID'],
-                                         row['STATUS_TEXT'])
+        start = 0
+        for rows in documents.batched(status_data, checkpoint_every):
+            end = start + len(rows)
+            if not progress.is_done(start, end):
+                valid = validator.statuses(rows).to_dict('records')
+                added = sum(status_collection.add_status(row['STATUS_ID'],
+                                                         row['USER_ID'],
+                                                         row['STATUS_TEXT'])
+                            for row in valid)
+                progress.commit(start, end, len(rows), added)
+                logs.batch(len(rows), added, start, end)
+            start = end
+    _complete(progress)
     logger.info("Loaded user status database from file successfully!")
-    return True
+    return _validated(validator)
 
 
-def load_users_chunks(filename, user_collection):
+@metrics.timed
+def load_users_chunks(filename, user_collection, resume=False, size=None,
+                      tuning=None, outcome=None):
     '''
     Opens a CSV file with user data and
     adds it to an existing instance of
     UserCollection
 
-    Load users data in chunks
+    Load users data in chunks of size rows, or of a tuned size when size
+    is None (the tuning dict is filled with autotune's report); every
+    chunk is checkpointed and resume=True continues an interrupted load.
+    Duplicate IDs in the file are skipped and IDs already stored do not
+    stop the load; the outcome dict is filled with dedup's report.
     '''
     file_exist = os.path.exists(filename)
     if file_exist is False:
         logger.error("Sorry, this file doesn't exist.")
         return False
-    user_collection.add_user_in_chunks(filename)
-    return True
-
-
-def load_users_multiprocess(filename, size=100):
-    '''
-    Imports CSV file in chunks of a defined size
-    '''
-    chunk_number = 0
-    processes = []
-    for chunk in pd.read_csv(filename, chunksize=size, iterator=True):
-        print(f"CHUNK {chunk_number}")
-        # Create an empty list and append chunk of user dicts to it
-        # user_chunk = []
-        # for index, row in chunk.iterrows():
-        #     user = {}
-        #     user['_id'] = row['USER_ID']
-        #     user['email'] = row['EMAIL']
-        #     user['name'] = row['NAME']
-        #     user['last_name'] = row['LASTNAME']
-        #     user_chunk.append(user)
-        proc = multiprocessing.Process(target=load_users_worker,
-                                       args=(chunk, ))
-        processes.append(proc)
-        proc.start()
-        chunk_number += 1
-    for proc in processes:
-        print(f"waiting on {proc.name}")
-        proc.join()
-    return True
+    progress = checkpoint.Checkpoint(filename, 'load_users_chunks', resume)
+    validator = validation.Validator(filename, resume)
+    size = autotune.BatchSizeTuner() if size is None else size
+    report = dedup.LoadReport()
+    with logs.bulk('load_users_chunks'):
+        user_collection.add_user_in_chunks(filename, size, progress,
+                                           validator, report)
+    # Every chunk was processed; failed rows are reported, not retried
+    _complete(progress)
+    _report_tuning(size, tuning)
+    return _reported(progress.loader, validator, report, outcome)
+
+
+@metrics.timed
+def load_users_multiprocess(filename, size=None, processes=None,
+                            database_name=None, resume=False, tuning=None,
+                            outcome=None):
+    '''
+    Imports CSV file in chunks of a defined size, or of a tuned size when
+    size is None (the tuning dict is filled with autotune's report)
+
+    Chunks are handed to a fixed pool of worker processes (one per core
+    by default). Each worker keeps a single client for its whole life
+    and writes every chunk with one unordered insert_many into
+    database_name (the configured database by default). Every chunk is
+    checkpointed and resume=True continues an interrupted load; a worker
+    error is logged and returns False with the checkpoint kept.
+    Duplicate IDs in the file are skipped before chunks are handed out;
+    the outcome dict is filled with dedup's report.
+    '''
+    if not os.path.exists(filename):
+        logger.error("Sorry, this file doesn't exist.")
+        return False
+    progress = checkpoint.Checkpoint(filename, 'load_users_multiprocess',
+                                     resume)
+    validator = validation.Validator(filename, resume)
+    size = autotune.BatchSizeTuner() if size is None else size
+    report = dedup.LoadReport()
+    with logs.bulk(progress.loader):
+        inserted, loaded = _run_loader_pool(
+            load_users_worker,
+            _numbered_chunks(filename, size, progress, lambda chunk:
+                             report.unique_rows(validator.users(chunk),
+                                                'USER_ID')),
+            processes, database_name, progress, report, size)
+    logger.info(f"Loaded {inserted} users with multiprocessing")
+    _report_tuning(size, tuning)
+    return _reported(progress.loader, validator, report, outcome) and loaded
 
 
 def load_users_worker(chunk):
     """
     The worker function for load users with multiprocessing
     """
-    with MongoDBConnection() as mongo:
-        database = mongo.connection.SocialNetwork
-        user_collection = init_user_collection(database)
-        for _, row in chunk.iterrows():
-            user_collection.add_user(row['USER_ID'],row['EMAIL'],row['NAME'],row['LASTNAME'])
-        # user_collection.add_users(chunk)
-    return True
+    report = dedup.LoadReport()
+    report.insert(_WORKER['database'].user_collection,
+                  documents.user_documents(chunk))
+    return len(chunk), report.as_dict()
 
 
-def load_status_updates_chunks(filename, status_collection):
+@metrics.timed
+def load_status_updates_chunks(filename, status_collection, resume=False,
+                               size=None, tuning=None, outcome=None):
     '''
     Opens a CSV file with status data and adds it to an existing
     instance of UserStatusCollection
 
-    Load status updates in chunks
+    Load status updates in chunks of size rows, or of a tuned size when
+    size is None (the tuning dict is filled with autotune's report);
+    every chunk is checkpointed and resume=True continues an interrupted
+    load. Duplicate IDs in the file are skipped and IDs already stored do
+    not stop the load; the outcome dict is filled with dedup's report.
     '''
     file_exist = os.path.exists(filename)
     if file_exist is False:
         logger.error("Sorry, this file doesn't exist.")
         return False
-    status_collection.add_status_in_chunks(filename)
+    progress = checkpoint.Checkpoint(filename, 'load_status_updates_chunks',
+                                     resume)
+    validator = validation.Validator(filename, resume)
+    size = autotune.BatchSizeTuner() if size is None else size
+    report = dedup.LoadReport()
+    with logs.bulk('load_status_updates_chunks'):
+        status_collection.add_status_in_chunks(filename, size,
+                                               progress=progress,
+                                               validator=validator,
+                                               report=report)
+    # Every chunk was processed; rejected rows are reported, not retried
+    _complete(progress)
+    _report_tuning(size, tuning)
+    return _reported(progress.loader, validator, report, outcome)
+
+
+@metrics.timed
+def load_status_multiprocess(filename, size=None, processes=None,
+                             database_name=None, resume=False, tuning=None,
+                             outcome=None):
+    '''
+    Imports CSV file in chunks of a defined size, or of a tuned size when
+    size is None (the tuning dict is filled with autotune's report)
+
+    Chunks are handed to a fixed pool of worker processes (one per core
+    by default). Each worker keeps a single client for its whole life
+    and writes every chunk with one unordered insert_many into
+    database_name (the configured database by default). Every chunk is
+    checkpointed and resume=True continues an interrupted load; a worker
+    error is logged and returns False with the checkpoint kept.
+    Duplicate IDs in the file are skipped before chunks are handed out;
+    the outcome dict is filled with dedup's report.
+    '''
+    if not os.path.exists(filename):
+        logger.error("Sorry, this file doesn't exist.")
+        return False
+    progress = checkpoint.Checkpoint(filename, 'load_status_multiprocess',
+                                     resume)
+    validator = validation.Validator(filename, resume)
+    size = autotune.BatchSizeTuner() if size is None else size
+    report = dedup.LoadReport()
+    with logs.bulk(progress.loader):
+        inserted, loaded = _run_loader_pool(
+            load_status_worker,
+            _numbered_chunks(filename, size, progress, lambda chunk:
+                             report.unique_rows(validator.statuses(chunk),
+                                                'STATUS_ID')),
+            processes, database_name, progress, report, size)
+    logger.info(f"Loaded {inserted} status updates with multiprocessing")
+    _report_tuning(size, tuning)
+    return _reported(progress.loader, validator, report, outcome) and loaded
+
+
+def load_status_worker(chunk):
+    """
+    The worker function for load status updates with multiprocessing
+    """
+    report = dedup.LoadReport()
+    _insert_statuses(_WORKER['status_collection'],
+                     documents.status_documents(chunk), report)
+    return len(chunk), report.as_dict()
+
+
+def _init_loader_worker(database_name, loader):
+    """
+    Pool initializer: open the one client this worker process will use,
+    and the BulkLog its tasks of the loader's run share
+    """
+    _WORKER['database'] = connection.get_database(database_name)
+    _WORKER['log'] = logs.BulkLog(loader)
+    _WORKER['status_collection'] = init_status_collection(_WORKER['database'])
+
+
+def _insert_statuses(status_collection, status_chunk, report):
+    """
+    Checks the users of a chunk of statuses once and inserts the accepted
+    ones unordered into report (a dedup.LoadReport); returns the number
+    inserted
+    """
+    accepted = status_collection.accept_known_users(status_chunk,
+                                                    report=report)
+    return report.insert(status_collection.status_collection, accepted)
+
+
+def _numbered_chunks(filename, size, progress, validate):
+    """
+    Yields (first row, end row, validate(chunk)) for the chunks of
+    filename that progress has not committed yet; size is a number of
+    rows or an autotune.BatchSizeTuner
+    """
+    start = progress.resume_row()
+    for chunk in autotune.read_chunks(filename, size, start):
+        end = start + len(chunk)
+        if not progress.is_done(start, end):
+            yield start, end, validate(chunk)
+        start = end
+
+
+def _run_task(task):
+    """
+    Runs worker(payload) in a pool process for task
+    (worker, start, end, payload); returns
+    (start, end, rows, outcome, seconds) where outcome is the worker's
+    dedup.LoadReport as a dict
+    """
+    worker, start, end, payload = task
+    began = time.perf_counter()
+    with logs.active(_WORKER['log']) as log:
+        rows, outcome = worker(payload)
+        log.batch(rows, outcome['inserted'], start, end)
+    return start, end, rows, outcome, time.perf_counter() - began
+
+
+def _run_loader_pool(worker, tasks, processes, database_name, progress,
+                     report, size=None):
+    """
+    Feeds (start, end, payload) tasks to a pool of loader processes,
+    commits each finished task to progress, merges the workers' outcomes
+    into report (a dedup.LoadReport) and returns (inserted documents,
+    loaded). A task that raises is logged; no further tasks are started,
+    the checkpoint is kept for a resume and loaded is False.
+
+    At most two tasks per process are in flight, so memory stays bounded
+    and an autotune.BatchSizeTuner given as size is told how long every
+    task took before the next chunks are read.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    finished = queue.Queue()
+    in_flight = 0
+    inserted = 0
+    errors = []
+    with multiprocessing.Pool(processes=processes,
+                              initializer=_init_loader_worker,
+                              initargs=(database_name,
+                                        progress.loader)) as pool:
+        for task in itertools.chain(tasks, [None]):
+            if task is not None:
+                pool.apply_async(_run_task, ((worker, *task), ),
+                                 callback=finished.put,
+                                 error_callback=finished.put)
+                in_flight += 1
+            while in_flight and (task is None or errors
+                                 or in_flight >= 2 * processes):
+                result = finished.get()
+                in_flight -= 1
+                if isinstance(result, Exception):
+                    errors.append(result)
+                    continue
+                start, end, rows, outcome, seconds = result
+                if isinstance(size, autotune.BatchSizeTuner):
+                    # The rows read, not those left after validation
+                    size.record(end - start, seconds)
+                progress.commit(start, end, rows, outcome['inserted'])
+                report.merge(outcome)
+                inserted += outcome['inserted']
+            if errors:
+                break
+    if errors:
+        logger.error(f"{progress.loader} of {progress.filename} failed: "
+                     f"{errors[0]!r}")
+        return inserted, False
+    _complete(progress)
+    return inserted, True
+
+
+def _complete(progress):
+    """
+    Removes the checkpoint of a finished load and adds the rows this run
+    loaded to the loader's metrics (for its rows/sec)
+    """
+    progress.complete()
+    metrics.add_rows(f"{__name__}.{progress.loader}", progress.run_rows)
+
+
+def _reported(loader, validator, report, outcome):
+    """
+    Logs the validation rejects and the dedup report of a load and fills
+    the outcome dict with the report; False if any row was rejected by
+    validation or by the loader (e.g. a status of an unknown user), or
+    failed to insert
+    """
+    valid = _validated(validator)
+    report.log(loader)
+    if outcome is not None:
+        outcome.update(report.as_dict())
+    return valid and report.clean()
+
+
+def _validated(validator):
+    """
+    Logs where the rows rejected by validator went; False if there were
+    any
+    """
+    report = validator.report()
+    if report['rejected']:
+        logger.error(f"{report['rejected']} of {report['rows']} rows failed "
+                     f"validation, see {report['rejects_file']}")
+        return False
     return True
 
 
-def load_status_multiprocess(filename, size=1000):
+def _report_tuning(size, tuning):
+    """
+    Logs the batch size an autotune.BatchSizeTuner chose and copies its
+    report into the tuning dict, if one was given
+    """
+    if not isinstance(size, autotune.BatchSizeTuner):
+        return
+    report = size.report()
+    logger.info(f"Batch size {report['size']} chosen at "
+                f"{report['docs_per_second']:.0f} docs/sec after "
+                f"{report['batches']} batches")
+    if tuning is not None:
+        tuning.update(report)
+
+
+@metrics.timed
+def load_users_ranges(filename, size=1000, processes=None,
+                      database_name=None, resume=False):
     '''
-    Imports CSV file in chunks of a defined size
+    Imports a user CSV file with each worker parsing its own byte range
+
+    The file is split into line-aligned byte ranges (see csv_ranges);
+    workers memory-map it, parse only their slice and insert it in
+    unordered batches of size rows. Nothing but the range offsets is sent
+    to the workers. Every range is checkpointed and resume=True continues
+    an interrupted load; a worker error is logged and returns False with
+    the checkpoint kept.
     '''
-    chunk_number = 0
-    processes = []
-    for chunk in pd.read_csv(filename, chunksize=size, iterator=True):
-        print(f"CHUNK {chunk_number}")
-        proc = multiprocessing.Process(target=load_status_worker,
-                                       args=(chunk, ))
-        processes.append(proc)
-        proc.start()
-        chunk_number += 1
-    for proc in processes:
-        print(f"waiting on {proc.name}")
-        proc.join()
-    return True
+    return _load_ranges(filename, 'load_users_ranges', load_users_range_worker,
+                        size, processes, database_name, resume, 'users')
 
 
-def load_status_worker(chunk):
+@metrics.timed
+def load_status_ranges(filename, size=1000, processes=None,
+                       database_name=None, resume=False):
+    '''
+    Imports a status CSV file with each worker parsing its own byte range
+
+    Like load_users_ranges; user existence is checked once per batch.
+    Quoted STATUS_TEXT values (commas, quotes, newlines) stay intact.
+    '''
+    return _load_ranges(filename, 'load_status_ranges',
+                        load_status_range_worker, size, processes,
+                        database_name, resume, 'status updates')
+
+
+def load_users_range_worker(task):
     """
-    The worker function for load status updates with multiprocessing
+    The worker function for load users by byte range
     """
-    with MongoDBConnection() as mongo:
-        database = mongo.connection.SocialNetwork
-        user_collection = init_user_collection(database)
-        status_collection = init_status_collection(database)
-        for _, row in chunk.iterrows():
-            status_collection.add_status(row['STATUS_ID'],row['USER_ID'],row['STATUS_TEXT'])
-    return True
+    rows = 0
+    report = dedup.LoadReport()
+    for chunk in csv_ranges.read_range(*task):
+        rows += len(chunk)
+        report.insert(_WORKER['database'].user_collection,
+                      report.unique(documents.user_documents(chunk)))
+    return rows, report.as_dict()
+
+
+def load_status_range_worker(task):
+    """
+    The worker function for load status updates by byte range
+    """
+    rows = 0
+    report = dedup.LoadReport()
+    for chunk in csv_ranges.read_range(*task):
+        rows += len(chunk)
+        _insert_statuses(_WORKER['status_collection'],
+                         report.unique(documents.status_documents(chunk)),
+                         report)
+    return rows, report.as_dict()
+
+
+def _load_ranges(filename, loader, worker, size, processes, database_name,
+                 resume, what):
+    """
+    Splits filename into byte ranges and loads them with a worker pool;
+    loader names the checkpoint and metrics of the load. Duplicate IDs
+    are skipped within each range.
+    """
+    if not os.path.exists(filename):
+        logger.error("Sorry, this file doesn't exist.")
+        return False
+    progress = checkpoint.Checkpoint(filename, loader, resume, unit='bytes')
+    processes = processes or multiprocessing.cpu_count()
+    header, ranges = csv_ranges.plan_ranges(filename, processes)
+    tasks = [(start, end, (filename, start, end, header, size))
+             for start, end in ranges if not progress.is_done(start, end)]
+    report = dedup.LoadReport()
+    inserted, loaded = _run_loader_pool(worker, tasks, processes,
+                                        database_name, progress, report)
+    logger.info(f"Loaded {inserted} {what} from {len(tasks)} byte ranges")
+    report.log(loader)
+    return report.clean() and loaded
+
+
+@metrics.timed
+def load_users_pipeline(filename, user_collection, size=None, converters=2,
+                        writers=2, queue_size=4, stats=None, resume=False,
+                        outcome=None):
+    '''
+    Loads a user CSV file through a reader -> converter -> writer
+    pipeline (see pipeline.IngestPipeline)
+
+    Up to queue_size chunks wait between stages, so memory stays flat.
+    Chunks hold size rows, or a tuned number of rows when size is None.
+    When a stats dict is given it is filled with the pipeline's queue
+    depths, per-stage throughput and batch size. Every written chunk is
+    checkpointed and resume=True continues an interrupted load.
+    Converters skip duplicate IDs (with several converters, which copy is
+    kept depends on their timing); the outcome dict is filled with
+    dedup's report.
+    '''
+    if not os.path.exists(filename):
+        logger.error("Sorry, this file doesn't exist.")
+        return False
+    progress = checkpoint.Checkpoint(filename, 'load_users_pipeline', resume)
+    validator = validation.Validator(filename, resume)
+    size = autotune.BatchSizeTuner() if size is None else size
+    report = dedup.LoadReport()
+    ingest = pipeline.IngestPipeline(
+        filename,
+        lambda chunk: report.unique(validator.user_documents(chunk)),
+        _batch_logged(lambda docs: report.insert(
+            user_collection.user_collection, docs)),
+        size, converters, writers, queue_size, progress)
+    with logs.bulk(progress.loader):
+        loaded = _run_pipeline(ingest, stats, progress)
+    return _reported(progress.loader, validator, report, outcome) and loaded
+
+
+@metrics.timed
+def load_status_pipeline(filename, status_collection, size=None,
+                         converters=2, writers=2, queue_size=4, stats=None,
+                         resume=False, outcome=None):
+    '''
+    Loads a status CSV file through a reader -> converter -> writer
+    pipeline (see pipeline.IngestPipeline)
+
+    Writers check user existence once per chunk; chunks hold size rows,
+    or a tuned number of rows when size is None. When a stats dict is
+    given it is filled with the pipeline's queue depths, per-stage
+    throughput and batch size. Every written chunk is checkpointed and
+    resume=True continues an interrupted load. Converters skip duplicate
+    IDs; the outcome dict is filled with dedup's report.
+    '''
+    if not os.path.exists(filename):
+        logger.error("Sorry, this file doesn't exist.")
+        return False
+    progress = checkpoint.Checkpoint(filename, 'load_status_pipeline',
+                                     resume)
+    validator = validation.Validator(filename, resume)
+    size = autotune.BatchSizeTuner() if size is None else size
+    report = dedup.LoadReport()
+    ingest = pipeline.IngestPipeline(
+        filename,
+        lambda chunk: report.unique(validator.status_documents(chunk)),
+        _batch_logged(lambda docs: _insert_statuses(
+            status_collection, docs, report)),
+        size, converters, writers, queue_size, progress)
+    with logs.bulk(progress.loader):
+        loaded = _run_pipeline(ingest, stats, progress)
+    return _reported(progress.loader, validator, report, outcome) and loaded
+
+
+def _batch_logged(write):
+    """
+    Wraps a pipeline write so that every batch is summarized in the
+    load's BulkLog (see logs)
+    """
+    def write_batch(docs):
+        written = write(docs)
+        logs.batch(len(docs), written)
+        return written
+    return write_batch
+
+
+def _run_pipeline(ingest, stats, progress):
+    """
+    Runs an IngestPipeline, logs and optionally returns its stats; False
+    if a stage failed, in which case the checkpoint is kept for a resume
+    """
+    loaded = True
+    try:
+        ingest.run()
+    except Exception as err:  # pylint: disable=W0703
+        logger.error(f"Pipeline load of {ingest.filename} failed: {err!r}")
+        loaded = False
+    else:
+        _complete(progress)
+    result = ingest.stats()
+    if stats is not None:
+        stats.update(result)
+    logger.info(f"Pipeline wrote {result['rows_written']} rows at "
+                f"{result['rows_per_second']:.0f} rows/sec, "
+                f"bottleneck: {result['bottleneck']}, "
+                f"batch size: {result['batch_size']['size']}")
+    return loaded
+
+
+@metrics.timed
+def sync_users(filename, user_collection, size=1000, delete_missing=False):
+    '''
+    Syncs a user CSV export into an existing instance of UserCollection,
+    writing only new or changed rows; with delete_missing, users missing
+    from the file are deleted. Rows are validated as the loaders do, and
+    the invalid ones go to the rejects CSV instead of being written.
+
+    Returns a dict of inserted, updated, unchanged, deleted, skipped,
+    rejected and failed counts, or False if the file does not exist.
+    '''
+    if not os.path.exists(filename):
+        logger.error("Sorry, this file doesn't exist.")
+        return False
+    validator = validation.Validator(filename)
+    with logs.bulk('sync_users'):
+        counts = user_collection.sync_users(filename, size, delete_missing,
+                                            validator)
+    _validated(validator)
+    metrics.add_rows(f"{__name__}.sync_users",
+                     sum(counts.values()) - counts['deleted'])
+    return counts
+
+
+@metrics.timed
+def sync_status_updates(filename, status_collection, size=1000,
+                        delete_missing=False):
+    '''
+    Syncs a status CSV export into an existing instance of
+    UserStatusCollection, writing only new or changed rows; with
+    delete_missing, statuses missing from the file are deleted. Rows are
+    validated as the loaders do, and the invalid ones go to the rejects CSV
+    instead of being written.
+
+    Returns a dict of inserted, updated, unchanged, deleted, skipped,
+    rejected and failed counts, or False if the file does not exist.
+    '''
+    if not os.path.exists(filename):
+        logger.error("Sorry, this file doesn't exist.")
+        return False
+    validator = validation.Validator(filename)
+    with logs.bulk('sync_status_updates'):
+        counts = status_collection.sync_statuses(filename, size,
+                                                 delete_missing, validator)
+    _validated(validator)
+    metrics.add_rows(f"{__name__}.sync_status_updates",
+                     sum(counts.values()) - counts['deleted'])
+    return counts
+
+
+@metrics.timed
+def export_users(filename, user_collection):
+    '''
+    Exports every user to filename as BSON documents, without decoding
+    them; returns the number exported
+    '''
+    return user_collection.export_users(filename)
 
 
+@metrics.timed
+def export_status_updates(filename, status_collection):
+    '''
+    Exports every status to filename as BSON documents, without decoding
+    them; returns the number exported
+    '''
+    return status_collection.export_statuses(filename)
+
+
+@metrics.timed
 def add_user(user_id, email, user_name, user_last_name, user_collection):
     '''
     Creates a new instance of User and stores it in user_collection
@@ -221,6 +752,7 @@ def add_user(user_id, email, user_name, user_last_name, user_collection):
     return user_collection.add_user(user_id,email,user_name,user_last_name)
 
 
+@metrics.timed
 def add_users(user_chunk, user_collection):
     """
     Add users to database in chunk
@@ -228,6 +760,18 @@ def add_users(user_chunk, user_collection):
     return user_collection.add_users(user_chunk)
 
 
+@metrics.timed
+def add_statuses(status_chunk, status_collection, rejects=None):
+    """
+    Add statuses to database in chunk
+
+    User existence is checked once for the whole chunk; statuses of
+    non-existing users are appended to rejects instead of inserted.
+    """
+    return status_collection.add_statuses(status_chunk, rejects=rejects)
+
+
+@metrics.timed
 def update_user(user_id, email, user_name, user_last_name, user_collection):
     '''
     Updates the values of an existing user
@@ -239,6 +783,7 @@ def update_user(user_id, email, user_name, user_last_name, user_collection):
     return user_collection.modify_user(user_id, email, user_name, user_last_name)
 
 
+@metrics.timed
 def delete_user(user_id, user_collection):
     '''
     Deletes a user from user_collection.
@@ -250,6 +795,30 @@ def delete_user(user_id, user_collection):
     return user_collection.delete_user(user_id)
 
 
+@metrics.timed
+def update_users(changes, user_collection):
+    '''
+    Updates many existing users in bulk
+
+    changes is a list of (user_id, email, user_name, user_last_name).
+    Returns a list with True or False for each change, as update_user
+    would.
+    '''
+    return user_collection.modify_users(changes)
+
+
+@metrics.timed
+def delete_users(user_ids, user_collection):
+    '''
+    Deletes many users (and their statuses) in bulk
+
+    Returns a list with True or False for each user_id, as delete_user
+    would.
+    '''
+    return user_collection.delete_users(user_ids)
+
+
+@metrics.timed
 def search_user(user_id, user_collection):
     '''
     Searches for a user in user_collection(which is an instance of
@@ -262,6 +831,7 @@ def search_user(user_id, user_collection):
     return user_collection.search_user(user_id)
 
 
+@metrics.timed
 def add_status(user_id, status_id, status_text, status_collection):
     '''
     Creates a new instance of UserStatus and stores it in
@@ -276,6 +846,18 @@ def add_status(user_id, status_id, status_text, status_collection):
     return status_collection.add_status(status_id, user_id, status_text)
 
 
+@metrics.timed
+def search_users(user_ids, user_collection):
+    '''
+    Searches for many users at once
+
+    Returns a list with the user for each user_id, or None where
+    search_user would return None.
+    '''
+    return user_collection.search_users(user_ids)
+
+
+@metrics.timed
 def update_status(status_id, user_id, status_text, status_collection):
     '''
     Updates the values of an existing status_id
@@ -287,6 +869,29 @@ def update_status(status_id, user_id, status_text, status_collection):
     return status_collection.modify_status(status_id, user_id, status_text)
 
 
+@metrics.timed
+def update_statuses(changes, status_collection):
+    '''
+    Updates many existing statuses in bulk
+
+    changes is a list of (status_id, user_id, status_text). Returns a list
+    with True or False for each change, as update_status would.
+    '''
+    return status_collection.modify_statuses(changes)
+
+
+@metrics.timed
+def delete_statuses(status_ids, status_collection):
+    '''
+    Deletes many statuses in bulk
+
+    Returns a list with True or False for each status_id, as
+    delete_status would.
+    '''
+    return status_collection.delete_statuses(status_ids)
+
+
+@metrics.timed
 def delete_status(status_id, status_collection):
     '''
     Deletes a status_id from user_collection.
@@ -298,6 +903,7 @@ def delete_status(status_id, status_collection):
     return status_collection.delete_status(status_id)
 
 
+@metrics.timed
 def search_status(status_id, status_collection):
     '''
     Searches for a status in status_collection
@@ -308,3 +914,25 @@ def search_status(status_id, status_collection):
     - Otherwise, it returns None.
     '''
     return status_collection.search_status(status_id)
+
+
+@metrics.timed
+def timeline(user_id, status_collection, limit=20, before=None):
+    '''
+    One page of a user's statuses, newest first
+
+    Returns (statuses, next_before); pass next_before as before to get the
+    next page. next_before is None on the last page.
+    '''
+    return status_collection.timeline(user_id, limit, before)
+
+
+@metrics.timed
+def search_statuses(status_ids, status_collection):
+    '''
+    Searches for many statuses at once
+
+    Returns a list with the status for each status_id, or None where
+    search_status would return None.
+    '''
+    return status_collection.search_statuses(status_ids)
@@ -0,0 +1,749 @@
+'''
+In-process, pure-Python storage engine for the social network collections
+
+MemoryClient / MemoryDatabase / MemoryCollection implement the subset of
+the pymongo client, database and collection API that UserAccounts and
+StatusUpdates use, so either backend can be passed where a pymongo
+database is expected:
+
+    database = memory_store.MemoryClient().SocialNetwork
+    user_collection = main.init_user_collection(database)
+
+Documents are stored in a dict keyed by _id, and the secondary indexes
+built by create_index map a field value to the set of _ids holding it
+(StatusUpdates declares one on user_id, which serves the per-user status
+lookups and the user cascade delete).
+Errors and results are pymongo's own classes, so callers cannot tell the
+backends apart.
+'''
+# pylint: disable=E0401
+
+import copy
+import threading
+import bson
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import (BulkWriteResult, DeleteResult, InsertManyResult,
+                             InsertOneResult, UpdateResult)
+
+DUPLICATE_KEY = 11000
+
+# Marks a field that is absent from a document
+_MISSING = object()
+
+
+def _compare(value, operator, operand):
+    '''
+    Evaluates one query operator against a document value
+    '''
+    # pylint: disable=R0911
+    if operator == '$in':
+        return value in operand
+    if operator == '$nin':
+        return value not in operand
+    if operator == '$ne':
+        return value != operand
+    if operator == '$exists':
+        return (value is not _MISSING) == bool(operand)
+    if value is _MISSING or value is None:
+        return False
+    if operator == '$gt':
+        return value > operand
+    if operator == '$gte':
+        return value >= operand
+    if operator == '$lt':
+        return value < operand
+    if operator == '$lte':
+        return value <= operand
+    raise ValueError(f"Unsupported query operator {operator}")
+
+
+def _is_operator_query(condition):
+    return isinstance(condition, dict) and condition and all(
+        key.startswith('$') for key in condition)
+
+
+def matches(document, query):
+    '''
+    True if document satisfies a (flat) Mongo query
+    '''
+    for field, condition in query.items():
+        value = document.get(field, _MISSING)
+        if _is_operator_query(condition):
+            for operator, operand in condition.items():
+                if not _compare(value, operator, operand):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def project(document, projection):
+    '''
+    Applies an inclusion or exclusion projection to a copy of document
+    '''
+    if not projection:
+        return dict(document)
+    if isinstance(projection, (list, tuple)):
+        projection = dict.fromkeys(projection, 1)
+    include = [field for field, flag in projection.items()
+               if flag and field != '_id']
+    if include:
+        result = {field: document[field] for field in include
+                  if field in document}
+        if projection.get('_id', 1) and '_id' in document:
+            result = {'_id': document['_id'], **result}
+        return result
+    return {field: value for field, value in document.items()
+            if projection.get(field, 1)}
+
+
+class MemoryCursor():
+    '''
+    Iterable result of MemoryCollection.find
+    '''
+    def __init__(self, collection, query, projection):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        '''
+        Sorts by one field, or by a list of (field, direction) pairs
+        '''
+        self._sort = key if isinstance(key, list) else [(key, direction)]
+        return self
+
+    def skip(self, count):
+        '''
+        Skips the first count documents
+        '''
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        '''
+        Returns at most count documents (0 means no limit)
+        '''
+        self._limit = count
+        return self
+
+    def explain(self):
+        '''
+        The query plan, in the shape of pymongo's Cursor.explain()
+        '''
+        return self.collection.explain(self.query)
+
+    def batch_size(self, _size):
+        '''
+        Accepted for pymongo compatibility; there are no network batches
+        '''
+        return self
+
+    def __iter__(self):
+        documents = self.collection.find_documents(self.query)
+        for field, direction in reversed(self._sort or []):
+            documents.sort(key=lambda doc, field=field: (
+                doc.get(field) is not None, doc.get(field)),
+                           reverse=direction < 0)
+        end = self._skip + self._limit if self._limit else None
+        for document in documents[self._skip:end]:
+            yield self.collection.decode(project(document, self.projection))
+
+
+class MemoryCollection():
+    '''
+    A collection of documents kept in a dict keyed by _id
+    '''
+    def __init__(self, name):
+        self.name = name
+        self._documents = {}
+        # field -> value -> set of _ids, one per indexed leading field
+        self._indexes = {}
+        self._index_specs = {'_id_': {'key': [('_id', 1)], 'unique': True}}
+        self._unique_fields = set()
+        self._lock = threading.RLock()
+        self.codec_options = None
+
+    def with_options(self, codec_options=None, **_options):
+        '''
+        The same collection returning documents decoded with
+        codec_options (e.g. as bson.raw_bson.RawBSONDocument)
+        '''
+        view = copy.copy(self)
+        view.codec_options = codec_options
+        return view
+
+    def decode(self, document):
+        '''
+        A stored document as the codec options return it
+        '''
+        if self.codec_options is None:
+            return document
+        return bson.decode(bson.encode(document), self.codec_options)
+
+    def _index_add(self, document):
+        for field, index in self._indexes.items():
+            if field in document:
+                index.setdefault(document[field], set()).add(document['_id'])
+
+    def _index_remove(self, document):
+        for field, index in self._indexes.items():
+            if field in document:
+                ids = index.get(document[field])
+                if ids is not None:
+                    ids.discard(document['_id'])
+                    if not ids:
+                        del index[document[field]]
+
+    def _check_unique(self, document):
+        '''
+        Raises DuplicateKeyError if document clashes with another one on a
+        unique index
+        '''
+        for field in self._unique_fields:
+            if field not in document:
+                continue
+            holders = self._indexes[field].get(document[field], ())
+            if any(_id != document['_id'] for _id in holders):
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.name} "
+                    f"index: {field}_1 dup key: "
+                    f"{{ {field}: {document[field]!r} }}",
+                    DUPLICATE_KEY, {'keyValue': {field: document[field]}})
+
+    def create_index(self, keys, unique=False, name=None, **_options):
+        '''
+        Builds a secondary index on the leading field of keys
+
+        Compound indexes are served by their leading field plus a sort,
+        which is all the engine needs for equality-prefix queries.
+        '''
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        keys = [tuple(key) for key in keys]
+        name = name or '_'.join(f"{field}_{direction}"
+                                for field, direction in keys)
+        spec = {'key': keys, 'unique': unique}
+        with self._lock:
+            existing = self._index_specs.get(name)
+            if existing is not None:
+                if existing != spec:
+                    raise OperationFailure(
+                        f"Index with name: {name} already exists with "
+                        f"different options", 85)
+                return name
+            field = keys[0][0]
+            if field == '_id':
+                self._index_specs[name] = spec
+                return name
+            index = {}
+            for document in self._documents.values():
+                if field in document:
+                    index.setdefault(document[field], set()).add(
+                        document['_id'])
+            if unique and any(len(ids) > 1 for ids in index.values()):
+                raise OperationFailure(
+                    f"E11000 duplicate key error collection: {self.name} "
+                    f"index: {name}", DUPLICATE_KEY)
+            self._indexes.setdefault(field, index)
+            if unique and len(keys) == 1:
+                self._unique_fields.add(field)
+            self._index_specs[name] = spec
+        return name
+
+    def index_information(self):
+        '''
+        Index name -> {'key': [(field, direction), ...], 'unique': bool}
+        '''
+        return {name: {'key': list(spec['key']), 'unique': spec['unique']}
+                for name, spec in self._index_specs.items()}
+
+    def _candidate_ids(self, query):
+        '''
+        Uses the _id key or a secondary index to narrow the documents a
+        query has to look at; None means a full scan
+        '''
+        field = self._plan_field(query)
+        if field is None:
+            return None
+        condition = query[field]
+        if _is_operator_query(condition):
+            values = dict.fromkeys(condition['$in'])
+        else:
+            values = [condition]
+        if field == '_id':
+            return [value for value in values if value in self._documents]
+        index = self._indexes[field]
+        return [_id for value in values for _id in index.get(value, ())]
+
+    def _plan_field(self, query):
+        '''
+        The key or indexed field a query can be answered from, or None
+        '''
+        for field in ['_id', *self._indexes]:
+            if field not in query:
+                continue
+            condition = query[field]
+            if not _is_operator_query(condition) or '$in' in condition:
+                return field
+        return None
+
+    def explain(self, query):
+        '''
+        Describes how query is executed, in explain() output format
+        '''
+        field = self._plan_field(query)
+        if field is None:
+            plan = {'stage': 'COLLSCAN'}
+        elif field == '_id':
+            plan = {'stage': 'IDHACK'}
+        else:
+            name = next(name for name, spec in self._index_specs.items()
+                        if spec['key'][0][0] == field)
+            plan = {'stage': 'FETCH',
+                    'inputStage': {'stage': 'IXSCAN', 'indexName': name}}
+        return {'queryPlanner': {'namespace': self.name,
+                                 'winningPlan': plan}}
+
+    def find_documents(self, query=None):
+        '''
+        Returns the stored documents matching query (not copies)
+        '''
+        query = query or {}
+        with self._lock:
+            candidates = self._candidate_ids(query)
+            if candidates is None:
+                documents = self._documents.values()
+            else:
+                documents = [self._documents[_id] for _id in candidates]
+            return [doc for doc in documents if matches(doc, query)]
+
+    def _insert(self, document):
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+        if document['_id'] in self._documents:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.name} "
+                f"index: _id_ dup key: {{ _id: {document['_id']!r} }}",
+                DUPLICATE_KEY, {'keyValue': {'_id': document['_id']}})
+        stored = dict(document)
+        self._check_unique(stored)
+        self._documents[stored['_id']] = stored
+        self._index_add(stored)
+        return stored['_id']
+
+    def insert_one(self, document):
+        '''
+        Inserts one document, raises DuplicateKeyError on an existing _id
+        '''
+        with self._lock:
+            return InsertOneResult(self._insert(document), True)
+
+    def insert_many(self, documents, ordered=True):
+        '''
+        Inserts documents, raises BulkWriteError listing the failures
+        '''
+        inserted_ids = []
+        write_errors = []
+        with self._lock:
+            for position, document in enumerate(documents):
+                try:
+                    inserted_ids.append(self._insert(document))
+                except DuplicateKeyError as err:
+                    write_errors.append({'index': position,
+                                         'code': DUPLICATE_KEY,
+                                         'errmsg': str(err),
+                                         'keyValue':
+                                         err.details['keyValue'],
+                                         'op': document})
+                    if ordered:
+                        break
+        if write_errors:
+            raise BulkWriteError({'writeErrors': write_errors,
+                                  'writeConcernErrors': [],
+                                  'nInserted': len(inserted_ids),
+                                  'nUpserted': 0, 'nMatched': 0,
+                                  'nModified': 0, 'nRemoved': 0,
+                                  'upserted': []})
+        return InsertManyResult(inserted_ids, True)
+
+    def find(self, query=None, projection=None):
+        '''
+        Returns a cursor over the documents matching query
+        '''
+        return MemoryCursor(self, query or {}, projection)
+
+    def find_one(self, query=None, projection=None):
+        '''
+        Returns the first document matching query, or None
+        '''
+        query = query or {}
+        if len(query) == 1 and '_id' in query and not isinstance(
+                query['_id'], dict):
+            document = self._documents.get(query['_id'])
+            return None if document is None else self.decode(
+                project(document, projection))
+        for document in self.find(query, projection).limit(1):
+            return document
+        return None
+
+    def count_documents(self, query):
+        '''
+        Number of documents matching query
+        '''
+        if not query:
+            return len(self._documents)
+        return len(self.find_documents(query))
+
+    def _upsert(self, query, fields):
+        '''
+        Inserts the document an upsert creates: the equality conditions of
+        query plus fields
+        '''
+        document = {field: condition for field, condition in query.items()
+                    if not _is_operator_query(condition)}
+        document.update(copy.deepcopy(fields))
+        return self._insert(document)
+
+    def _update(self, query, update, many, upsert=False):
+        unsupported = set(update) - {'$set', '$setOnInsert'}
+        if unsupported:
+            raise ValueError(f"Unsupported update operators {unsupported}")
+        with self._lock:
+            documents = self.find_documents(query)
+            if not documents and upsert:
+                upserted = self._upsert(query, {**update.get('$setOnInsert',
+                                                             {}),
+                                                **update.get('$set', {})})
+                return UpdateResult({'n': 1, 'nModified': 0,
+                                     'upserted': upserted, 'ok': 1.0}, True)
+            if not many:
+                documents = documents[:1]
+            modified = 0
+            for document in documents:
+                changes = {field: value for field, value
+                           in update.get('$set', {}).items()
+                           if document.get(field, _MISSING) != value}
+                if changes:
+                    self._replace(document, {**document, **changes})
+                    modified += 1
+        return UpdateResult({'n': len(documents), 'nModified': modified,
+                             'ok': 1.0}, True)
+
+    def _replace(self, document, new_document):
+        '''
+        Swaps the stored document for new_document (same _id)
+        '''
+        new_document = {'_id': document['_id'],
+                        **{field: copy.deepcopy(value) for field, value
+                           in new_document.items() if field != '_id'}}
+        self._check_unique(new_document)
+        self._index_remove(document)
+        self._documents[document['_id']] = new_document
+        self._index_add(new_document)
+
+    def update_one(self, query, update, upsert=False):
+        '''
+        Applies a $set update to the first document matching query
+        '''
+        return self._update(query, update, many=False, upsert=upsert)
+
+    def update_many(self, query, update, upsert=False):
+        '''
+        Applies a $set update to every document matching query
+        '''
+        return self._update(query, update, many=True, upsert=upsert)
+
+    def replace_one(self, query, replacement, upsert=False):
+        '''
+        Replaces the first document matching query
+        '''
+        with self._lock:
+            documents = self.find_documents(query)
+            if not documents:
+                if upsert:
+                    upserted = self._upsert(query, replacement)
+                    return UpdateResult({'n': 1, 'nModified': 0,
+                                         'upserted': upserted, 'ok': 1.0},
+                                        True)
+                return UpdateResult({'n': 0, 'nModified': 0, 'ok': 1.0}, True)
+            modified = int(project(documents[0], None) != {
+                **replacement, '_id': documents[0]['_id']})
+            self._replace(documents[0], replacement)
+        return UpdateResult({'n': 1, 'nModified': modified, 'ok': 1.0}, True)
+
+    def _delete(self, query, many):
+        with self._lock:
+            documents = self.find_documents(query)
+            if not many:
+                documents = documents[:1]
+            for document in documents:
+                self._index_remove(document)
+                del self._documents[document['_id']]
+        return DeleteResult({'n': len(documents), 'ok': 1.0}, True)
+
+    def delete_one(self, query):
+        '''
+        Deletes the first document matching query
+        '''
+        return self._delete(query, many=False)
+
+    def delete_many(self, query):
+        '''
+        Deletes every document matching query
+        '''
+        return self._delete(query, many=True)
+
+    def _bulk_operation(self, operation):
+        '''
+        Runs one pymongo bulk operation (InsertOne, UpdateOne, ...) and
+        returns its result
+        '''
+        # pylint: disable=W0212
+        kind = type(operation).__name__
+        if kind == 'InsertOne':
+            return self.insert_one(operation._doc)
+        if kind in ('UpdateOne', 'UpdateMany'):
+            return self._update(operation._filter, operation._doc,
+                                many=kind == 'UpdateMany',
+                                upsert=bool(operation._upsert))
+        if kind == 'ReplaceOne':
+            return self.replace_one(operation._filter, operation._doc,
+                                    upsert=bool(operation._upsert))
+        if kind in ('DeleteOne', 'DeleteMany'):
+            return self._delete(operation._filter, many=kind == 'DeleteMany')
+        raise ValueError(f"Unsupported bulk operation {kind}")
+
+    def bulk_write(self, requests, ordered=True):
+        '''
+        Applies a list of pymongo bulk operations, raising BulkWriteError
+        listing the ones that failed
+        '''
+        totals = {'writeErrors': [], 'writeConcernErrors': [],
+                  'nInserted': 0, 'nUpserted': 0, 'nMatched': 0,
+                  'nModified': 0, 'nRemoved': 0, 'upserted': []}
+        with self._lock:
+            for position, operation in enumerate(requests):
+                try:
+                    result = self._bulk_operation(operation)
+                except DuplicateKeyError as err:
+                    totals['writeErrors'].append(
+                        {'index': position, 'code': DUPLICATE_KEY,
+                         'errmsg': str(err),
+                         'keyValue': err.details['keyValue'],
+                         'op': operation})
+                    if ordered:
+                        break
+                    continue
+                if isinstance(result, InsertOneResult):
+                    totals['nInserted'] += 1
+                elif isinstance(result, DeleteResult):
+                    totals['nRemoved'] += result.deleted_count
+                elif result.upserted_id is not None:
+                    totals['nUpserted'] += 1
+                    totals['upserted'].append({'index': position,
+                                               '_id': result.upserted_id})
+                else:
+                    totals['nMatched'] += result.matched_count
+                    totals['nModified'] += result.modified_count
+        if totals['writeErrors']:
+            raise BulkWriteError(totals)
+        return BulkWriteResult(totals, True)
+
+    def drop(self):
+        '''
+        Removes every document
+        '''
+        with self._lock:
+            self._documents.clear()
+            self._indexes.clear()
+            self._unique_fields.clear()
+            self._index_specs = {'_id_': self._index_specs['_id_']}
+
+
+class MemoryDatabase():
+    '''
+    A named group of MemoryCollections, created on first access
+    '''
+    def __init__(self, name):
+        self.name = name
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def list_collection_names(self):
+        '''
+        Names of the collections created so far
+        '''
+        return list(self._collections)
+
+    def drop_collection(self, name):
+        '''
+        Forgets a collection and its documents
+        '''
+        self._collections.pop(name, None)
+
+
+class MemoryClient():
+    '''
+    Stand-in for MongoClient holding MemoryDatabases
+    '''
+    def __init__(self):
+        self._databases = {}
+
+    def __getitem__(self, name):
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(name)
+        return self._databases[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def list_database_names(self):
+        '''
+        Names of the databases created so far
+        '''
+        return list(self._databases)
+
+    def drop_database(self, name):
+        '''
+        Forgets a database and all its collections
+        '''
+        self._databases.pop(name, None)
+
+    def close(self):
+        '''
+        Nothing to release; kept for MongoClient compatibility
+        '''
+
+
+class AsyncMemoryCursor():
+    '''
+    Async iterable over a MemoryCursor, shaped like pymongo's AsyncCursor
+    '''
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, key, direction=1):
+        '''
+        See MemoryCursor.sort
+        '''
+        self.cursor.sort(key, direction)
+        return self
+
+    def skip(self, count):
+        '''
+        See MemoryCursor.skip
+        '''
+        self.cursor.skip(count)
+        return self
+
+    def limit(self, count):
+        '''
+        See MemoryCursor.limit
+        '''
+        self.cursor.limit(count)
+        return self
+
+    def batch_size(self, size):
+        '''
+        See MemoryCursor.batch_size
+        '''
+        self.cursor.batch_size(size)
+        return self
+
+    async def _iterate(self):
+        for document in self.cursor:
+            yield document
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def to_list(self, length=None):
+        '''
+        All (or the first length) documents as a list
+        '''
+        documents = list(self.cursor)
+        return documents if length is None else documents[:length]
+
+
+class AsyncMemoryCollection():
+    '''
+    Coroutine front end of a MemoryCollection, shaped like pymongo's
+    AsyncCollection; every method except find is awaitable
+    '''
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+
+    def find(self, query=None, projection=None):
+        '''
+        Returns an async cursor over the documents matching query
+        '''
+        return AsyncMemoryCursor(self.collection.find(query, projection))
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+class AsyncMemoryDatabase():
+    '''
+    Async view of a MemoryDatabase
+    '''
+    def __init__(self, database):
+        self.database = database
+        self.name = database.name
+
+    def __getitem__(self, name):
+        return AsyncMemoryCollection(self.database[name])
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+
+class AsyncMemoryClient():
+    '''
+    Stand-in for pymongo's AsyncMongoClient; it may share its databases
+    with a MemoryClient
+    '''
+    def __init__(self, client=None):
+        self.client = client or MemoryClient()
+
+    def __getitem__(self, name):
+        return AsyncMemoryDatabase(self.client[name])
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    async def drop_database(self, name):
+        '''
+        Forgets a database and all its collections
+        '''
+        self.client.drop_database(name)
+
+    async def close(self):
+        '''
+        Nothing to release; kept for AsyncMongoClient compatibility
+        '''
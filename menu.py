@@ -3,20 +3,19 @@ Provides a basic frontend
 '''
 # pylint: disable=C0103
 # pylint: disable=E0401
-# pylint: disable=W0612 # Unused variable 't' (unused-variable) # context manager
 
 import datetime
 import sys
 from loguru import logger
+import logs
 import main
-from timer_context import Timer
+import metrics
 
 #log code
 #create a file called log_mm_dd_yyyy.log
 date_time = datetime.datetime.today()
 log_date = date_time.strftime("%d_%m_%Y")
-logger.remove()
-logger.add(f"log_{log_date}.log")
+logs.configure(f"log_{log_date}.log")
 
 
 def load_users():
@@ -24,8 +23,7 @@ def load_users():
     Loads user accounts from a file
     '''
     filename = input('Enter filename of user file: ')
-    with Timer() as t:
-        result = main.load_users(filename, user_collection)
+    result = main.load_users(filename, user_collection)
     if not result:
         logger.error("Error occurred when trying to load user accounts "
                      "database from file.")
@@ -38,8 +36,7 @@ def load_users_chunks():
     Load users from file in chunks
     """
     filename = input('Enter filename of user file: ')
-    with Timer() as t:
-        result = main.load_users_chunks(filename, user_collection)
+    result = main.load_users_chunks(filename, user_collection)
     if not result:
         logger.error("Error occurred when trying to load user accounts "
                      "database from file.")
@@ -52,8 +49,7 @@ def load_users_multiprocess():
     Loads user accounts from a file
     '''
     filename = input('Enter filename of user file: ')
-    with Timer() as t:
-        result = main.load_users_multiprocess(filename, size=500)
+    result = main.load_users_multiprocess(filename)
     if not result:
         logger.error("Error occurred when trying to load user accounts "
                      "database from file.")
@@ -66,8 +62,7 @@ def load_status_updates():
     Loads status updates from a file
     '''
     filename = input('Enter filename for status file: ')
-    with Timer() as t:
-        result = main.load_status_updates(filename, status_collection)
+    result = main.load_status_updates(filename, status_collection)
     if not result:
         logger.error("Error occurred when trying to load status updates "
                      "database from file")
@@ -80,8 +75,7 @@ def load_status_updates_chunks():
     Load status updates in chunks
     """
     filename = input('Enter filename for status file: ')
-    with Timer() as t:
-        result = main.load_status_updates_chunks(filename, status_collection)
+    result = main.load_status_updates_chunks(filename, status_collection)
     if not result:
         logger.error("Error occurred when trying to load status updates "
                      "database from file")
@@ -94,8 +88,7 @@ def load_status_updates_multiprocess():
     Load status updates in chunks
     """
     filename = input('Enter filename for status file: ')
-    with Timer() as t:
-        result = main.load_status_multiprocess(filename, size=50000)
+    result = main.load_status_multiprocess(filename)
     if not result:
         logger.error("Error occurred when trying to load status updates "
                      "database from file")
@@ -111,12 +104,11 @@ def add_user():
     email = input('User email: ')
     user_name = input('User name: ')
     user_last_name = input('User last name: ')
-    with Timer() as t:
-        result = main.add_user(user_id,
-                               email,
-                               user_name,
-                               user_last_name,
-                               user_collection)
+    result = main.add_user(user_id,
+                           email,
+                           user_name,
+                           user_last_name,
+                           user_collection)
     if not result:
         logger.error("An error occurred while trying to add new user")
     else:
@@ -132,12 +124,11 @@ def update_user():
     email = input('User email: ')
     user_name = input('User name: ')
     user_last_name = input('User last name: ')
-    with Timer() as t:
-        result = main.update_user(user_id,
-                                  email,
-                                  user_name,
-                                  user_last_name,
-                                  user_collection)
+    result = main.update_user(user_id,
+                              email,
+                              user_name,
+                              user_last_name,
+                              user_collection)
     if not result:
         logger.error("An error occurred while trying to update user")
     else:
@@ -149,8 +140,7 @@ def search_user():
     Searches a user in the database
     '''
     user_id = input('Enter user ID to search: ')
-    with Timer() as t:
-        result = main.search_user(user_id, user_collection)
+    result = main.search_user(user_id, user_collection)
     if result is None:
         print("ERROR: User does not exist")
         logger.error("An error occurred while trying to search user")
@@ -167,8 +157,7 @@ def delete_user():
     Deletes user from the database
     '''
     user_id = input('User ID: ')
-    with Timer() as t:
-        result = main.delete_user(user_id, user_collection)
+    result = main.delete_user(user_id, user_collection)
     if not result:
         logger.error("An error occurred while trying to delete user")
     else:
@@ -182,11 +171,10 @@ def add_status():
     user_id = input('User ID: ')
     status_id = input('Status ID: ')
     status_text = input('Status text: ')
-    with Timer() as t:
-        result = main.add_status(user_id,
-                                 status_id,
-                                 status_text,
-                                 status_collection)
+    result = main.add_status(user_id,
+                             status_id,
+                             status_text,
+                             status_collection)
     if not result:
         logger.error("An error occurred while trying to add new status")
     else:
@@ -200,11 +188,10 @@ def update_status():
     user_id = input('User ID: ')
     status_id = input('Status ID: ')
     status_text = input('Status text: ')
-    with Timer() as t:
-        result = main.update_status(status_id,
-                                    user_id,
-                                    status_text,
-                                    status_collection)
+    result = main.update_status(status_id,
+                                user_id,
+                                status_text,
+                                status_collection)
     if not result:
         logger.error("An error occurred while trying to update status")
         return False
@@ -217,8 +204,7 @@ def search_status():
     Searches a status in the database
     '''
     status_id = input('Enter status ID to search: ')
-    with Timer() as t:
-        result = main.search_status(status_id, status_collection)
+    result = main.search_status(status_id, status_collection)
     if result is None:
         logger.error("ERROR: Status does not exist")
     else:
@@ -233,8 +219,7 @@ def delete_status():
     Deletes status from the database
     '''
     status_id = input('Status ID: ')
-    with Timer() as t:
-        result = main.delete_status(status_id, status_collection)
+    result = main.delete_status(status_id, status_collection)
     if not result:
         logger.error("An error occurred while trying to delete status")
     else:
@@ -247,13 +232,50 @@ def clear_database():
     """
     permission = input("Are you sure to clear your existing database? (Y/N)")
     if permission.lower() == 'y':
-        mongo.connection.drop_database('SocialNetwork')
+        mongo.connection.drop_database(mongo.database.name)
     elif permission.lower() == 'n':
         print("The existing database was not cleared.")
     else:
         print("Not valid option")
 
 
+def view_timeline():
+    '''
+    Shows a user's statuses a page at a time, newest first
+    '''
+    user_id = input('User ID: ')
+    before = None
+    while True:
+        statuses, before = main.timeline(user_id, status_collection, 10,
+                                         before)
+        for status in statuses:
+            print(f"{status.status_id}: {status.status_text}")
+        if before is None:
+            if not statuses:
+                print(f"No statuses for user {user_id}")
+            return
+        if input('Enter for more, anything else to stop: '):
+            return
+
+
+def view_metrics():
+    '''
+    Shows count, errors, latency percentiles and rows/sec of every
+    operation called so far, and optionally exports them
+    '''
+    print(f"{'operation':<45} {'count':>7} {'errors':>6} {'p50 ms':>9} "
+          f"{'p95 ms':>9} {'p99 ms':>9} {'rows/sec':>10}")
+    for name, stats in metrics.snapshot().items():
+        print(f"{name:<45} {stats['count']:>7} {stats['errors']:>6} "
+              f"{stats['p50'] * 1000:>9.3f} {stats['p95'] * 1000:>9.3f} "
+              f"{stats['p99'] * 1000:>9.3f} {stats['rows_per_second']:>10.0f}")
+    path = input('Export to file (.json or .prom, blank to skip): ')
+    if path.endswith('.json'):
+        metrics.to_json(path)
+    elif path:
+        metrics.to_prometheus(path)
+
+
 def quit_program():
     '''
     Quits program
@@ -263,7 +285,7 @@ def quit_program():
 
 if __name__ == '__main__':
     with main.MongoDBConnection() as mongo:
-        database = mongo.connection.SocialNetwork
+        database = mongo.database
         user_collection = main.init_user_collection(database)
         status_collection = main.init_status_collection(database)
 
@@ -283,7 +305,9 @@ if __name__ == '__main__':
             'M': load_status_updates_chunks,
             'N': load_users_multiprocess,
             'O': load_status_updates_multiprocess,
-            'Q': quit_program
+            'P': view_metrics,
+            'Q': quit_program,
+            'R': view_timeline
         }
         while True:
             user_selection = input("""
@@ -302,6 +326,8 @@ if __name__ == '__main__':
                                 M: Load status updates chunks
                                 N: Load users multiprocess
                                 O: Load status updates multiprocess
+                                P: View metrics
+                                R: View user timeline
                                 Q: Quit
     
                                 Please enter your choice: """)
@@ -0,0 +1,247 @@
+'''
+Counts, errors and latency histograms of the public operations
+
+Functions decorated with @timed record every call under
+"<module>.<qualified name>", e.g. main.add_user or
+users.UserAccounts.search_user:
+
+    @metrics.timed
+    def add_user(user_id, email, user_name, user_last_name, user_collection):
+        ...
+
+A call counts as an error when it raises or returns False (the way this
+project reports failures). Latencies go into a fixed log-scale histogram
+(8 buckets per doubling, about 9% resolution, 1 microsecond to ~70
+minutes), so recording is a bisect and a few additions under a lock,
+cheap enough to leave on in the hot path. Loaders add the rows they
+loaded with add_rows, which gives rows/sec.
+
+    metrics.snapshot()          # {name: {count, errors, p50, p95, ...}}
+    metrics.to_json()           # the snapshot as JSON
+    metrics.to_prometheus()     # Prometheus text exposition format
+
+Each process keeps its own registry; the loaders record in the parent.
+'''
+
+import bisect
+import functools
+import json
+import math
+import threading
+import time
+import profiler
+
+# Upper bounds (seconds) of the latency buckets: 2 ** (1/8) apart
+BUCKET_BOUNDS = [1e-6 * 2 ** (step / 8) for step in range(8 * 32)]
+
+# Every 8th bound (1, 2, 4, ... microseconds) is exported as a Prometheus
+# bucket
+_EXPORTED_BOUNDS = range(0, len(BUCKET_BOUNDS), 8)
+
+
+class OperationStats():
+    '''
+    Calls, errors, rows and the latency histogram of one operation
+    '''
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''
+        Zeroes every counter
+        '''
+        with self._lock:
+            self.count = 0
+            self.errors = 0
+            self.rows = 0
+            self.total_seconds = 0.0
+            self.max_seconds = 0.0
+            self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def record(self, seconds, error=False):
+        '''
+        Adds one call that took seconds
+        '''
+        bucket = bisect.bisect_left(BUCKET_BOUNDS, seconds)
+        with self._lock:
+            self.count += 1
+            self.errors += error
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.buckets[bucket] += 1
+
+    def add_rows(self, rows):
+        '''
+        Adds rows processed by the operation
+        '''
+        with self._lock:
+            self.rows += rows
+
+    def percentile(self, fraction):
+        '''
+        Latency below which fraction of the calls fall, to bucket
+        resolution (the geometric middle of the bucket)
+        '''
+        if not self.count:
+            return 0.0
+        rank = math.ceil(fraction * self.count)
+        seen = 0
+        for upper, calls in zip(BUCKET_BOUNDS, self.buckets):
+            seen += calls
+            if seen >= rank:
+                return min(upper / 2 ** (1 / 16), self.max_seconds)
+        # In the overflow bucket past the last bound
+        return self.max_seconds
+
+    def as_dict(self):
+        '''
+        Counters, latency percentiles and rows/sec
+        '''
+        with self._lock:
+            return {'count': self.count,
+                    'errors': self.errors,
+                    'total_seconds': self.total_seconds,
+                    'mean': (self.total_seconds / self.count
+                             if self.count else 0.0),
+                    'p50': self.percentile(0.50),
+                    'p95': self.percentile(0.95),
+                    'p99': self.percentile(0.99),
+                    'max': self.max_seconds,
+                    'rows': self.rows,
+                    'rows_per_second': (self.rows / self.total_seconds
+                                        if self.total_seconds else 0.0)}
+
+
+class Registry():
+    '''
+    The OperationStats of every operation, by name
+    '''
+    def __init__(self):
+        self.operations = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        '''
+        The OperationStats of name, created on first use
+        '''
+        stats = self.operations.get(name)
+        if stats is None:
+            with self._lock:
+                stats = self.operations.setdefault(name,
+                                                   OperationStats(name))
+        return stats
+
+    def clear(self):
+        '''
+        Zeroes every operation
+        '''
+        with self._lock:
+            for stats in self.operations.values():
+                stats.reset()
+
+
+REGISTRY = Registry()
+
+
+def timed(func):
+    '''
+    Decorator recording every call of func in REGISTRY (and, while
+    profiling, the Mongo commands it sends; see profiler)
+    '''
+    stats = REGISTRY.get(f"{func.__module__}.{func.__qualname__}")
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiled = profiler.ENABLED
+        if profiled:
+            token = profiler.enter(stats.name)
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            stats.record(time.perf_counter() - start, True)
+            raise
+        finally:
+            if profiled:
+                profiler.leave(token)
+        stats.record(time.perf_counter() - start, result is False)
+        return result
+    return wrapper
+
+
+def add_rows(name, rows):
+    '''
+    Adds rows loaded by the operation name, for its rows/sec
+    '''
+    REGISTRY.get(name).add_rows(rows)
+
+
+def snapshot():
+    '''
+    {operation: counters, percentiles and rows/sec} of every operation
+    that was called
+    '''
+    return {name: stats.as_dict()
+            for name, stats in sorted(REGISTRY.operations.items())
+            if stats.count}
+
+
+def to_json(path=None):
+    '''
+    The snapshot as JSON, also written to path if one is given
+    '''
+    text = json.dumps({'created': time.time(), 'operations': snapshot()},
+                      indent=2)
+    if path is not None:
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+    return text
+
+
+def to_prometheus(path=None):
+    '''
+    Every operation in the Prometheus text exposition format, also
+    written to path if one is given (e.g. for node_exporter's textfile
+    collector)
+    '''
+    lines = ['# HELP social_network_operation_seconds Latency of public '
+             'operations',
+             '# TYPE social_network_operation_seconds histogram']
+    counters = []
+    for name, stats in sorted(REGISTRY.operations.items()):
+        if not stats.count:
+            continue
+        label = f'operation="{name}"'
+        with stats._lock:  # pylint: disable=W0212
+            buckets = list(stats.buckets)
+            total, errors, rows = stats.total_seconds, stats.errors, stats.rows
+        cumulative = 0
+        seen = 0
+        for bound in _EXPORTED_BOUNDS:
+            cumulative += sum(buckets[seen:bound + 1])
+            seen = bound + 1
+            lines.append(f'social_network_operation_seconds_bucket'
+                         f'{{{label},le="{BUCKET_BOUNDS[bound]:.6g}"}} '
+                         f'{cumulative}')
+        lines.append(f'social_network_operation_seconds_bucket'
+                     f'{{{label},le="+Inf"}} {sum(buckets)}')
+        lines.append(f'social_network_operation_seconds_sum{{{label}}} '
+                     f'{total:.9g}')
+        lines.append(f'social_network_operation_seconds_count{{{label}}} '
+                     f'{sum(buckets)}')
+        counters.append((label, errors, rows))
+    lines += ['# HELP social_network_operation_errors_total Failed calls',
+              '# TYPE social_network_operation_errors_total counter']
+    lines += [f'social_network_operation_errors_total{{{label}}} {errors}'
+              for label, errors, _ in counters]
+    lines += ['# HELP social_network_rows_loaded_total Rows loaded',
+              '# TYPE social_network_rows_loaded_total counter']
+    lines += [f'social_network_rows_loaded_total{{{label}}} {rows}'
+              for label, _, rows in counters if rows]
+    text = '\n'.join(lines) + '\n'
+    if path is not None:
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+    return text
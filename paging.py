@@ -0,0 +1,63 @@
+'''
+Keyset pagination over a collection in _id order
+
+Each page is one query for the next batch_size documents after the last
+_id seen:
+
+    find({..., '_id': {'$gt': last_id}}, projection)
+        .sort('_id', 1).limit(batch_size)
+
+Unlike skip/limit, a page costs the same however deep into the
+collection it starts (the _id index, or a compound index ending in _id,
+seeks straight to it), only one page is held in memory at a time, and a
+scan stopped at any point resumes from the last _id it returned:
+
+    for user in user_collection.iter_users(after='Kay.Xian3'):
+        ...
+'''
+# pylint: disable=E0401
+
+from pymongo import ASCENDING
+import records
+
+
+def pages(collection, query=None, projection=None, batch_size=1000,
+          after=None, raw=False):
+    '''
+    Yields lists of up to batch_size documents matching query, in _id
+    order and starting after the _id after (from the start if None)
+
+    projection may leave out any field but _id, which every page needs.
+    With raw=True, documents are RawBSONDocuments (see records.raw).
+    '''
+    if projection is not None:
+        projection = ({**projection, '_id': 1}
+                      if isinstance(projection, dict)
+                      else [*projection, '_id'])
+    collection = records.raw(collection) if raw else collection
+    query = dict(query or {})
+    while True:
+        if after is not None:
+            query['_id'] = {'$gt': after}
+        page = list(collection.find(query, projection)
+                    .sort('_id', ASCENDING).limit(batch_size)
+                    .batch_size(batch_size))
+        if page:
+            yield page
+        if len(page) < batch_size:
+            return
+        after = page[-1]['_id']
+
+
+def stream(collection, record, query=None, projection=None,
+           batch_size=1000, after=None, raw=False):
+    '''
+    Streams the documents of pages() one at a time, as record(document),
+    or as RawBSONDocuments with raw=True
+    '''
+    for page in pages(collection, query, projection, batch_size, after,
+                      raw):
+        if raw:
+            yield from page
+        else:
+            yield from map(record, page)
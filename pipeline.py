@@ -0,0 +1,258 @@
+'''
+Streaming reader -> converter -> writer ingest pipeline
+
+One reader thread parses the CSV in chunks, a pool of converter threads
+turns chunks into documents, and several writer threads send the bulk
+inserts. The stages are joined by bounded queues, so a slow stage blocks
+the ones before it (backpressure) and memory stays flat however large the
+file is. While Mongo is busy with one batch, the next ones are already
+being parsed and converted.
+
+    pipeline = IngestPipeline('status_updates.csv',
+                              documents.status_documents, write)
+    pipeline.run()
+    pipeline.stats()    # queue depths and per-stage throughput
+
+Every chunk travels with its data row interval, so with a
+checkpoint.Checkpoint as progress the reader skips chunks committed by an
+earlier run and writers commit each chunk once it is written.
+
+Every stage thread runs in a copy of the context that called run(), so
+context variables such as the BulkLog of logs.bulk reach all stages.
+
+chunk_size may be an autotune.BatchSizeTuner: the reader then asks it for
+the size of every chunk and the writers report each write's latency.
+'''
+# pylint: disable=E0401
+# pylint: disable=R0902 # too-many-instance-attributes
+# pylint: disable=R0913 # too-many-arguments
+
+import contextvars
+import queue
+import threading
+import time
+import autotune
+
+# Marks the end of a queue's stream
+_DONE = object()
+
+# How often a blocked stage rechecks whether the pipeline was aborted
+_POLL_SECONDS = 0.1
+
+
+def _thread(target, name):
+    '''
+    A thread that runs target in a copy of the current context
+    '''
+    return threading.Thread(target=contextvars.copy_context().run,
+                            args=(target, ), name=name)
+
+
+class StageStats():
+    '''
+    Counters of one pipeline stage
+    '''
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.batches = 0
+        self.rows = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, rows, seconds):
+        '''
+        Adds one processed batch
+        '''
+        with self._lock:
+            self.batches += 1
+            self.rows += rows
+            self.busy_seconds += seconds
+
+    def as_dict(self, elapsed):
+        '''
+        Counters plus rows/sec (per busy second of one worker) and how busy
+        the stage's workers were over elapsed seconds
+        '''
+        return {'workers': self.workers,
+                'batches': self.batches,
+                'rows': self.rows,
+                'busy_seconds': self.busy_seconds,
+                'rows_per_busy_second': (self.rows / self.busy_seconds
+                                         if self.busy_seconds else 0.0),
+                'utilization': (self.busy_seconds / (elapsed * self.workers)
+                                if elapsed else 0.0)}
+
+
+class IngestPipeline():
+    '''
+    Reads filename in chunks of chunk_size, converts each chunk with
+    convert(chunk) -> documents and writes them with write(documents) ->
+    number written; chunk_size is a number of rows or an
+    autotune.BatchSizeTuner, progress an optional checkpoint.Checkpoint
+    '''
+    def __init__(self, filename, convert, write, chunk_size=1000,
+                 converters=2, writers=2, queue_size=4, progress=None):
+        self.filename = filename
+        self.convert = convert
+        self.write = write
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.chunks = queue.Queue(maxsize=queue_size)
+        self.batches = queue.Queue(maxsize=queue_size)
+        self.max_depth = {'chunks': 0, 'batches': 0}
+        self.stages = {'reader': StageStats('reader', 1),
+                       'converter': StageStats('converter', converters),
+                       'writer': StageStats('writer', writers)}
+        self.written = 0
+        self.errors = []
+        self._abort = threading.Event()
+        self._converters_left = converters
+        self._lock = threading.Lock()
+        self._started = None
+        self._finished = None
+
+    def _put(self, name, target, item):
+        '''
+        Blocking put that gives up when the pipeline is aborted
+        '''
+        while not self._abort.is_set():
+            try:
+                target.put(item, timeout=_POLL_SECONDS)
+            except queue.Full:
+                continue
+            self.max_depth[name] = max(self.max_depth[name], target.qsize())
+            return True
+        return False
+
+    def _get(self, source):
+        '''
+        Blocking get that returns _DONE when the pipeline is aborted
+        '''
+        while not self._abort.is_set():
+            try:
+                return source.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _fail(self, err):
+        with self._lock:
+            self.errors.append(err)
+        self._abort.set()
+
+    def _read(self):
+        try:
+            first_row = 0 if self.progress is None \
+                else self.progress.resume_row()
+            reader = autotune.read_chunks(self.filename, self.chunk_size,
+                                          first_row)
+            while True:
+                start = time.perf_counter()
+                chunk = next(reader, None)
+                if chunk is None:
+                    break
+                self.stages['reader'].record(len(chunk),
+                                             time.perf_counter() - start)
+                rows = (first_row, first_row + len(chunk))
+                first_row = rows[1]
+                if self.progress is not None and self.progress.is_done(*rows):
+                    continue
+                if not self._put('chunks', self.chunks, (rows, chunk)):
+                    return
+        except Exception as err:  # pylint: disable=W0703
+            self._fail(err)
+        finally:
+            for _ in range(self.stages['converter'].workers):
+                self._put('chunks', self.chunks, _DONE)
+
+    def _convert(self):
+        try:
+            while True:
+                item = self._get(self.chunks)
+                if item is _DONE:
+                    break
+                rows, chunk = item
+                start = time.perf_counter()
+                docs = self.convert(chunk)
+                self.stages['converter'].record(len(docs),
+                                                time.perf_counter() - start)
+                if not self._put('batches', self.batches, (rows, docs)):
+                    break
+        except Exception as err:  # pylint: disable=W0703
+            self._fail(err)
+        finally:
+            with self._lock:
+                self._converters_left -= 1
+                last = self._converters_left == 0
+            if last:
+                for _ in range(self.stages['writer'].workers):
+                    self._put('batches', self.batches, _DONE)
+
+    def _write(self):
+        try:
+            while True:
+                item = self._get(self.batches)
+                if item is _DONE:
+                    break
+                rows, docs = item
+                start = time.perf_counter()
+                written = self.write(docs)
+                seconds = time.perf_counter() - start
+                self.stages['writer'].record(len(docs), seconds)
+                if isinstance(self.chunk_size, autotune.BatchSizeTuner):
+                    self.chunk_size.record(rows[1] - rows[0], seconds)
+                with self._lock:
+                    self.written += written
+                if self.progress is not None:
+                    self.progress.commit(*rows, len(docs), written)
+        except Exception as err:  # pylint: disable=W0703
+            self._fail(err)
+
+    def run(self):
+        '''
+        Runs every stage to completion; returns the number of documents
+        written. The first exception raised by a stage aborts the pipeline
+        and is re-raised here.
+        '''
+        self._started = time.perf_counter()
+        threads = [_thread(self._read, 'reader')]
+        threads += [_thread(self._convert, f"converter-{number}")
+                    for number in range(self.stages['converter'].workers)]
+        threads += [_thread(self._write, f"writer-{number}")
+                    for number in range(self.stages['writer'].workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._finished = time.perf_counter()
+        if self.errors:
+            raise self.errors[0]
+        return self.written
+
+    def stats(self):
+        '''
+        Queue depths and per-stage throughput; can be called while the
+        pipeline runs. The bottleneck is the stage whose workers were
+        busiest.
+        '''
+        if self._started is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self._finished or time.perf_counter()) - self._started
+        stages = {name: stage.as_dict(elapsed)
+                  for name, stage in self.stages.items()}
+        if isinstance(self.chunk_size, autotune.BatchSizeTuner):
+            batch_size = self.chunk_size.report()
+        else:
+            batch_size = {'size': self.chunk_size}
+        return {'elapsed_seconds': elapsed,
+                'rows_written': self.written,
+                'rows_per_second': self.written / elapsed if elapsed else 0.0,
+                'queue_depth': {'chunks': self.chunks.qsize(),
+                                'batches': self.batches.qsize()},
+                'max_queue_depth': dict(self.max_depth),
+                'stages': stages,
+                'batch_size': batch_size,
+                'bottleneck': max(stages,
+                                  key=lambda name: stages[name]['utilization'])}
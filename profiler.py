@@ -0,0 +1,218 @@
+'''
+Opt-in profiler of the Mongo commands sent by each API call
+
+Built on pymongo command monitoring. With profile = true in
+social_network.ini (or SOCIAL_NETWORK_MONGODB_PROFILE=true),
+connection.get_client registers LISTENER on the client and turns
+profiling on. From then on every command is tied to the API call that
+sent it: the outermost function decorated with metrics.timed (a main
+function, or a UserAccounts/StatusUpdates method called directly).
+
+    profiler.summary()
+    {'main.add_status': {'calls': 1, 'round_trips': 2,
+                         'commands': {'find': 1, 'insert': 1},
+                         'bytes_sent': 231, 'bytes_received': 121,
+                         'server_seconds': 0.0009, ...}}
+    profiler.recent_calls()     # the commands of the last calls, in order
+    print(profiler.report())
+
+server_seconds is the command duration the driver measures (server time
+plus the network round trip). Commands sent outside an API call, from
+threads started by a call (the pipeline writers) or from loader worker
+processes are summarized under UNATTRIBUTED or not seen; each process
+profiles its own client. Profiling costs a BSON encode of every command
+and reply, so it is meant for diagnosis rather than being left on.
+'''
+# pylint: disable=E0401
+
+import collections
+import contextvars
+import threading
+import bson
+from pymongo import monitoring
+
+UNATTRIBUTED = '(unattributed)'
+
+# True while profiling; metrics.timed only tracks calls then
+ENABLED = False
+
+# The CallProfile of the API call running in this context
+_CALL = contextvars.ContextVar('profiled_call', default=None)
+
+
+class CallProfile():
+    '''
+    The commands sent by one API call
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.stack = [name]
+        self.commands = []
+
+    def as_dict(self):
+        '''
+        The call with its commands in the order they were sent
+        '''
+        return {'call': self.name,
+                'round_trips': len(self.commands),
+                'commands': list(self.commands)}
+
+
+class CommandProfiler(monitoring.CommandListener):
+    '''
+    Command listener aggregating commands per API call
+    '''
+    def __init__(self, recent=100):
+        self.calls = {}
+        self.recent = collections.deque(maxlen=recent)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if not ENABLED:
+            return
+        call = _CALL.get()
+        self._pending[(event.connection_id, event.request_id)] = (
+            call, call.stack[-1] if call else UNATTRIBUTED,
+            len(bson.encode(event.command)))
+
+    def succeeded(self, event):
+        self._finish(event, len(bson.encode(event.reply)), True)
+
+    def failed(self, event):
+        self._finish(event, len(bson.encode(event.failure)), False)
+
+    def _finish(self, event, received, succeeded):
+        pending = self._pending.pop((event.connection_id, event.request_id),
+                                    None)
+        if pending is None:
+            return
+        call, function, sent = pending
+        command = {'command': event.command_name,
+                   'function': function,
+                   'seconds': event.duration_micros / 1e6,
+                   'bytes_sent': sent,
+                   'bytes_received': received,
+                   'ok': succeeded}
+        if call is None:
+            unattributed = CallProfile(UNATTRIBUTED)
+            unattributed.commands.append(command)
+            self.add(unattributed)
+        else:
+            call.commands.append(command)
+
+    def add(self, call):
+        '''
+        Adds a finished call to the summary
+        '''
+        with self._lock:
+            totals = self.calls.setdefault(call.name, {
+                'calls': 0, 'round_trips': 0, 'commands': {},
+                'bytes_sent': 0, 'bytes_received': 0, 'server_seconds': 0.0,
+                'failed_commands': 0})
+            totals['calls'] += 1
+            totals['round_trips'] += len(call.commands)
+            for command in call.commands:
+                totals['commands'][command['command']] = \
+                    totals['commands'].get(command['command'], 0) + 1
+                totals['bytes_sent'] += command['bytes_sent']
+                totals['bytes_received'] += command['bytes_received']
+                totals['server_seconds'] += command['seconds']
+                totals['failed_commands'] += not command['ok']
+            if call.name != UNATTRIBUTED:
+                self.recent.append(call.as_dict())
+
+    def clear(self):
+        '''
+        Forgets every recorded call
+        '''
+        with self._lock:
+            self.calls.clear()
+            self.recent.clear()
+
+
+LISTENER = CommandProfiler()
+
+
+def enable():
+    '''
+    Starts tying commands to API calls (LISTENER must be registered on
+    the client, see connection.get_client)
+    '''
+    global ENABLED  # pylint: disable=W0603
+    ENABLED = True
+
+
+def disable():
+    '''
+    Stops profiling; the summary is kept
+    '''
+    global ENABLED  # pylint: disable=W0603
+    ENABLED = False
+
+
+def enter(name):
+    '''
+    Called by metrics.timed when API function name starts; returns the
+    token to pass to leave
+    '''
+    call = _CALL.get()
+    if call is None:
+        return _CALL.set(CallProfile(name))
+    call.stack.append(name)
+    return None
+
+
+def leave(token):
+    '''
+    Called by metrics.timed when the API function of token returns; the
+    outermost call is added to the summary
+    '''
+    call = _CALL.get()
+    if token is None:
+        call.stack.pop()
+        return
+    _CALL.reset(token)
+    LISTENER.add(call)
+
+
+def summary():
+    '''
+    {API call: calls, round trips, commands by name, bytes and server
+    time in total and per call}
+    '''
+    with LISTENER._lock:  # pylint: disable=W0212
+        calls = {name: dict(totals, commands=dict(totals['commands']))
+                 for name, totals in LISTENER.calls.items()}
+    for totals in calls.values():
+        for key in ('round_trips', 'bytes_sent', 'bytes_received',
+                    'server_seconds'):
+            totals[f"{key}_per_call"] = totals[key] / totals['calls']
+    return calls
+
+
+def recent_calls():
+    '''
+    The last calls (up to LISTENER.recent.maxlen) with their commands
+    '''
+    with LISTENER._lock:  # pylint: disable=W0212
+        return list(LISTENER.recent)
+
+
+def report():
+    '''
+    summary() as a text table, chattiest calls first
+    '''
+    lines = [f"{'API call':<45} {'calls':>7} {'trips/call':>10} "
+             f"{'bytes/call':>11} {'ms/call':>9}  commands"]
+    for name, totals in sorted(summary().items(),
+                               key=lambda item: -item[1]['round_trips']):
+        commands = ', '.join(f"{command} x{count}" for command, count
+                             in sorted(totals['commands'].items()))
+        size = (totals['bytes_sent_per_call']
+                + totals['bytes_received_per_call'])
+        lines.append(
+            f"{name:<45} {totals['calls']:>7} "
+            f"{totals['round_trips_per_call']:>10.1f} {size:>11.0f} "
+            f"{totals['server_seconds_per_call'] * 1000:>9.3f}  {commands}")
+    return '\n'.join(lines)
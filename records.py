@@ -0,0 +1,144 @@
+'''
+Compact User and UserStatus records returned by the collection APIs
+
+A record keeps its fields in __slots__ instead of a per-instance dict,
+which takes a fraction of the memory of the decoded document (see
+bench_records.py). Records still read like the documents they replace:
+
+    user = main.search_user('ckayx15', user_collection)
+    user.name, user['name'], dict(user)     # 'Kay', 'Kay', the document
+
+Fields missing from a document (e.g. left out by a projection) are None.
+Reads that only pass documents through can skip decoding altogether
+with RAW_CODEC_OPTIONS: the cursor then returns
+bson.raw_bson.RawBSONDocument values that keep the BSON bytes and decode
+only when a field is read. dump() exports a collection that way.
+'''
+# pylint: disable=E0401
+
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+
+class Record():
+    '''
+    Base of the record types: FIELDS maps document fields to attributes
+    '''
+    __slots__ = ()
+    FIELDS = {}
+
+    @classmethod
+    def from_document(cls, document):
+        '''
+        The record of a document (a dict or a RawBSONDocument)
+        '''
+        return cls(*(document.get(field) for field in cls.FIELDS))
+
+    def to_document(self):
+        '''
+        The record as a document dict
+        '''
+        return {field: getattr(self, attribute)
+                for field, attribute in self.FIELDS.items()}
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, self.FIELDS[field])
+        except KeyError:
+            raise KeyError(field) from None
+
+    def get(self, field, default=None):
+        '''
+        The value of a document field, or default if there is no such field
+        '''
+        return self[field] if field in self.FIELDS else default
+
+    def keys(self):
+        '''
+        The document fields, so that dict(record) is the document
+        '''
+        return self.FIELDS.keys()
+
+    def __contains__(self, field):
+        return field in self.FIELDS
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return type(self) is type(other) \
+                and self.to_document() == other.to_document()
+        if isinstance(other, dict):
+            return self.to_document() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        values = ', '.join(f"{attribute}={getattr(self, attribute)!r}"
+                           for attribute in self.FIELDS.values())
+        return f"{type(self).__name__}({values})"
+
+
+class User(Record):
+    '''
+    A user account
+    '''
+    __slots__ = ('user_id', 'email', 'name', 'last_name')
+    FIELDS = {'_id': 'user_id', 'email': 'email', 'name': 'name',
+              'last_name': 'last_name'}
+
+    def __init__(self, user_id, email=None, name=None, last_name=None):
+        self.user_id = user_id
+        self.email = email
+        self.name = name
+        self.last_name = last_name
+
+
+class UserStatus(Record):
+    '''
+    A status message
+    '''
+    __slots__ = ('status_id', 'user_id', 'status_text')
+    FIELDS = {'_id': 'status_id', 'user_id': 'user_id',
+              'status_text': 'status_text'}
+
+    def __init__(self, status_id, user_id=None, status_text=None):
+        self.status_id = status_id
+        self.user_id = user_id
+        self.status_text = status_text
+
+
+def raw(collection):
+    '''
+    collection returning RawBSONDocument values instead of dicts
+    '''
+    return collection.with_options(codec_options=RAW_CODEC_OPTIONS)
+
+
+def dump(collection, filename, batch_size=1000):
+    '''
+    Writes every document of collection to filename as concatenated BSON
+    (the mongodump format, read back with bson.decode_file_iter) without
+    decoding them; returns the number of documents written
+    '''
+    count = 0
+    with open(filename, 'wb') as file:
+        for document in raw(collection).find().batch_size(batch_size):
+            file.write(document.raw)
+            count += 1
+    return count
+
+
+def user(document):
+    '''
+    User of a document, or None for no document
+    '''
+    return None if document is None else User.from_document(document)
+
+
+def status(document):
+    '''
+    UserStatus of a document, or None for no document
+    '''
+    return None if document is None else UserStatus.from_document(document)
@@ -0,0 +1,99 @@
+'''
+Incremental sync of CSV exports into a collection
+
+Every synced document stores a hash of its content in HASH_FIELD. A batch
+of rows is compared with the stored hashes using one projection read
+({'_id': {'$in': ids}}, {HASH_FIELD: 1}), and only the new or changed
+rows are sent, as one unordered bulk_write of upserts. Re-syncing an
+unchanged export is then one read per batch and no writes at all.
+
+Documents loaded without a hash (by the plain loaders) count as updated
+the first time they are synced. A row whose _id already appeared in the
+same batch is skipped, as the loaders do (see dedup), so every _id is
+diffed and counted once.
+'''
+# pylint: disable=E0401
+
+import hashlib
+import json
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import documents
+import logs
+
+HASH_FIELD = 'row_hash'
+
+
+def row_hash(document):
+    '''
+    Hash of a document's fields other than _id and HASH_FIELD
+    '''
+    content = sorted((field, value) for field, value in document.items()
+                     if field not in ('_id', HASH_FIELD))
+    encoded = json.dumps(content, default=str).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+def new_counts():
+    '''
+    The counters a sync reports
+    '''
+    return {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0,
+            'skipped': 0, 'rejected': 0, 'failed': 0}
+
+
+def write_batch(collection, docs, counts, accept=None):
+    '''
+    Upserts the new or changed docs of one batch and adds them to counts
+
+    accept(changed docs) -> docs to write lets the caller reject rows
+    (e.g. statuses of unknown users). Returns the _ids that were written.
+    '''
+    first = {}
+    for doc in docs:
+        first.setdefault(doc['_id'], doc)
+    counts['skipped'] += len(docs) - len(first)
+    docs = list(first.values())
+    hashes = {doc['_id']: row_hash(doc) for doc in docs}
+    stored = {doc['_id']: doc.get(HASH_FIELD) for doc in collection.find(
+        {'_id': {'$in': list(hashes)}}, {HASH_FIELD: 1})}
+    changed = [doc for doc in docs if stored.get(doc['_id'], '')
+               != hashes[doc['_id']]]
+    counts['unchanged'] += len(docs) - len(changed)
+    if accept is not None and changed:
+        accepted = accept(changed)
+        counts['rejected'] += len(changed) - len(accepted)
+        changed = accepted
+    if not changed:
+        return []
+    requests = [UpdateOne({'_id': doc['_id']},
+                          {'$set': {**{field: value
+                                       for field, value in doc.items()
+                                       if field != '_id'},
+                                    HASH_FIELD: hashes[doc['_id']]}},
+                          upsert=True)
+                for doc in changed]
+    failed = set()
+    try:
+        collection.bulk_write(requests, ordered=False)
+    except BulkWriteError as err:
+        failed = {error['index'] for error in err.details['writeErrors']}
+        for error in err.details['writeErrors']:
+            doc_id = changed[error['index']]['_id']
+            logs.reject(doc_id, logs.write_error_reason(error),
+                        f"_id: {doc_id} failed to sync")
+    written = [doc['_id'] for index, doc in enumerate(changed)
+               if index not in failed]
+    counts['failed'] += len(failed)
+    counts['updated'] += sum(doc_id in stored for doc_id in written)
+    counts['inserted'] += sum(doc_id not in stored for doc_id in written)
+    return written
+
+
+def stale_ids(collection, seen, batch_size=1000):
+    '''
+    Yields batches of the stored _ids that are not in seen
+    '''
+    cursor = collection.find({}, {'_id': 1}).batch_size(batch_size)
+    yield from documents.batched((doc['_id'] for doc in cursor
+                                  if doc['_id'] not in seen), batch_size)
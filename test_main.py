@@ -7,14 +7,116 @@ tests for the main driver code of the Social Network
 # pylint: disable=R0201
 # pylint: disable=W0621 # Redefining name 'empty_db' from outer scope
 
+import asyncio
+import datetime
+import json
+import os
+from pathlib import Path
+import bson
+from loguru import logger
+import pandas as pd
+from pymongo import AsyncMongoClient, monitoring
 import pytest
 import main
+import async_collections
+import autotune
+import cache
+import checkpoint
+import connection
+import csv_ranges
+import documents
+import generate_data
+import indexes
+import logs
+import memory_store
+import metrics
+import profiler
+import records
 from users import UserAccounts
 from user_status import StatusUpdates
 
+# SOCIAL_NETWORK_MONGODB_BACKEND=memory runs the suite without a mongod
+MEMORY_BACKEND = connection.load_settings()['backend'] == 'memory'
+
 CLIENT = main.MongoDBConnection().connection
 
 
+class CommandCounter():
+    """
+    Wraps a collection and records every database call made through it
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self.calls = []
+
+    def __getattr__(self, name):
+        attribute = getattr(self.collection, name)
+        if not callable(attribute):
+            return attribute
+
+        def counted(*args, **kwargs):
+            self.calls.append(name)
+            return attribute(*args, **kwargs)
+        return counted
+
+
+class MonitoredCollection():
+    """
+    Wraps a collection and reports every call to a command listener the
+    way pymongo command monitoring does
+    """
+    def __init__(self, collection, listener):
+        self.collection = collection
+        self.listener = listener
+        self.request_id = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self.collection, name)
+        if not callable(attribute):
+            return attribute
+
+        def monitored(*args, **kwargs):
+            self.request_id += 1
+            address = ('localhost', 27017)
+            self.listener.started(monitoring.CommandStartedEvent(
+                {name: self.collection.name}, 'test_main', self.request_id,
+                address, self.request_id))
+            result = attribute(*args, **kwargs)
+            self.listener.succeeded(monitoring.CommandSucceededEvent(
+                datetime.timedelta(microseconds=50), {'ok': 1}, name,
+                self.request_id, address, self.request_id))
+            return result
+        return monitored
+
+
+class InlinePool():
+    """
+    Stands in for multiprocessing.Pool, running every task in the calling
+    process so that the loader pools can use the in-memory store
+    """
+    def __init__(self, processes=None, initializer=None, initargs=()):
+        self.processes = processes
+        initializer(*initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        return False
+
+    @staticmethod
+    def apply_async(function, args=(), callback=None, error_callback=None):
+        """
+        Runs function(*args) now and hands the outcome to a callback
+        """
+        try:
+            result = function(*args)
+        except Exception as err:  # pylint: disable=W0703
+            error_callback(err)
+        else:
+            callback(result)
+
+
 @pytest.fixture
 def empty_db():
     """
@@ -48,6 +150,40 @@ def full_db():
     return database
 
 
+def test_shared_client():
+    """
+    Every connection in a process shares one pooled client
+    """
+    with main.MongoDBConnection() as first, main.MongoDBConnection() as second:
+        assert first.connection is second.connection
+    assert main.MongoDBConnection().connection is CLIENT
+
+
+def test_settings_environment_override(monkeypatch):
+    """
+    Environment variables override social_network.ini
+    """
+    monkeypatch.setenv('SOCIAL_NETWORK_MONGODB_MAX_POOL_SIZE', '7')
+    monkeypatch.setenv('SOCIAL_NETWORK_MONGODB_COMPRESSORS', 'zstd, zlib')
+    options = connection.client_options()
+
+    assert options['maxPoolSize'] == 7
+    assert options['compressors'] == ['zstd', 'zlib']
+
+
+def test_settings_file_parsed_once(monkeypatch):
+    """
+    Client lookups reuse the settings file parsed earlier in the process
+    """
+    def read(*_args, **_kwargs):
+        raise AssertionError('social_network.ini parsed again')
+    monkeypatch.setattr(connection.configparser.ConfigParser, 'read', read)
+
+    assert connection.get_client() is CLIENT
+    assert main.MongoDBConnection().database.name == \
+        connection.load_settings()['database']
+
+
 def test_init_user_collection(empty_db):
     '''
     Creates and returns a new instance of UserCollection
@@ -112,6 +248,415 @@ def test_load_users_chunks(empty_db):
     assert load_wrong is False
 
 
+def test_batch_size_tuner():
+    """
+    The tuner converges within its bounds on the size with the best
+    docs/sec, here sqrt(0.005 / 6.25e-10) ~ 2828 rows
+    """
+    tuner = autotune.BatchSizeTuner(initial=1000, minimum=100, maximum=50000)
+    while not tuner.converged:
+        size = tuner.size
+        tuner.record(size, 0.005 + size * 1e-5 + size ** 2 * 6.25e-10)
+    report = tuner.report()
+
+    assert 2000 <= report['size'] <= 4000
+    assert report['docs_per_second'] == max(
+        step['docs_per_second'] for step in report['history'])
+
+
+def test_load_users_chunks_tuned(empty_db):
+    """
+    Without a size the chunked loader tunes it and reports the choice
+    """
+    uc = main.init_user_collection(empty_db)
+    tuning = {}
+
+    assert main.load_users_chunks('accounts.csv', uc, tuning=tuning) is True
+    assert len(uc) == 2000
+    assert autotune.MIN_SIZE <= tuning['size'] <= autotune.MAX_SIZE
+    assert tuning['batches'] > 0
+
+
+def test_load_users_validation(empty_db, tmp_path):
+    """
+    Bad rows go to the rejects CSV with their reasons; the rest load
+    """
+    uc = main.init_user_collection(empty_db)
+    filename = tmp_path / 'accounts.csv'
+    pd.DataFrame([['dave03', 'David', 'Yuen', 'dave03@gmail.com'],
+                  ['bbq15', 'B', '', 'bbq15@uw.edu'],
+                  ['ckayx15', 'Kay', 'Xian', 'ckayx15.at.uw.edu'],
+                  ['ckayx16', 'Kay', 'Xian', 'ckayx15@uw.edu'],
+                  ['', 'No', 'Id', '']],
+                 columns=['USER_ID', 'NAME', 'LASTNAME', 'EMAIL']
+                 ).to_csv(filename, index=False)
+
+    assert main.load_users_chunks(str(filename), uc, size=2) is False
+    rejects = pd.read_csv(f"{filename}.rejects.csv", keep_default_na=False)
+    assert rejects['REASON'].tolist() == [
+        'missing LASTNAME', 'malformed EMAIL', 'USER_ID does not match EMAIL',
+        'missing USER_ID; missing EMAIL']
+    assert len(uc) == 1 and main.search_user('dave03', uc) is not None
+
+    assert main.load_users(str(filename), uc) is False
+    assert len(pd.read_csv(f"{filename}.rejects.csv")) == 4
+
+
+def test_load_users_duplicates(empty_db, tmp_path):
+    """
+    Duplicate IDs in the file are skipped, stored IDs do not stop the
+    load and both are reported with other failures
+    """
+    uc = main.init_user_collection(empty_db)
+    main.add_user('dave03', 'dave03@gmail.com', 'David', 'Yuen', uc)
+    main.add_user('kay01', 'ckayx15@uw.edu', 'Kay', 'Xian', uc)
+    filename = tmp_path / 'accounts.csv'
+    rows = [['bbq15', 'B', 'Q', 'bbq15@uw.edu'],
+            ['dave03', 'David', 'Yuen', 'dave03@gmail.com'],
+            ['bbq15', 'B', 'Q', 'bbq15@uw.edu'],
+            ['ckayx15', 'Kay', 'Xian', 'ckayx15@uw.edu'],
+            ['bbq15', 'B', 'Q', 'bbq15@uw.edu'],
+            ['sam07', 'Sam', 'Lee', 'sam07@uw.edu']]
+    pd.DataFrame(rows, columns=['USER_ID', 'NAME', 'LASTNAME', 'EMAIL']
+                 ).to_csv(filename, index=False)
+    outcome = {}
+
+    assert main.load_users_chunks(str(filename), uc, size=3,
+                                  outcome=outcome) is False
+    assert outcome['inserted'] == 2
+    assert outcome['skipped'] == {'count': 2, 'ids': ['bbq15', 'bbq15']}
+    assert outcome['already_present'] == {'count': 1, 'ids': ['dave03']}
+    assert outcome['failed'] == {'count': 1, 'ids': ['ckayx15']}
+    assert main.search_user('sam07', uc) is not None
+
+
+def test_load_users_chunks_resume(empty_db, tmp_path):
+    """
+    A resumed load skips the committed rows and removes its checkpoint
+    once the file is loaded
+    """
+    accounts = tmp_path / 'accounts.csv'
+    accounts.write_bytes(Path('accounts.csv').read_bytes())
+    uc = main.init_user_collection(empty_db)
+    interrupted = checkpoint.Checkpoint(str(accounts), 'load_users_chunks')
+    interrupted.commit(0, 1000, 1000, 1000)
+
+    assert main.load_users_chunks(str(accounts), uc, resume=True) is True
+    assert len(uc) == 1000
+    assert uc.search_user(pd.read_csv(accounts)['USER_ID'][0]) is None
+    assert not os.path.exists(interrupted.path)
+
+
+def test_sync_users(empty_db, tmp_path):
+    """
+    A sync writes only new or changed rows and can delete missing users
+    """
+    accounts = pd.read_csv('accounts.csv')
+    export = tmp_path / 'accounts.csv'
+    accounts.to_csv(export, index=False)
+    uc = main.init_user_collection(empty_db)
+    first = main.sync_users(str(export), uc)
+    second = main.sync_users(str(export), uc)
+    accounts.loc[0, 'NAME'] = 'Changed'
+    accounts.iloc[:1990].to_csv(export, index=False)
+    third = main.sync_users(str(export), uc, delete_missing=True)
+
+    assert first['inserted'] == 2000
+    assert second['unchanged'] == 2000 and second['inserted'] == 0
+    assert third['updated'] == 1 and third['unchanged'] == 1989
+    assert third['deleted'] == 10
+    assert len(uc) == 1990
+    assert uc.search_user(accounts['USER_ID'][0])['name'] == 'Changed'
+    assert main.sync_users('wrong.csv', uc) is False
+
+
+def test_sync_users_repeated_id(empty_db, tmp_path):
+    """
+    A user ID repeated within a batch is written and counted once
+    """
+    accounts = pd.read_csv('accounts.csv').iloc[:5]
+    export = tmp_path / 'accounts.csv'
+    pd.concat([accounts, accounts.iloc[:2]]).to_csv(export, index=False)
+    uc = main.init_user_collection(empty_db)
+    counts = main.sync_users(str(export), uc)
+
+    assert counts['inserted'] == 5 and counts['skipped'] == 2
+    assert counts['failed'] == 0
+    assert len(uc) == 5
+
+
+def test_sync_users_validation(empty_db, tmp_path):
+    """
+    Sync rejects the rows every loader rejects, and counts them
+    """
+    accounts = pd.read_csv('accounts.csv').iloc[:5]
+    accounts.loc[1, 'EMAIL'] = 'not-an-email'
+    accounts.loc[3, 'NAME'] = ''
+    export = tmp_path / 'accounts.csv'
+    accounts.to_csv(export, index=False)
+    uc = main.init_user_collection(empty_db)
+    counts = main.sync_users(str(export), uc)
+
+    assert counts['inserted'] == 3 and counts['rejected'] == 2
+    assert uc.search_user(accounts['USER_ID'][1]) is None
+    assert len(pd.read_csv(f"{export}.rejects.csv")) == 2
+
+
+@pytest.mark.skipif(MEMORY_BACKEND,
+                    reason="worker processes cannot share an in-memory store")
+def test_load_users_multiprocess(empty_db):
+    """
+    Returns True if the worker pool loaded the file
+    Returns False if file does not exist
+    """
+    load_pool = main.load_users_multiprocess('accounts.csv', size=500,
+                                             processes=2,
+                                             database_name='test_main')
+    load_wrong = main.load_users_multiprocess('wrong.csv')
+
+    assert load_pool is True
+    assert load_wrong is False
+
+
+def test_load_users_multiprocess_tunes_dirty_input(empty_db, tmp_path,
+                                                   monkeypatch):
+    """
+    Chunks that lose rows to validation still give the tuner feedback
+    """
+    monkeypatch.setattr(main.multiprocessing, 'Pool', InlinePool)
+    accounts = pd.read_csv('accounts.csv')
+    accounts.loc[::10, 'NAME'] = ''
+    dirty = tmp_path / 'accounts.csv'
+    accounts.to_csv(dirty, index=False)
+    tuner = autotune.BatchSizeTuner(initial=100, minimum=10, maximum=1000)
+
+    assert main.load_users_multiprocess(str(dirty), size=tuner, processes=1,
+                                        database_name='test_main') is False
+    assert len(main.init_user_collection(empty_db)) == 1800
+    assert tuner.history and tuner.size != 100
+
+
+def test_load_users_multiprocess_worker_error(empty_db, tmp_path,
+                                              monkeypatch):
+    """
+    A failing worker is logged and the load returns False, keeping the
+    checkpoint of the chunks that were written
+    """
+    def failing_worker(chunk):
+        if chunk['USER_ID'].iloc[0] != first_id:
+            raise OSError('connection reset')
+        return loader(chunk)
+
+    monkeypatch.setattr(main.multiprocessing, 'Pool', InlinePool)
+    accounts = tmp_path / 'accounts.csv'
+    accounts.write_bytes(Path('accounts.csv').read_bytes())
+    first_id = pd.read_csv(accounts)['USER_ID'][0]
+    loader = main.load_users_worker
+    monkeypatch.setattr(main, 'load_users_worker', failing_worker)
+    messages = []
+    sink = logger.add(messages.append, format='{message}')
+    try:
+        loaded = main.load_users_multiprocess(str(accounts), size=500,
+                                              processes=1,
+                                              database_name='test_main')
+    finally:
+        logger.remove(sink)
+
+    assert loaded is False
+    assert len(main.init_user_collection(empty_db)) == 500
+    assert any('connection reset' in message for message in messages)
+    assert os.path.exists(f"{accounts}.checkpoint.json")
+
+
+def test_user_documents():
+    """
+    The vectorized conversion builds the same documents as iterrows
+    """
+    chunk = pd.read_csv('accounts.csv', nrows=50)
+    expected = [{'_id': row['USER_ID'],
+                 'email': row['EMAIL'],
+                 'name': row['NAME'],
+                 'last_name': row['LASTNAME']}
+                for _, row in chunk.iterrows()]
+
+    assert documents.user_documents(chunk) == expected
+
+
+def test_load_users_pipeline(empty_db):
+    """
+    The pipeline loads every row and reports per-stage stats
+    """
+    uc = main.init_user_collection(empty_db)
+    stats = {}
+    loaded = main.load_users_pipeline('accounts.csv', uc, size=100,
+                                      queue_size=2, stats=stats)
+
+    assert loaded is True
+    assert len(uc) == 2000
+    assert stats['rows_written'] == 2000
+    assert stats['stages']['reader']['batches'] == 20
+    assert stats['max_queue_depth']['chunks'] <= 2
+    assert main.load_users_pipeline('wrong.csv', uc) is False
+
+
+def test_load_users_pipeline_stage_error(empty_db, tmp_path):
+    """
+    A failing stage is logged and the load returns False
+    """
+    class FailingCollection(CommandCounter):
+        """
+        A collection whose inserts fail
+        """
+        def insert_many(self, *_args, **_kwargs):
+            raise OSError('connection reset')
+
+    accounts = tmp_path / 'accounts.csv'
+    accounts.write_bytes(Path('accounts.csv').read_bytes())
+    uc = main.init_user_collection(empty_db)
+    uc.user_collection = FailingCollection(uc.user_collection)
+    stats = {}
+
+    assert main.load_users_pipeline(str(accounts), uc, size=500,
+                                     stats=stats) is False
+    assert stats['rows_written'] == 0
+
+
+def test_load_status_pipeline_samples_rejects(full_db, tmp_path):
+    """
+    One BulkLog serves the whole pipeline load, converter threads
+    included, so validation rejects are sampled across batches
+    """
+    status_file = tmp_path / 'status_updates.csv'
+    pd.DataFrame({'STATUS_ID': [f'ckayx_{number:05d}'
+                                for number in range(2, 42)],
+                  'USER_ID': 'ckayx15',
+                  'STATUS_TEXT': ['Hello', ''] * 20}).to_csv(status_file,
+                                                             index=False)
+    sc = main.init_status_collection(full_db)
+    messages = []
+    sink = logger.add(messages.append, format='{message}')
+    try:
+        main.load_status_pipeline(str(status_file), sc, size=4)
+    finally:
+        logger.remove(sink)
+
+    assert len(sc) == 21
+    assert sum('rejected:' in message
+               for message in messages) == logs.SAMPLE_FIRST
+    assert sum('load_status_pipeline: ' in message and ' read, ' in message
+               for message in messages) == 10
+
+
+def test_generate_data(tmp_path):
+    """
+    The generator is deterministic, writes the exact sizes in the repo's
+    schemas and only statuses of generated users, except for the injected
+    unknown-user rows; bad rows leave the other rows as they were
+    """
+    def generate(name, **options):
+        users_file = tmp_path / f'{name}_users.csv'
+        status_file = tmp_path / f'{name}_status.csv'
+        generate_data.generate(users_file, status_file, 300, 5000, seed=4,
+                               distribution='pareto', **options)
+        return pd.read_csv(users_file), pd.read_csv(status_file)
+
+    users, statuses = generate('first')
+    same_users, same_statuses = generate('second')
+    bad_users, bad_statuses = generate('bad', bad_rate=0.2)
+    unknown = bad_statuses['USER_ID'].str.endswith('.missing')
+
+    assert users.equals(same_users) and statuses.equals(same_statuses)
+    assert list(users.columns) == ['USER_ID', 'NAME', 'LASTNAME', 'EMAIL']
+    assert list(statuses.columns) == ['STATUS_ID', 'USER_ID', 'STATUS_TEXT']
+    assert (len(users), len(statuses)) == (300, 5000)
+    assert users['USER_ID'].is_unique and statuses['STATUS_ID'].is_unique
+    assert set(statuses['USER_ID']) <= set(users['USER_ID'])
+    assert (len(bad_users), len(bad_statuses)) == (300, 5000)
+    assert bad_users['NAME'].equals(users['NAME'])
+    assert unknown.any()
+    assert set(bad_statuses['USER_ID'][~unknown]) <= set(bad_users['USER_ID'])
+    assert not set(bad_statuses['USER_ID'][unknown]) & set(bad_users['USER_ID'])
+
+
+def test_split_ranges_keeps_quoted_fields(tmp_path):
+    """
+    Byte ranges end on record boundaries, never inside quoted text
+    """
+    status_file = tmp_path / 'status_updates.csv'
+    with open(status_file, 'w', encoding='utf-8') as file:
+        file.write('STATUS_ID,USER_ID,STATUS_TEXT\n')
+        for number in range(500):
+            file.write(f'ckayx_{number:05d},ckayx15,"Line one, ""quoted""\n'
+                       f'line two of status {number}"\n')
+    header, ranges = csv_ranges.split_ranges(status_file, 7)
+    parsed = pd.concat(chunk for start, end in ranges
+                       for chunk in csv_ranges.read_range(
+                           status_file, start, end, header, 100))
+
+    assert len(ranges) == 7
+    assert parsed.reset_index(drop=True).equals(pd.read_csv(status_file))
+
+
+def test_read_chunks_skip(tmp_path, monkeypatch):
+    """
+    Skipped rows are sought past, across quoted and unquoted blocks
+    """
+    monkeypatch.setattr(csv_ranges, 'SCAN_SIZE', 256)
+    status_file = tmp_path / 'status_updates.csv'
+    with open(status_file, 'w', encoding='utf-8') as file:
+        file.write('STATUS_ID,USER_ID,STATUS_TEXT\n')
+        for number in range(300):
+            text = (f'"Line one, ""quoted""\nline two {number}"'
+                    if 100 <= number < 200 else f'plain status {number}')
+            file.write(f'ckayx_{number:05d},ckayx15,{text}\n')
+    expected = pd.read_csv(status_file)
+
+    for skip in (1, 50, 150, 250):
+        parsed = pd.concat(autotune.read_chunks(status_file, 40, skip))
+        assert parsed.reset_index(drop=True).equals(
+            expected.iloc[skip:].reset_index(drop=True))
+    assert not list(autotune.read_chunks(status_file, 40, 300))
+
+
+def test_load_status_unknown_users(full_db, tmp_path):
+    """
+    Statuses of unknown users are reported as rejected and make the load
+    return False, without keeping the checkpoint of a finished load
+    """
+    status_file = tmp_path / 'status_updates.csv'
+    pd.DataFrame({'STATUS_ID': [f'ckayx_{number:05d}'
+                                for number in range(2, 12)],
+                  'USER_ID': ['ckayx15', 'nobody01'] * 5,
+                  'STATUS_TEXT': 'Hello'}).to_csv(status_file, index=False)
+    sc = main.init_status_collection(full_db)
+    chunks, pipelined = {}, {}
+
+    assert main.load_status_updates_chunks(str(status_file), sc, size=3,
+                                           outcome=chunks) is False
+    assert main.load_status_pipeline(str(status_file), sc, size=3,
+                                     outcome=pipelined) is False
+    assert len(sc) == 6
+    unknown = [f'ckayx_{number:05d}' for number in range(3, 12, 2)]
+    assert chunks['rejected'] == {'count': 5, 'ids': unknown}
+    assert sorted(pipelined['rejected']['ids']) == unknown
+    assert not os.path.exists(f"{status_file}.checkpoint.json")
+
+
+@pytest.mark.skipif(MEMORY_BACKEND,
+                    reason="worker processes cannot share an in-memory store")
+def test_load_users_ranges(empty_db):
+    """
+    Returns True if the byte-range workers loaded the file
+    Returns False if file does not exist
+    """
+    load_ranges = main.load_users_ranges('accounts.csv', size=500,
+                                         processes=2,
+                                         database_name='test_main')
+
+    assert load_ranges is True
+    assert main.load_users_ranges('wrong.csv') is False
+
+
 def test_update_user(empty_db):
     '''
     Updates the values of an existing user
@@ -171,6 +716,371 @@ def test_main_search_user(empty_db):
     assert search_non_exist is None
 
 
+def test_records(full_db, tmp_path):
+    """
+    Searches return slotted records that still read like documents, and
+    exports copy the raw BSON
+    """
+    uc = main.init_user_collection(full_db)
+    sc = main.init_status_collection(full_db)
+    user = main.search_user('ckayx15', uc)
+    status = main.search_statuses(['ckayx_00001'], sc)[0]
+    filename = tmp_path / 'statuses.bson'
+
+    assert isinstance(user, records.User) and not hasattr(user, '__dict__')
+    assert user.name == user['name'] == 'Kay'
+    assert dict(user) == full_db.user_collection.find_one({'_id': 'ckayx15'})
+    assert isinstance(status, records.UserStatus)
+    assert status.user_id == status['user_id'] == 'ckayx15'
+    with pytest.raises(KeyError):
+        user['status_text']
+    assert main.export_status_updates(str(filename), sc) == 1
+    with open(filename, 'rb') as file:
+        assert list(bson.decode_file_iter(file)) == [status.to_document()]
+
+
+def test_iterators(empty_db):
+    """
+    The iterators page through everything in _id order and resume after
+    a given _id
+    """
+    uc = main.init_user_collection(empty_db)
+    sc = main.init_status_collection(empty_db)
+    main.load_users_chunks('accounts.csv', uc)
+    main.add_user('dave03', 'dave03@gmail.com', 'David', 'Yuen', uc)
+    for number in range(5):
+        main.add_status('dave03', f'dave03_0000{number}', 'Hi', sc)
+    user_ids = sorted([*pd.read_csv('accounts.csv')['USER_ID'], 'dave03'])
+    users = list(uc.iter_users(batch_size=300, projection={'name': 1}))
+
+    assert [user.user_id for user in users] == user_ids
+    assert users[0].name and users[0].email is None
+    assert [user['_id'] for user in uc.iter_users(
+        after=user_ids[-3], raw=True)] == user_ids[-2:]
+    assert [status.status_id for status in sc.iter_statuses_for_user(
+        'dave03', batch_size=2, after='dave03_00001')] == [
+            'dave03_00002', 'dave03_00003', 'dave03_00004']
+    assert len(list(sc.iter_statuses(batch_size=5))) == 5
+
+
+def test_timeline(full_db):
+    """
+    The timeline pages through one user's statuses newest first
+    """
+    sc = main.init_status_collection(full_db)
+    for number in range(2, 6):
+        main.add_status('ckayx15', f'ckayx_0000{number}', f'Post {number}',
+                        sc)
+    first, before = main.timeline('ckayx15', sc, limit=2)
+    second, after_second = main.timeline('ckayx15', sc, 2, before)
+    last, end = main.timeline('ckayx15', sc, 2, after_second)
+
+    assert [status.status_id for status in first + second + last] == [
+        'ckayx_00005', 'ckayx_00004', 'ckayx_00003', 'ckayx_00002',
+        'ckayx_00001']
+    assert first[0].status_text == 'Post 5' and first[0].user_id == 'ckayx15'
+    assert (before, after_second, end) == ('ckayx_00004', 'ckayx_00002',
+                                           None)
+    assert main.timeline('bbq15', sc) == ([], None)
+    assert main.timeline('ckayx15', sc, 0) == ([], None)
+    assert main.timeline('ckayx15', sc, -1) == ([], None)
+
+
+def test_search_user_cache(empty_db):
+    """
+    Cached lookups, cached misses and invalidation on writes
+    """
+    lru = cache.LRUCache(maxsize=10, ttl=60)
+    uc = main.init_user_collection(empty_db, lru)
+    main.add_user('ckayx15', 'ckayx15@uw.edu', 'Kay', 'Xian', uc)
+
+    assert main.search_user('ckayx15', uc)['name'] == 'Kay'
+    assert main.search_user('ckayx15', uc)['name'] == 'Kay'
+    assert main.search_user('dave03', uc) is None
+    assert main.search_user('dave03', uc) is None
+    assert (lru.hits, lru.misses) == (2, 2)
+
+    main.update_user('ckayx15', 'ckayx15@uw.edu', 'Shiqi', 'Xian', uc)
+    main.add_user('dave03', 'david.yuen@gmail.com', 'David', 'Yuen', uc)
+
+    assert main.search_user('ckayx15', uc)['name'] == 'Shiqi'
+    assert main.search_user('dave03', uc)['name'] == 'David'
+
+
+def test_cache_invalidated_after_write(empty_db):
+    """
+    A miss cached by a lookup that races an insert is dropped once the
+    insert succeeds
+    """
+    lru = cache.LRUCache()
+    uc = main.init_user_collection(empty_db, lru)
+    sc = main.init_status_collection(empty_db, lru)
+    main.add_user('ckayx15', 'ckayx15@uw.edu', 'Kay', 'Xian', uc)
+
+    class RacingCollection(CommandCounter):
+        """
+        Looks the new document up, as another thread would, before each
+        insert reaches the database
+        """
+        def __init__(self, collection, lookup):
+            super().__init__(collection)
+            self.lookup = lookup
+
+        def insert_one(self, document):
+            self.lookup(document['_id'])
+            return self.collection.insert_one(document)
+
+        def insert_many(self, docs, ordered=True):
+            for document in docs:
+                self.lookup(document['_id'])
+            return self.collection.insert_many(docs, ordered=ordered)
+
+    uc.user_collection = RacingCollection(uc.user_collection, uc.search_user)
+    sc.status_collection = RacingCollection(sc.status_collection,
+                                            sc.search_status)
+    main.add_user('dave03', 'dave03@gmail.com', 'David', 'Yuen', uc)
+    main.add_status('ckayx15', 'ckayx_00001', 'First', sc)
+    main.add_statuses([{'_id': 'ckayx_00002', 'user_id': 'ckayx15',
+                        'status_text': 'Second'}], sc)
+
+    assert main.search_user('dave03', uc)['name'] == 'David'
+    assert main.search_status('ckayx_00001', sc) is not None
+    assert main.search_status('ckayx_00002', sc) is not None
+
+
+def test_cache_drops_miss_read_before_write(empty_db):
+    """
+    A miss read before a concurrent insert, but cached after the insert
+    invalidated the key, is not kept
+    """
+    lru = cache.LRUCache()
+    uc = main.init_user_collection(empty_db, lru)
+    writer = UserAccounts(empty_db, lru)
+    pending = [('dave03', 'dave03@gmail.com', 'David', 'Yuen'),
+               ('sam07', 'sam07@uw.edu', 'Sam', 'Reyes')]
+
+    class LateCollection(CommandCounter):
+        """
+        Lets another client insert the next pending user after a read
+        returns
+        """
+        def find_one(self, query):
+            result = self.collection.find_one(query)
+            self.insert_pending()
+            return result
+
+        def find(self, *args, **kwargs):
+            result = list(self.collection.find(*args, **kwargs))
+            self.insert_pending()
+            return result
+
+        @staticmethod
+        def insert_pending():
+            """
+            The concurrent write
+            """
+            if pending:
+                writer.add_user(*pending.pop(0))
+
+    uc.user_collection = LateCollection(uc.user_collection)
+
+    assert main.search_user('dave03', uc) is None
+    assert main.search_users(['sam07'], uc) == [None]
+    assert main.search_user('dave03', uc)['name'] == 'David'
+    assert main.search_users(['sam07'], uc)[0]['name'] == 'Sam'
+
+
+def test_metrics_percentile_buckets():
+    """
+    Percentiles of no calls, of in-range calls and of calls past the last
+    bucket bound
+    """
+    stats = metrics.OperationStats('test')
+    assert stats.percentile(0.5) == 0.0
+    stats.record(0.001)
+    stats.record(metrics.BUCKET_BOUNDS[-1] * 2)
+
+    assert 0.0009 < stats.percentile(0.5) < 0.0011
+    assert stats.percentile(0.99) == metrics.BUCKET_BOUNDS[-1] * 2
+
+
+def test_metrics(empty_db):
+    """
+    Public operations record counts, errors and latency percentiles, and
+    loaders their rows/sec; both exports include them
+    """
+    metrics.REGISTRY.clear()
+    uc = main.init_user_collection(empty_db)
+    main.add_user('ckayx15', 'ckayx15@uw.edu', 'Kay', 'Xian', uc)
+    main.add_user('ckayx15', 'ckayx15@uw.edu', 'Kay', 'Xian', uc)
+    main.load_users_chunks('accounts.csv', uc, size=500)
+    snapshot = metrics.snapshot()
+    add_user = snapshot['main.add_user']
+
+    assert (add_user['count'], add_user['errors']) == (2, 1)
+    assert snapshot['users.UserAccounts.add_user']['count'] == 2
+    assert 0 < add_user['p50'] <= add_user['p95'] <= add_user['p99'] \
+        <= add_user['max']
+    assert snapshot['main.load_users_chunks']['rows'] == 2000
+    assert snapshot['main.load_users_chunks']['rows_per_second'] > 0
+    prometheus = metrics.to_prometheus()
+    assert 'social_network_operation_seconds_count{operation="main.add_user"} 2' \
+        in prometheus
+    assert 'social_network_operation_errors_total{operation="main.add_user"} 1' \
+        in prometheus
+    assert json.loads(metrics.to_json())['operations'] == \
+        json.loads(json.dumps(snapshot))
+
+
+def test_profiler(full_db, monkeypatch):
+    """
+    While profiling, every command is tied to the outermost API call
+    """
+    monkeypatch.setattr(profiler, 'ENABLED', True)
+    profiler.LISTENER.clear()
+    sc = main.init_status_collection(full_db)
+    sc.user_collection = MonitoredCollection(sc.user_collection,
+                                             profiler.LISTENER)
+    sc.status_collection = MonitoredCollection(sc.status_collection,
+                                               profiler.LISTENER)
+    main.add_status('ckayx15', 'ckayx_00002', 'Profiled', sc)
+    main.add_status('ckayx15', 'ckayx_00003', 'Profiled', sc)
+    summary = profiler.summary()['main.add_status']
+    last = profiler.recent_calls()[-1]
+
+    assert summary['calls'] == 2
+    assert summary['commands'] == {'find_one': 2, 'insert_one': 2}
+    assert summary['round_trips_per_call'] == 2
+    assert summary['server_seconds'] == pytest.approx(4 * 50e-6)
+    assert summary['bytes_received'] > 0
+    assert [command['function'] for command in last['commands']] == \
+        ['user_status.StatusUpdates.add_status'] * 2
+    assert 'main.add_status' in profiler.report()
+
+
+def test_cache_eviction():
+    """
+    Entries expire after ttl and the least recently used is evicted
+    """
+    now = [0.0]
+    lru = cache.LRUCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    lru.put('a', 1)
+    lru.put('b', 2)
+    lru.get('a')
+    lru.put('c', 3)
+
+    assert lru.get('b') == (False, None)
+    assert lru.get('a') == (True, 1)
+    now[0] = 11.0
+    assert lru.get('c') == (False, None)
+    assert lru.stats()['evictions'] == 1
+
+
+def test_cascade_delete_invalidates_status_cache(full_db):
+    """
+    Deleting a user drops that user's cached statuses
+    """
+    lru = cache.LRUCache()
+    uc = main.init_user_collection(full_db, lru)
+    sc = main.init_status_collection(full_db, lru)
+
+    assert main.search_status('ckayx_00001', sc) is not None
+    assert main.delete_user('ckayx15', uc) is True
+    assert main.search_status('ckayx_00001', sc) is None
+
+
+def test_bulk_user_operations(full_db):
+    """
+    Bulk update/search/delete return one result per item
+    """
+    uc = main.init_user_collection(full_db)
+    main.add_user('dave03', 'david.yuen@gmail.com', 'David', 'Yuen', uc)
+    updated = main.update_users([('ckayx15', 'ckayx15@uw.edu', 'Shiqi', 'Xian'),
+                                 ('bbq15', 'bbq15@uw.edu', 'B', 'Q'),
+                                 ('dave03', 'dave03@uw.edu', 'Dave', 'Yuen')],
+                                uc)
+    found = main.search_users(['dave03', 'bbq15', 'ckayx15'], uc)
+    deleted = main.delete_users(['ckayx15', 'bbq15', 'ckayx15'], uc)
+
+    assert updated == [True, False, True]
+    assert [user and user['name'] for user in found] == ['Dave', None, 'Shiqi']
+    assert deleted == [True, False, False]
+    assert full_db.status_collection.count_documents({}) == 0
+
+
+def test_bulk_updates_use_write_results(full_db):
+    """
+    Bulk updates take their results from the write instead of reading
+    first; only a batch with a missing ID re-sends its updates one by one
+    """
+    uc = main.init_user_collection(full_db)
+    main.add_user('dave03', 'dave03@gmail.com', 'David', 'Yuen', uc)
+    uc.user_collection = CommandCounter(uc.user_collection)
+
+    assert main.update_users([('ckayx15', 'ckayx15@uw.edu', 'Shiqi', 'Xian'),
+                              ('dave03', 'dave03@uw.edu', 'Dave', 'Yuen')],
+                             uc) == [True, True]
+    assert uc.user_collection.calls == ['bulk_write']
+    uc.user_collection.calls.clear()
+    assert main.update_users([('bbq15', 'bbq15@uw.edu', 'B', 'Q'),
+                              ('dave03', 'dave03@uw.edu', 'Dave', 'Yuen')],
+                             uc) == [False, True]
+    assert uc.user_collection.calls == ['bulk_write', 'update_one',
+                                        'update_one']
+
+
+def test_bulk_status_operations(full_db):
+    """
+    Bulk status update/search/delete return one result per item
+    """
+    sc = main.init_status_collection(full_db)
+    main.add_status('ckayx15', 'ckayx_00002', 'Second', sc)
+    updated = main.update_statuses([('ckayx_00001', 'ckayx15', 'Edited'),
+                                    ('bbq_00001', 'ckayx15', 'Missing')], sc)
+    found = main.search_statuses(['ckayx_00001', 'bbq_00001'], sc)
+    deleted = main.delete_statuses(['ckayx_00002', 'bbq_00001'], sc)
+
+    assert updated == [True, False]
+    assert found[0]['status_text'] == 'Edited' and found[1] is None
+    assert deleted == [True, False]
+    assert len(sc) == 1
+
+
+def test_user_writes_are_single_commands(full_db):
+    """
+    update/delete user issue one command per collection they touch
+    """
+    uc = main.init_user_collection(full_db)
+    uc.user_collection = CommandCounter(uc.user_collection)
+    uc.status_collection = CommandCounter(uc.status_collection)
+
+    assert main.update_user('ckayx15', 'ckayx15@uw.edu', 'Shiqi', 'Xian', uc)
+    assert not main.update_user('bbq15', 'bbq15@uw.edu', 'B', 'Q', uc)
+    assert uc.user_collection.calls == ['update_one', 'update_one']
+
+    uc.user_collection.calls.clear()
+    assert not main.delete_user('bbq15', uc)
+    assert main.delete_user('ckayx15', uc)
+    assert uc.user_collection.calls == ['delete_one', 'delete_one']
+    assert uc.status_collection.calls == ['delete_many']
+    assert full_db.status_collection.count_documents({}) == 0
+
+
+def test_status_writes_are_single_commands(full_db):
+    """
+    update/delete status issue exactly one command each
+    """
+    sc = main.init_status_collection(full_db)
+    sc.status_collection = CommandCounter(sc.status_collection)
+
+    assert main.update_status('ckayx_00001', 'ckayx15', 'Edited', sc)
+    assert not main.update_status('bbq_00001', 'ckayx15', 'Missing', sc)
+    assert main.delete_status('ckayx_00001', sc)
+    assert not main.delete_status('ckayx_00001', sc)
+    assert sc.status_collection.calls == ['update_one', 'update_one',
+                                          'delete_one', 'delete_one']
+
+
 def test_init_status_collection(empty_db):
     '''
     Creates and returns a new instance of UserStatusCollection
@@ -209,6 +1119,120 @@ def test_main_add_status(empty_db):
     assert new_status_main is True
     assert exist_status_main is False
 
+def test_add_statuses_rejects_unknown_users(full_db):
+    """
+    Statuses of non-existing users go to the reject list
+    """
+    sc = main.init_status_collection(full_db)
+    rejects = []
+    status_chunk = [{'_id': 'ckayx_00002', 'user_id': 'ckayx15',
+                     'status_text': 'Known user'},
+                    {'_id': 'bbq_00001', 'user_id': 'bbq15',
+                     'status_text': 'Unknown user'}]
+    added = main.add_statuses(status_chunk, sc, rejects=rejects)
+
+    assert added is True
+    assert [status['_id'] for status in rejects] == ['bbq_00001']
+    assert main.search_status('ckayx_00002', sc) is not None
+    assert main.search_status('bbq_00001', sc) is None
+
+
+def test_bulk_logging(full_db):
+    """
+    In bulk mode successes are not logged, rejects are sampled and the
+    batch summary names every rejected ID
+    """
+    sc = main.init_status_collection(full_db)
+    status_chunk = [{'_id': f'bbq_0000{number}', 'user_id': 'bbq15',
+                     'status_text': 'Unknown user'} for number in range(3)]
+    status_chunk.append({'_id': 'ckayx_00002', 'user_id': 'ckayx15',
+                         'status_text': 'Known user'})
+    messages = []
+    sink = logger.add(messages.append, format='{message}')
+    try:
+        with logs.bulk('test_bulk', sample_first=1) as log:
+            main.add_statuses(status_chunk, sc)
+            main.add_status('ckayx15', 'ckayx_00003', 'Quiet', sc)
+            log.batch(5, 2)
+    finally:
+        logger.remove(sink)
+
+    assert log.rejects == {'unknown user': 3}
+    assert not any('successfully' in message for message in messages)
+    assert sum('bbq_' in message and 'so far' in message
+               for message in messages) == 1
+    assert messages[-1].strip() == (
+        'test_bulk: 5 read, 2 inserted, 3 rejected '
+        '(unknown user: bbq_00000, bbq_00001, bbq_00002)')
+
+
+def test_memory_store_cascade_delete():
+    """
+    The in-memory engine serves CRUD and the user cascade delete
+    """
+    database = memory_store.MemoryClient().test_main
+    uc = main.init_user_collection(database)
+    sc = main.init_status_collection(database)
+    main.add_user('ckayx15', 'ckayx15@uw.edu', 'Kay', 'Xian', uc)
+    main.add_user('dave03', 'david.yuen@gmail.com', 'David', 'Yuen', uc)
+    main.add_status('ckayx15', 'ckayx_00001', 'First', sc)
+    main.add_status('ckayx15', 'ckayx_00002', 'Second', sc)
+    main.add_status('dave03', 'dave03_00001', 'Other user', sc)
+
+    assert database.status_collection.count_documents(
+        {'user_id': 'ckayx15'}) == 2
+    assert main.delete_user('ckayx15', uc) is True
+    assert main.search_status('ckayx_00001', sc) is None
+    assert main.search_status('dave03_00001', sc)['user_id'] == 'dave03'
+    assert len(sc) == 1
+
+
+def test_indexes_serve_user_queries(empty_db):
+    """
+    init_*_collection provisions the indexes and the planner uses them
+    """
+    uc = main.init_user_collection(empty_db)
+    sc = main.init_status_collection(empty_db)
+
+    assert uc.index_report('ckayx15', 'ckayx15@uw.edu') == {
+        'email': True, 'cascade_delete': True}
+    assert sc.index_report('ckayx15') == {'user_statuses': True,
+                                          'timeline': True}
+    assert sc.ensure_indexes() is True
+
+
+def test_add_user_duplicate_email(empty_db):
+    """
+    The unique email index rejects a second account with the same email
+    """
+    uc = main.init_user_collection(empty_db)
+    main.add_user('ckayx15', 'ckayx15@uw.edu', 'Kay', 'Xian', uc)
+
+    with logs.bulk('test_add_user') as log:
+        assert main.add_user('ckayx16', 'ckayx15@uw.edu', 'Kay', 'Xian',
+                             uc) is False
+        assert main.add_user('ckayx15', 'kay@uw.edu', 'Kay', 'Xian',
+                             uc) is False
+    assert log.rejects == {'duplicate email': 1, 'duplicate': 1}
+
+
+def test_update_user_duplicate_email(empty_db):
+    """
+    Updates that would share an email fail instead of raising, and the
+    user collection alone provisions the index of the cascade delete
+    """
+    uc = main.init_user_collection(empty_db)
+    main.add_user('ckayx15', 'ckayx15@uw.edu', 'Kay', 'Xian', uc)
+    main.add_user('dave03', 'dave03@gmail.com', 'David', 'Yuen', uc)
+
+    assert main.update_user('dave03', 'ckayx15@uw.edu', 'David', 'Yuen',
+                            uc) is False
+    assert main.update_users([('dave03', 'ckayx15@uw.edu', 'David', 'Yuen'),
+                              ('ckayx15', 'ckayx15@uw.edu', 'Shiqi', 'Xian')],
+                             uc) == [False, True]
+    assert uc.index_report('ckayx15')['cascade_delete'] is True
+
+
 def test_update_status(empty_db):
     '''
     Updates the values of an existing status_id
@@ -251,3 +1275,55 @@ def test_main_search_status(full_db):
 
     assert search_exist_status['_id'] == 'ckayx_00001'
     assert search_non_exist_status is None
+
+
+def async_client():
+    """
+    An async client over the same server (or in-memory store) as CLIENT
+    """
+    if MEMORY_BACKEND:
+        return memory_store.AsyncMemoryClient(CLIENT)
+    return AsyncMongoClient(**connection.client_options())
+
+
+def test_async_collections(full_db):
+    """
+    The async API keeps the return values of the blocking one
+    """
+    async def scenario():
+        database = async_client().test_main
+        uc = await async_collections.init_user_collection(database)
+        sc = await async_collections.init_status_collection(database)
+        added = await asyncio.gather(
+            uc.add_user('dave03', 'david.yuen@gmail.com', 'David', 'Yuen'),
+            uc.add_user('ckayx15', 'ckayx15@uw.edu', 'Kay', 'Xian'))
+        statuses = await asyncio.gather(
+            sc.add_status('dave03_00001', 'dave03', 'Async status'),
+            sc.add_status('bbq_00001', 'bbq15', 'No such user'))
+        found = await asyncio.gather(uc.search_user('dave03'),
+                                     uc.search_user('bbq15'))
+        return (added, statuses, found, await uc.delete_user('ckayx15'),
+                await sc.count())
+
+    added, statuses, found, deleted, count = asyncio.run(scenario())
+
+    assert added == [True, False]
+    assert statuses == [True, False]
+    assert found[0]['name'] == 'David' and found[1] is None
+    assert deleted is True
+    assert count == 1
+    assert indexes.missing_indexes(UserAccounts(full_db)) == []
+
+
+def test_async_load_users(empty_db):
+    """
+    The async loader keeps several chunks in flight
+    """
+    async def scenario():
+        uc = async_collections.AsyncUserAccounts(async_client().test_main)
+        loaded = await async_collections.load_users('accounts.csv', uc,
+                                                    size=250, concurrency=4)
+        missing = await async_collections.load_users('wrong.csv', uc)
+        return loaded, missing, await uc.count()
+
+    assert asyncio.run(scenario()) == (True, False, 2000)
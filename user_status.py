@@ -7,35 +7,74 @@ classes to manage the user status messages
 # pylint: disable=C0412 # Imports from package pymongo are not grouped (ungrouped-imports)
 
 
+import time
 from loguru import logger
-from pymongo import MongoClient
+from pymongo import DESCENDING
 import pandas as pd
 from pymongo.errors import DuplicateKeyError, BulkWriteError
+import autotune
+import bulk
+import checkpoint
+import connection
+import dedup
+import documents
+import indexes
+import logs
+import metrics
+import paging
+import records
+import sync
 
 
 def start_mongo():
     """
     start up a connection to MongoDB
 
-    :return: a pymongo client object, and a database object
+    :return: the process-wide pymongo client (see connection.get_client)
     """
-    client = MongoClient(host='localhost', port=27017)
-
-    return client
+    return connection.get_client()
 
 
 class StatusUpdates():
     """
     Collection of UserStatus messages
     """
-    def __init__(self, database):
+    # (collection attribute, keys, options) of the indexes this class needs
+    INDEXES = [indexes.STATUS_USER_ID]
+
+    def __init__(self, database, cache=None):
         """
         Initialize a collection called UserAccounts
+
+        cache is an optional cache.LRUCache for search_status, which may be
+        shared with a UserAccounts instance
         """
         self.database = database
         self.status_collection = database['status_collection']
         self.user_collection = database['user_collection']
-        logger.info("New user status collection instance created")
+        self.cache = cache
+        logger.debug("New user status collection instance created")
+
+    def _invalidate(self, status_ids):
+        """
+        Drops cached entries (including cached misses) of status_ids
+        """
+        if self.cache is not None:
+            for status_id in status_ids:
+                self.cache.discard(('status', status_id))
+
+    def _find_status(self, status_id):
+        """
+        find_one by _id, read through the cache when there is one
+        """
+        if self.cache is None:
+            return self.status_collection.find_one({'_id': status_id})
+        found, status = self.cache.get(('status', status_id))
+        if not found:
+            version = self.cache.version()
+            status = self.status_collection.find_one({'_id': status_id})
+            self.cache.put(('status', status_id), status, version)
+        return None if status is None else dict(status)
 
     def __len__(self):
         """
@@ -43,93 +82,397 @@ class StatusUpdates():
         """
         return self.status_collection.count_documents({})
 
-    def add_status_in_chunks(self, filename, size=10000):
+    def ensure_indexes(self):
+        """
+        Creates or verifies the indexes declared in INDEXES
+        """
+        return indexes.ensure_indexes(self)
+
+    def index_report(self, user_id=''):
+        """
+        Whether the planner serves the per-user status query and the
+        timeline pages from an index
+        """
+        return {'user_statuses': indexes.uses_index(self.status_collection,
+                                                    {'user_id': user_id}),
+                'timeline': indexes.uses_index(self.status_collection,
+                                               {'user_id': user_id,
+                                                '_id': {'$lt': '~'}})}
+
+    @metrics.timed
+    def add_status_in_chunks(self, filename, size=None, known_users=None,
+                             rejects=None, progress=None, validator=None,
+                             report=None):
         '''
         Imports CSV file in chunks of a defined size
+
+        size is a number of rows, or an autotune.BatchSizeTuner that picks
+        the size of every chunk; None tunes with the default bounds.
+        With a validation.Validator, only the rows of each chunk that pass
+        validation are inserted. User existence is checked once per chunk
+        (see add_statuses).
+        Statuses whose ID already appeared in the file are skipped, and
+        each chunk is inserted unordered, so IDs already in the collection
+        do not stop the load; report (a dedup.LoadReport) collects the
+        count and IDs of both.
+        Returns False if any status was rejected or failed to insert.
+        With a checkpoint.Checkpoint as progress, chunks committed by an
+        earlier run are skipped (the leading ones without being parsed)
+        and every written chunk is committed.
         '''
-        chunk_number = 0
-        for chunk in pd.read_csv(filename, chunksize=size, iterator=True):
-            # print(f"CHUNK {chunk_number}")
-            # Create an empty list and append chunk of status dicts to it
-            status_chunk = []
-            for index, row in chunk.iterrows():
-                status = {}
-                status['_id'] = row['STATUS_ID']
-                status['user_id'] = row['USER_ID']
-                status['status_text'] = row['STATUS_TEXT']
-                status_chunk.append(status)
-            try:
-                # Use insert_many to import chunk into user_collection
-                self.status_collection.insert_many(status_chunk)
-            except BulkWriteError:
-                return False
-            chunk_number += 1
+        size = autotune.BatchSizeTuner() if size is None else size
+        rejects = [] if rejects is None else rejects
+        report = dedup.LoadReport() if report is None else report
+        start = 0 if progress is None else progress.resume_row()
+        for chunk in autotune.read_chunks(filename, size, start):
+            end = start + len(chunk)
+            if progress is not None and progress.is_done(start, end):
+                start = end
+                continue
+            began = time.perf_counter()
+            status_chunk = report.unique(documents.status_documents(
+                chunk if validator is None else validator.statuses(chunk)))
+            inserted = report.inserted
+            self.add_statuses(status_chunk, known_users, rejects,
+                              report=report)
+            inserted = report.inserted - inserted
+            if isinstance(size, autotune.BatchSizeTuner):
+                size.record(len(chunk), time.perf_counter() - began)
+            if progress is not None:
+                progress.commit(start, end, len(chunk), inserted)
+            logs.batch(len(chunk), inserted, start, end)
+            start = end
+        return not rejects and report.clean()
+
+    def existing_user_ids(self, user_ids):
+        '''
+        Returns the subset of user_ids that exist, using one $in query
+        '''
+        query = {'_id': {'$in': list(set(user_ids))}}
+        return {user['_id']
+                for user in self.user_collection.find(query, {'_id': 1})}
+
+    def load_user_ids(self):
+        '''
+        Returns the set of every user ID, to preload as known_users
+        '''
+        return {user['_id'] for user in self.user_collection.find({}, {'_id': 1})}
+
+    def split_known_users(self, status_chunk, known_users=None):
+        '''
+        Splits a batch of status documents into (accepted, rejected) by
+        whether their user_id exists
+
+        known_users is an optional preloaded set of user IDs; without it
+        the batch is checked with a single $in query.
+        '''
+        if known_users is None:
+            known_users = self.existing_user_ids(
+                status['user_id'] for status in status_chunk)
+        return documents.split_known_users(status_chunk, known_users)
+
+    @metrics.timed
+    def add_statuses(self, status_chunk, known_users=None, rejects=None,
+                     duplicates_ok=False, report=None):
+        '''
+        Insert a chunk of statuses to database
+
+        Statuses of non-existing users are not inserted; they are logged
+        and appended to rejects when a list is given. The insert is
+        unordered, so one failing status does not stop the rest;
+        duplicates_ok treats already existing status IDs as success (used
+        when resuming a load). With a dedup.LoadReport as report, already
+        existing IDs are always accepted and recorded in it.
+        '''
+        accepted = self.accept_known_users(status_chunk, known_users,
+                                           rejects, report)
+        if not accepted:
+            return True
+        try:
+            return self._insert_accepted(accepted, duplicates_ok, report)
+        finally:
+            # After the write, so a concurrent miss cannot be re-cached
+            self._invalidate(status['_id'] for status in accepted)
+
+    def _insert_accepted(self, accepted, duplicates_ok, report):
+        '''
+        The unordered insert of add_statuses; False if a status failed
+        '''
+        if report is not None:
+            failed = report.count('failed')
+            report.insert(self.status_collection, accepted)
+            return report.count('failed') == failed
+        try:
+            # Use insert_many to import chunk into status_collection
+            self.status_collection.insert_many(accepted, ordered=False)
+        except BulkWriteError as err:
+            if duplicates_ok and checkpoint.duplicates_only(err):
+                return True
+            for error in err.details['writeErrors']:
+                logs.reject(error['op']['_id'], logs.write_error_reason(error),
+                            f"status_id: {error['op']['_id']} failed to add")
+            return False
         return True
 
+    def accept_known_users(self, statuses, known_users=None, rejects=None,
+                           report=None):
+        '''
+        The statuses of existing users (see split_known_users); the others
+        are rejected with reject_unknown_users and recorded as rejected in
+        report (a dedup.LoadReport) when one is given
+        '''
+        accepted, rejected = self.split_known_users(statuses, known_users)
+        self.reject_unknown_users(rejected, rejects)
+        if report is not None and rejected:
+            report.add(0, rejected=[status['_id'] for status in rejected])
+        return accepted
+
+    @staticmethod
+    def reject_unknown_users(rejected, rejects=None):
+        '''
+        Logs statuses of non-existing users as rejects and appends them to
+        rejects when a list is given
+        '''
+        for status in rejected:
+            logs.reject(status['_id'], 'unknown user',
+                        f"status_id: {status['_id']} rejected, user ID "
+                        f"{status['user_id']} does not exist")
+        if rejects is not None:
+            rejects.extend(rejected)
+
+    @metrics.timed
+    def sync_statuses(self, filename, size=1000, delete_missing=False,
+                      validator=None):
+        '''
+        Brings the collection in line with a status CSV file, writing only
+        new or changed rows (see sync)
+
+        New or changed statuses of non-existing users are rejected, and so
+        are rows that fail validation when a validation.Validator is given.
+        With delete_missing, statuses that are not in the file (valid or
+        not) are deleted.
+        Returns the counts of inserted, updated, unchanged, deleted,
+        skipped (repeated IDs), rejected and failed statuses.
+        '''
+        counts = sync.new_counts()
+        seen = set()
+        for chunk in pd.read_csv(filename, chunksize=size, iterator=True):
+            seen.update(chunk['STATUS_ID'])
+            rows = len(chunk)
+            if validator is not None:
+                chunk = validator.statuses(chunk)
+                counts['rejected'] += rows - len(chunk)
+            status_chunk = documents.status_documents(chunk)
+            written = sync.write_batch(self.status_collection, status_chunk,
+                                       counts, self.accept_known_users)
+            self._invalidate(written)
+            logs.batch(rows, len(written))
+        if delete_missing:
+            for batch in sync.stale_ids(self.status_collection, seen, size):
+                counts['deleted'] += sum(self.delete_statuses(batch, size))
+        logger.info(f"Synced user statuses from {filename}: {counts}")
+        return counts
+
+    @metrics.timed
     def add_status(self, status_id, user_id, status_text):
         '''
         add a new status message to the collection
         '''
         result = self.user_collection.find_one({'_id': user_id})
         if result:
-            new_status = {'_id': status_id,
-                          'user_id': user_id,
-                          'status_text': status_text}
+            new_status = documents.status_document(status_id, user_id,
+                                                   status_text)
             try:
                 self.status_collection.insert_one(new_status)
             except DuplicateKeyError:
-                print(f"Status ID {status_id} already exists")
-                logger.error("ERROR: Status ID exists. Failed to add new status")
+                if not logs.bulk_mode():
+                    print(f"Status ID {status_id} already exists")
+                logs.reject(status_id, 'duplicate',
+                            "ERROR: Status ID exists. Failed to add new status")
                 return False
-            logger.info("New status added successfully!")
+            self._invalidate([status_id])
+            logs.success("New status added successfully!")
             return True
-        logger.error(
-            "ERROR: User ID does not exist. Failed to add new status "
-            "for non-existing user ID")
+        logs.reject(status_id, 'unknown user',
+                    "ERROR: User ID does not exist. Failed to add new status "
+                    "for non-existing user ID")
         return False
 
+    @metrics.timed
     def modify_status(self, status_id, user_id, status_text):
         '''
         Modifies a status message
 
         The new user_id and status_text are assigned to the existing message
+        with a single update_one; matched_count tells whether it exists.
         '''
-        mongo_query = {'_id': status_id}
-        if self.status_collection.count_documents(mongo_query) > 0:
-            update_status = {'user_id': user_id,
-                             'status_text': status_text}
-            new_values = {"$set": update_status}
-            self.status_collection.update_one(mongo_query, new_values)
+        new_values = documents.status_update(user_id, status_text)
+        result = self.status_collection.update_one({'_id': status_id},
+                                                   new_values)
+        if result.matched_count:
+            self._invalidate([status_id])
             logger.info("Modified user status successfully!")
             return True
         logger.error("ERROR: User status ID doesn't exist. Failed to "
                      "modify user status")
         return False
 
+    @metrics.timed
     def delete_status(self, status_id):
         '''
         deletes the status message with id, status_id
+
+        A single delete_one; deleted_count tells whether it existed.
         '''
-        mongo_query = {'_id': status_id}
-        result = self.status_collection.find_one({'_id': status_id})
-        if result is None:
+        result = self.status_collection.delete_one({'_id': status_id})
+        if not result.deleted_count:
             logger.error("ERROR: Status ID doesn't exist. Failed to delete "
                          "status")
             return False
-        self.status_collection.delete_one(mongo_query)
+        self._invalidate([status_id])
         logger.info(f"User status for {status_id} was deleted")
         return True
 
+    @metrics.timed
     def search_status(self, status_id):
         '''
         Find and return a status message by its status_id
 
-        Returns an empty UserStatus object if status_id does not exist
+        Returns a records.UserStatus, or None if status_id does not exist
         '''
-        status = self.status_collection.find_one({'_id': status_id})
+        status = self._find_status(status_id)
         if status is None:
             print(f"Status ID {status_id} was not found")
             logger.error(f"ERROR: Status ID {status_id} does not exist.")
             return None
         logger.info(f"Status ID {status_id} was found.")
-        return status
+        return records.status(status)
+
+    @metrics.timed
+    def search_statuses(self, status_ids, batch_size=1000):
+        '''
+        Finds many status messages with one $in query per batch
+
+        Returns a list aligned with status_ids holding a
+        records.UserStatus for each status, or None for a status ID that
+        does not exist.
+        '''
+        found = {}
+        pending = list(dict.fromkeys(status_ids))
+        if self.cache is not None:
+            missing = []
+            for status_id in pending:
+                cached, status = self.cache.get(('status', status_id))
+                if cached:
+                    found[status_id] = status
+                else:
+                    missing.append(status_id)
+            pending = missing
+        for batch in documents.batched(pending, batch_size):
+            version = None if self.cache is None else self.cache.version()
+            statuses = {status['_id']: status for status in
+                        self.status_collection.find({'_id': {'$in': batch}})}
+            for status_id in batch:
+                found[status_id] = statuses.get(status_id)
+                if self.cache is not None:
+                    self.cache.put(('status', status_id), found[status_id],
+                                   version)
+        return [records.status(found[status_id]) for status_id in status_ids]
+
+    @metrics.timed
+    def timeline(self, user_id, limit=20, before=None):
+        '''
+        One page of a user's statuses, highest status ID (the newest, for
+        the sequential IDs of the CSV exports) first
+
+        before is the status ID the previous page ended with, None for the
+        first page. Returns (statuses, next_before): up to limit
+        records.UserStatus and the before of the next page, or None on the
+        last page. Pages seek on the (user_id, _id) index instead of
+        skipping, so every page costs the same however many statuses the
+        user has, and only _id and status_text are read. A limit below 1
+        is logged and gives an empty last page.
+        '''
+        if limit < 1:
+            logger.error(f"Timeline limit must be at least 1, got {limit}")
+            return [], None
+        query = {'user_id': user_id}
+        if before is not None:
+            query['_id'] = {'$lt': before}
+        # One extra status tells whether there is a next page
+        page = list(self.status_collection.find(query, {'status_text': 1})
+                    .sort('_id', DESCENDING).limit(limit + 1))
+        statuses = [records.UserStatus(status['_id'], user_id,
+                                       status.get('status_text'))
+                    for status in page[:limit]]
+        return statuses, (statuses[-1].status_id if len(page) > limit
+                          else None)
+
+    def iter_statuses(self, batch_size=1000, projection=None, after=None,
+                      raw=False):
+        '''
+        Yields every status as a records.UserStatus, in status ID order,
+        reading batch_size statuses per query (see paging)
+
+        projection limits the fields read (the others are None); after
+        resumes a scan after that status ID. raw=True yields undecoded
+        RawBSONDocuments instead.
+        '''
+        return paging.stream(self.status_collection, records.status, None,
+                             projection, batch_size, after, raw)
+
+    def iter_statuses_for_user(self, user_id, batch_size=1000,
+                               projection=None, after=None, raw=False):
+        '''
+        Like iter_statuses, for the statuses of one user
+        '''
+        return paging.stream(self.status_collection, records.status,
+                             {'user_id': user_id}, projection, batch_size,
+                             after, raw)
+
+    @metrics.timed
+    def export_statuses(self, filename, batch_size=1000):
+        '''
+        Writes every status to filename as BSON, copying the stored bytes
+        without decoding them (see records.dump); returns the number
+        written
+        '''
+        return records.dump(self.status_collection, filename, batch_size)
+
+    @metrics.timed
+    def modify_statuses(self, changes, batch_size=1000):
+        '''
+        Modifies many status messages with one bulk_write per batch
+
+        changes is a list of (status_id, user_id, status_text). Returns a
+        list of True/False aligned with changes; False means the status ID
+        doesn't exist or the update was rejected.
+        '''
+        results = []
+        for batch in documents.batched(changes, batch_size):
+            batch_results = bulk.update(self.status_collection, [
+                ({'_id': status_id},
+                 documents.status_update(user_id, status_text))
+                for status_id, user_id, status_text in batch])
+            self._invalidate(change[0] for change in batch)
+            logger.info(f"Modified {sum(batch_results)} of {len(batch)} "
+                        f"user statuses")
+            results.extend(batch_results)
+        return results
+
+    @metrics.timed
+    def delete_statuses(self, status_ids, batch_size=1000):
+        '''
+        Deletes many status messages with one bulk_write per batch
+
+        Returns a list of True/False aligned with status_ids; False means
+        the status ID doesn't exist.
+        '''
+        results = []
+        for batch in documents.batched(status_ids, batch_size):
+            batch_results = bulk.delete(self.status_collection, batch)
+            self._invalidate(batch)
+            logger.info(f"Deleted {sum(batch_results)} of {len(batch)} "
+                        f"user statuses")
+            results.extend(batch_results)
+        return results
@@ -6,34 +6,72 @@ Classes for user information for the social network project
 # pylint: disable=R0801 # Similar lines in 2 files
 
 
+import time
 import pandas as pd
 from loguru import logger
-from pymongo import MongoClient
 from pymongo.errors import DuplicateKeyError, BulkWriteError
+import autotune
+import bulk
+import connection
+import dedup
+import documents
+import indexes
+import logs
+import metrics
+import paging
+import records
+import sync
 
 
 def start_mongo():
     """
     start up a connection to MongoDB
 
-    :return: a pymongo client object, and a database object
+    :return: the process-wide pymongo client (see connection.get_client)
     """
-    client = MongoClient(host='localhost', port=27017)
-
-    return client
+    return connection.get_client()
 
 
 class UserAccounts():
     """
     a collection to hold user accounts
     """
-    def __init__(self,database):
+    # (collection attribute, keys, options) of the indexes this class needs;
+    # delete_user's cascade needs the status index too
+    INDEXES = [indexes.USER_EMAIL, indexes.STATUS_USER_ID]
+
+    def __init__(self, database, cache=None):
         """
         Initialize a collection called UserAccounts
+
+        cache is an optional cache.LRUCache for search_user, which may be
+        shared with a StatusUpdates instance
         """
         self.database = database
         self.user_collection = database['user_collection']
         self.status_collection = database['status_collection']
+        self.cache = cache
+
+    def _invalidate(self, user_ids):
+        """
+        Drops cached entries (including cached misses) of user_ids
+        """
+        if self.cache is not None:
+            for user_id in user_ids:
+                self.cache.discard(('user', user_id))
+
+    def _find_user(self, user_id):
+        """
+        find_one by _id, read through the cache when there is one
+        """
+        if self.cache is None:
+            return self.user_collection.find_one({'_id': user_id})
+        found, user = self.cache.get(('user', user_id))
+        if not found:
+            version = self.cache.version()
+            user = self.user_collection.find_one({'_id': user_id})
+            self.cache.put(('user', user_id), user, version)
+        return None if user is None else dict(user)
 
     def __len__(self):
         """
@@ -41,6 +79,23 @@ class UserAccounts():
         """
         return self.user_collection.count_documents({})
 
+    def ensure_indexes(self):
+        """
+        Creates or verifies the indexes declared in INDEXES
+        """
+        return indexes.ensure_indexes(self)
+
+    def index_report(self, user_id='', email=''):
+        """
+        Whether the planner serves the user queries from an index:
+        the email lookup and the status cascade of delete_user
+        """
+        return {'email': indexes.uses_index(self.user_collection,
+                                            {'email': email}),
+                'cascade_delete': indexes.uses_index(self.status_collection,
+                                                     {'user_id': user_id})}
+
+    @metrics.timed
     def add_users(self, user_chunk):
         """
         Insert a chunk of users to database
@@ -51,94 +106,259 @@ class UserAccounts():
         except BulkWriteError as err:
             details = err.details
             for error in details['writeErrors']:
-                logger.error(f"user_id: {error['keyValue']['_id']} failed to add")
+                logs.reject(error['op']['_id'], logs.write_error_reason(error),
+                            f"user_id: {error['op']['_id']} failed to add")
             return False
+        finally:
+            # After the write, so a concurrent miss cannot be re-cached
+            self._invalidate(user['_id'] for user in user_chunk)
 
-    def add_user_in_chunks(self, filename, size=100):
+    @metrics.timed
+    def add_user_in_chunks(self, filename, size=None, progress=None,
+                           validator=None, report=None):
         '''
         Imports CSV file in chunks of a defined size
+
+        size is a number of rows, or an autotune.BatchSizeTuner that picks
+        the size of every chunk; None tunes with the default bounds.
+        With a validation.Validator, only the rows of each chunk that pass
+        validation are inserted.
+        Users whose ID already appeared in the file are skipped, and each
+        chunk is inserted unordered, so IDs already in the collection do
+        not stop the load; report (a dedup.LoadReport) collects the count
+        and IDs of both. Returns False if any other write failed.
+        With a checkpoint.Checkpoint as progress, chunks committed by an
+        earlier run are skipped (the leading ones without being parsed)
+        and every written chunk is committed.
+        '''
+        size = autotune.BatchSizeTuner() if size is None else size
+        report = dedup.LoadReport() if report is None else report
+        start = 0 if progress is None else progress.resume_row()
+        for chunk in autotune.read_chunks(filename, size, start):
+            end = start + len(chunk)
+            if progress is not None and progress.is_done(start, end):
+                start = end
+                continue
+            began = time.perf_counter()
+            user_chunk = report.unique(documents.user_documents(
+                chunk if validator is None else validator.users(chunk)))
+            # Use insert_many to import chunk into user_collection
+            inserted = report.insert(self.user_collection, user_chunk)
+            self._invalidate(user['_id'] for user in user_chunk)
+            if isinstance(size, autotune.BatchSizeTuner):
+                size.record(len(chunk), time.perf_counter() - began)
+            if progress is not None:
+                progress.commit(start, end, len(chunk), inserted)
+            logs.batch(len(chunk), inserted, start, end)
+            start = end
+        return report.clean()
+
+    @metrics.timed
+    def sync_users(self, filename, size=1000, delete_missing=False,
+                   validator=None):
         '''
-        chunk_number = 0
+        Brings the collection in line with a user CSV file, writing only
+        new or changed rows (see sync)
+
+        With a validation.Validator, rows that fail validation are not
+        written and count as rejected. With delete_missing, users that are
+        not in the file (valid or not) are deleted with their statuses. Returns the counts of inserted, updated,
+        unchanged, deleted, skipped (repeated IDs), rejected and failed
+        users.
+        '''
+        counts = sync.new_counts()
+        seen = set()
         for chunk in pd.read_csv(filename, chunksize=size, iterator=True):
-            # print(f"CHUNK {chunk_number}")
-            # Create an empty list and append chunk of user dicts to it
-            user_chunk = []
-            for index, row in chunk.iterrows():
-                user = {}
-                user['_id'] = row['USER_ID']
-                user['email'] = row['EMAIL']
-                user['name'] = row['NAME']
-                user['last_name'] = row['LASTNAME']
-                user_chunk.append(user)
-            try:
-                # Use insert_many to import chunk into user_collection
-                self.user_collection.insert_many(user_chunk, ordered=False)
-            except BulkWriteError as err:
-                details = err.details
-                for error in details['writeErrors']:
-                    logger.error(
-                        f"user_id: {error['keyValue']['_id']} failed to add")
-                return False
-            chunk_number += 1
-        return True
+            seen.update(chunk['USER_ID'])
+            rows = len(chunk)
+            if validator is not None:
+                chunk = validator.users(chunk)
+                counts['rejected'] += rows - len(chunk)
+            user_chunk = documents.user_documents(chunk)
+            written = sync.write_batch(self.user_collection, user_chunk,
+                                       counts)
+            self._invalidate(written)
+            logs.batch(rows, len(written))
+        if delete_missing:
+            for batch in sync.stale_ids(self.user_collection, seen, size):
+                counts['deleted'] += sum(self.delete_users(batch, size))
+        logger.info(f"Synced users from {filename}: {counts}")
+        return counts
 
+    @metrics.timed
     def add_user(self, user_id, email, user_name, user_last_name):
         '''
         Adds a new user to the collection
         '''
-        new_user = {'_id': user_id,
-                    'email': email,
-                    'name': user_name,
-                    'last_name': user_last_name
-                    }
+        new_user = documents.user_document(user_id, email, user_name,
+                                           user_last_name)
         try:
             self.user_collection.insert_one(new_user)
-        except DuplicateKeyError:
-            print(f"User ID {user_id} already exists")
-            logger.error(f"Failed to add an existing user {user_id}")
+        except DuplicateKeyError as err:
+            reason = logs.duplicate_reason(err.details or {})
+            if reason == 'duplicate':
+                message = f"User ID {user_id} already exists"
+                failure = f"Failed to add an existing user {user_id}"
+            else:
+                message = f"Email {email} belongs to another user"
+                failure = f"{message}. Failed to add user {user_id}"
+            if not logs.bulk_mode():
+                print(message)
+            logs.reject(user_id, reason, failure)
             return False
+        self._invalidate([user_id])
         return True
 
+    @metrics.timed
     def modify_user(self, user_id, email, user_name, user_last_name):
         '''
         Modifies an existing user
+
+        A single update_one; its matched_count tells whether the user
+        exists, so there is no separate existence check.
         '''
-        mongo_query = {'_id': user_id}
-        if self.user_collection.count_documents(mongo_query) > 0:
-            updated_user_data = {
-                'email': email,
-                'name': user_name,
-                'last_name': user_last_name
-            }
-            new_values = {"$set": updated_user_data}
-            self.user_collection.update_one(mongo_query, new_values)
+        new_values = documents.user_update(email, user_name, user_last_name)
+        try:
+            result = self.user_collection.update_one({'_id': user_id},
+                                                     new_values)
+        except DuplicateKeyError:
+            logger.error(f"Email {email} belongs to another user. Failed to "
+                         f"update user {user_id}.")
+            return False
+        if result.matched_count:
+            self._invalidate([user_id])
             logger.info("User information updated successfully!")
             return True
         logger.error("User ID doesn't exist. Failed to update user.")
         return False
 
+    @metrics.timed
     def delete_user(self, user_id):
         '''
         Deletes an existing user
+
+        The user's statuses are deleted only when delete_one reports that
+        the user existed.
         '''
-        mongo_query = {'_id': user_id}
-        result = self.user_collection.find_one({'_id': user_id})
-        if result:
-            mongo_query_status = {'user_id': user_id}
-            self.status_collection.delete_many(mongo_query_status)
-            self.user_collection.delete_one(mongo_query)
+        result = self.user_collection.delete_one({'_id': user_id})
+        if result.deleted_count:
+            self.status_collection.delete_many({'user_id': user_id})
+            self._invalidate([user_id])
+            if self.cache is not None:
+                self.cache.discard_where(
+                    lambda key, status: key[0] == 'status' and status
+                    is not None and status['user_id'] == user_id)
             logger.info(f"User {user_id} was deleted.")
             return True
         logger.error("ERROR: User ID doesn't exist. Failed to delete user.")
         return False
 
+    @metrics.timed
     def search_user(self, user_id):
         '''
-        Searches for user data
+        Searches for user data; returns a records.User or None
         '''
-        user = self.user_collection.find_one({'_id': user_id})
+        user = self._find_user(user_id)
         if user is None:
             logger.error("ERROR: User ID doesn't exist.")
             return None
         logger.info(f"User ID {user_id} was found.")
-        return user
+        return records.user(user)
+
+    @metrics.timed
+    def search_users(self, user_ids, batch_size=1000):
+        '''
+        Searches for many users with one $in query per batch
+
+        Returns a list aligned with user_ids holding a records.User for
+        each user, or None for a user ID that doesn't exist.
+        '''
+        found = {}
+        pending = list(dict.fromkeys(user_ids))
+        if self.cache is not None:
+            missing = []
+            for user_id in pending:
+                cached, user = self.cache.get(('user', user_id))
+                if cached:
+                    found[user_id] = user
+                else:
+                    missing.append(user_id)
+            pending = missing
+        for batch in documents.batched(pending, batch_size):
+            version = None if self.cache is None else self.cache.version()
+            users = {user['_id']: user for user in
+                     self.user_collection.find({'_id': {'$in': batch}})}
+            for user_id in batch:
+                found[user_id] = users.get(user_id)
+                if self.cache is not None:
+                    self.cache.put(('user', user_id), found[user_id],
+                                   version)
+        return [records.user(found[user_id]) for user_id in user_ids]
+
+    def iter_users(self, batch_size=1000, projection=None, after=None,
+                   raw=False):
+        '''
+        Yields every user as a records.User, in user ID order, reading
+        batch_size users per query (see paging)
+
+        projection limits the fields read (the others are None); after
+        resumes a scan after that user ID. raw=True yields undecoded
+        RawBSONDocuments instead.
+        '''
+        return paging.stream(self.user_collection, records.user, None,
+                             projection, batch_size, after, raw)
+
+    @metrics.timed
+    def export_users(self, filename, batch_size=1000):
+        '''
+        Writes every user to filename as BSON, copying the stored bytes
+        without decoding them (see records.dump); returns the number
+        written
+        '''
+        return records.dump(self.user_collection, filename, batch_size)
+
+    @metrics.timed
+    def modify_users(self, changes, batch_size=1000):
+        '''
+        Modifies many existing users with one bulk_write per batch
+
+        changes is a list of (user_id, email, user_name, user_last_name).
+        Returns a list of True/False aligned with changes; False means the
+        user ID doesn't exist or the update was rejected.
+        '''
+        results = []
+        for batch in documents.batched(changes, batch_size):
+            batch_results = bulk.update(self.user_collection, [
+                ({'_id': user_id},
+                 documents.user_update(email, user_name, user_last_name))
+                for user_id, email, user_name, user_last_name in batch])
+            self._invalidate(change[0] for change in batch)
+            logger.info(f"Updated {sum(batch_results)} of {len(batch)} users")
+            results.extend(batch_results)
+        return results
+
+    @metrics.timed
+    def delete_users(self, user_ids, batch_size=1000):
+        '''
+        Deletes many existing users, and their statuses, with one
+        bulk_write per batch
+
+        Returns a list of True/False aligned with user_ids; False means the
+        user ID doesn't exist.
+        '''
+        results = []
+        for batch in documents.batched(user_ids, batch_size):
+            batch_results = bulk.delete(self.user_collection, batch)
+            deleted = {user_id for user_id, result in zip(batch, batch_results)
+                       if result}
+            if deleted:
+                self.status_collection.delete_many(
+                    {'user_id': {'$in': list(deleted)}})
+            self._invalidate(batch)
+            if self.cache is not None:
+                self.cache.discard_where(
+                    lambda key, status, deleted=deleted: key[0] == 'status'
+                    and status is not None and status['user_id'] in deleted)
+            logger.info(f"Deleted {len(deleted)} of {len(batch)} users")
+            results.extend(batch_results)
+        return results
@@ -0,0 +1,163 @@
+'''
+Column-wise validation of CSV chunks before they are inserted
+
+Each check is one vectorized pandas operation over a whole chunk, so
+validating costs a few operations per column rather than a Python loop
+per row:
+
+- a required field is empty (missing USER_ID, ...)
+- EMAIL is not of the form name@domain.tld (malformed EMAIL)
+- USER_ID is not the part of EMAIL before the @ (USER_ID does not match
+  EMAIL)
+- STATUS_TEXT is longer than MAX_STATUS_TEXT (oversized STATUS_TEXT)
+
+    validator = validation.Validator('accounts.csv')
+    clean = validator.users(chunk)     # the rows that passed, as a chunk
+
+The rows that fail go to a rejects CSV next to the input file
+(accounts.csv.rejects.csv), with the original columns and a REASON
+column listing every failed check:
+
+    USER_ID,NAME,LASTNAME,EMAIL,REASON
+    Angy.Piselli51,Angy,,Angy.Piselli51@xmail.com,missing LASTNAME
+'''
+# pylint: disable=E0401
+
+import os
+import threading
+import pandas as pd
+import documents
+import logs
+
+# Longest STATUS_TEXT accepted, in characters
+MAX_STATUS_TEXT = 1000
+
+# One @ and a dotted domain; the local part may hold spaces, as some of
+# the exported accounts do
+EMAIL_PATTERN = r'[^@]+@[^@\s]+\.[^@\s]+'
+
+REASON = 'REASON'
+
+
+def _text(chunk, column):
+    '''
+    A column as stripped strings, with missing values as ''
+    '''
+    return chunk[column].fillna('').astype(str).str.strip()
+
+
+def _failures(chunk, fields, checks):
+    '''
+    Boolean frame of failed checks: one column per reason, one row per row
+    '''
+    failures = {f"missing {column}": _text(chunk, column) == ''
+                for column in fields}
+    failures.update(checks)
+    return pd.DataFrame(failures, index=chunk.index)
+
+
+def user_failures(chunk):
+    '''
+    The failed checks of every row of a user chunk
+    '''
+    user_id = _text(chunk, 'USER_ID')
+    email = _text(chunk, 'EMAIL')
+    malformed = ~email.str.fullmatch(EMAIL_PATTERN) & (email != '')
+    mismatch = ((email.str.partition('@')[0] != user_id)
+                & (email != '') & (user_id != '') & ~malformed)
+    return _failures(chunk, documents.USER_FIELDS, {
+        'malformed EMAIL': malformed,
+        'USER_ID does not match EMAIL': mismatch})
+
+
+def status_failures(chunk):
+    '''
+    The failed checks of every row of a status chunk
+    '''
+    text = chunk['STATUS_TEXT'].fillna('').astype(str)
+    return _failures(chunk, documents.STATUS_FIELDS, {
+        'oversized STATUS_TEXT': text.str.len() > MAX_STATUS_TEXT})
+
+
+class Validator():
+    '''
+    Validates the chunks of one input file and writes its rejects CSV
+
+    A new (not resumed) load starts a new rejects file; a resumed one
+    appends to it. The file is only created once a row is rejected.
+    Safe to share between threads.
+    '''
+    def __init__(self, filename, resume=False, path=None):
+        self.path = path or f"{filename}.rejects.csv"
+        self.rows = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        if not resume and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def users(self, chunk):
+        '''
+        The rows of a user chunk that pass validation
+        '''
+        chunk = self._frame(chunk, documents.USER_FIELDS)
+        return self._split(chunk, user_failures(chunk), 'USER_ID')
+
+    def statuses(self, chunk):
+        '''
+        The rows of a status chunk that pass validation
+        '''
+        chunk = self._frame(chunk, documents.STATUS_FIELDS)
+        return self._split(chunk, status_failures(chunk), 'STATUS_ID')
+
+    def user_documents(self, chunk):
+        '''
+        documents.user_documents of the rows that pass validation
+        '''
+        return documents.user_documents(self.users(chunk))
+
+    def status_documents(self, chunk):
+        '''
+        documents.status_documents of the rows that pass validation
+        '''
+        return documents.status_documents(self.statuses(chunk))
+
+    @staticmethod
+    def _frame(chunk, fields):
+        '''
+        chunk (a DataFrame or a list of row dicts) with every field column
+        '''
+        chunk = chunk if isinstance(chunk, pd.DataFrame) \
+            else pd.DataFrame(chunk)
+        missing = [column for column in fields if column not in chunk]
+        return chunk.reindex(columns=[*chunk.columns, *missing]) \
+            if missing else chunk
+
+    def _split(self, chunk, failures, id_column):
+        bad = failures.any(axis=1)
+        with self._lock:
+            self.rows += len(chunk)
+        if not bad.any():
+            return chunk
+        rejects = chunk[bad].copy()
+        # Joins the names of the failed checks of each row
+        rejects[REASON] = (failures[bad].dot(failures.columns + '; ')
+                           .str.rstrip('; '))
+        for record_id, reason in zip(rejects[id_column], rejects[REASON]):
+            logs.reject(record_id, reason)
+        self._write(rejects)
+        return chunk[~bad]
+
+    def _write(self, rejects):
+        with self._lock:
+            new = not os.path.exists(self.path)
+            rejects.to_csv(self.path, mode='w' if new else 'a', header=new,
+                           index=False)
+            self.rejected += len(rejects)
+
+    def report(self):
+        '''
+        Rows validated and rejected so far, and where the rejects went
+        '''
+        with self._lock:
+            return {'rows': self.rows, 'rejected': self.rejected,
+                    'rejects_file': self.path if self.rejected else None}